@@ -1,6 +1,7 @@
 
 
 import os
+import socket
 from dotenv import load_dotenv
 
 dotenv_path = os.getenv("DOTENV_PATH")
@@ -53,6 +54,96 @@ INSTA_COOKIES = os.getenv("INSTA_COOKIES", INST_COOKIES)
 FREEMIUM_LIMIT = int(os.getenv("FREEMIUM_LIMIT", "69"))
 PREMIUM_LIMIT  = int(os.getenv("PREMIUM_LIMIT", "500000"))
 FREE_BATCH_DAILY_LIMIT = int(os.getenv("FREE_BATCH_DAILY_LIMIT", "5"))
+
+# ─── BATCH PIPELINE ─────────────────────────────────────────────────────────────
+BATCH_FETCH_WORKERS    = int(os.getenv("BATCH_FETCH_WORKERS", "1"))
+BATCH_DOWNLOAD_WORKERS = int(os.getenv("BATCH_DOWNLOAD_WORKERS", "3"))
+BATCH_UPLOAD_WORKERS   = int(os.getenv("BATCH_UPLOAD_WORKERS", "2"))
+BATCH_QUEUE_SIZE       = int(os.getenv("BATCH_QUEUE_SIZE", "4"))  # items buffered between stages
+BATCH_PREFETCH_CHUNK   = int(os.getenv("BATCH_PREFETCH_CHUNK", "200"))  # message ids per get_messages RPC (max 200)
+BATCH_AUTO_RESUME      = os.getenv("BATCH_AUTO_RESUME", "false").lower() in ("1", "true", "yes")  # else ask with a button
+BATCH_CHECKPOINT_EVERY = int(os.getenv("BATCH_CHECKPOINT_EVERY", "5"))  # seconds between checkpoint writes
+
+# ─── PER-USER CLIENT POOLS (user bots and login sessions) ───────────────────────
+CLIENT_POOL_SIZE     = int(os.getenv("CLIENT_POOL_SIZE", "200"))  # started clients kept per pool
+CLIENT_IDLE_TTL      = int(os.getenv("CLIENT_IDLE_TTL", "1800"))  # seconds unused before a client is stopped
+CLIENT_HEALTH_EVERY  = int(os.getenv("CLIENT_HEALTH_EVERY", "300"))  # seconds between liveness checks
+
+PEER_SCAN_LIMIT      = int(os.getenv("PEER_SCAN_LIMIT", "500"))  # dialogs walked when a chat is not in the peer cache
+
+# ─── ADAPTIVE PACING (sends per second, per client and per target chat) ────────
+PACE_START_RATE      = float(os.getenv("PACE_START_RATE", "0.5"))
+PACE_MIN_RATE        = float(os.getenv("PACE_MIN_RATE", "0.05"))
+PACE_CHAT_MAX_RATE   = float(os.getenv("PACE_CHAT_MAX_RATE", "1"))
+PACE_CLIENT_MAX_RATE = float(os.getenv("PACE_CLIENT_MAX_RATE", "20"))
+PACE_BURST           = float(os.getenv("PACE_BURST", "3"))
+PACE_RAMP_AFTER      = int(os.getenv("PACE_RAMP_AFTER", "10"))  # clean sends before the rate goes up
+RPC_FLOOD_RETRIES    = int(os.getenv("RPC_FLOOD_RETRIES", "3"))  # retries of a call after its FloodWait
+
+# ─── STREAMING TRANSFERS ────────────────────────────────────────────────────────
+STREAM_TRANSFER      = os.getenv("STREAM_TRANSFER", "true").lower() in ("1", "true", "yes")  # pipe download into upload
+STREAM_BUFFER_CHUNKS = int(os.getenv("STREAM_BUFFER_CHUNKS", "8"))  # 1 MB chunks buffered between the two
+INMEMORY_MAX_SIZE    = int(os.getenv("INMEMORY_MAX_SIZE", str(20 * 1024 * 1024)))  # smaller media never touches disk
+DOWNLOAD_CONNECTIONS = int(os.getenv("DOWNLOAD_CONNECTIONS", "4"))  # ranges of one file fetched at once (max)
+DOWNLOAD_RANGE_MB    = int(os.getenv("DOWNLOAD_RANGE_MB", "4"))  # size of each range
+PARALLEL_MIN_SIZE    = int(os.getenv("PARALLEL_MIN_SIZE", str(32 * 1024 * 1024)))  # smaller files download sequentially
+UPLOAD_PARTS_IN_FLIGHT = int(os.getenv("UPLOAD_PARTS_IN_FLIGHT", "4"))  # 512 KB parts of one upload sent at once
+UPLOAD_PART_RETRIES  = int(os.getenv("UPLOAD_PART_RETRIES", "3"))  # attempts per part before the upload fails
+FILE_CACHE_MIRROR    = os.getenv("FILE_CACHE_MIRROR", "true").lower() in ("1", "true", "yes")  # keep a LOG_GROUP copy of each upload
+FILE_CACHE_TTL_DAYS  = float(os.getenv("FILE_CACHE_TTL_DAYS", "30"))  # delivered files remembered this long after last use; 0 = no expiry
+FILE_CACHE_MAX_ENTRIES = int(os.getenv("FILE_CACHE_MAX_ENTRIES", "50000"))  # least recently used entries forgotten beyond this; 0 = no limit
+
+# ─── MEDIA PROBING ──────────────────────────────────────────────────────────────
+PROBE_WORKERS        = int(os.getenv("PROBE_WORKERS", "4"))  # ffprobe runs in flight at once
+PROBE_CACHE_SIZE     = int(os.getenv("PROBE_CACHE_SIZE", "512"))  # probed files remembered by path/inode/mtime
+PROBE_TIMEOUT        = float(os.getenv("PROBE_TIMEOUT", "30"))  # seconds before a probe is given up
+
+# ─── MEDIA JOBS (ffmpeg / ffprobe child processes) ─────────────────────────────
+MEDIA_JOB_WORKERS    = int(os.getenv("MEDIA_JOB_WORKERS", "0"))  # processes at once; 0 = CPU count - 1
+MEDIA_JOB_NICE       = int(os.getenv("MEDIA_JOB_NICE", "10"))  # niceness added to every child
+MEDIA_JOB_IONICE     = os.getenv("MEDIA_JOB_IONICE", "true").lower() in ("1", "true", "yes")  # idle I/O class for children
+MEDIA_JOB_TIMEOUT    = float(os.getenv("MEDIA_JOB_TIMEOUT", "900"))  # seconds before a job is killed (transcodes)
+MEDIA_JOB_RESERVED   = int(os.getenv("MEDIA_JOB_RESERVED", "1"))  # slots transcodes may not take (probes, thumbnails)
+
+# ─── YT-DLP PROCESSES (extraction and downloads off the event loop) ────────────
+YTDL_PROCESS_WORKERS   = int(os.getenv("YTDL_PROCESS_WORKERS", "2"))  # yt-dlp worker processes; more requests wait
+YTDL_TIMEOUT           = float(os.getenv("YTDL_TIMEOUT", "3600"))  # seconds before a request's process is killed
+YTDL_INFO_TTL          = float(os.getenv("YTDL_INFO_TTL", "600"))  # seconds an extracted info dict is reused
+YTDL_INFO_CACHE_SIZE   = int(os.getenv("YTDL_INFO_CACHE_SIZE", "32"))  # info dicts kept (a YouTube one is a few MB)
+YTDL_CACHE_TTL_HOURS   = float(os.getenv("YTDL_CACHE_TTL_HOURS", "72"))  # uploaded /dl, /adl results resent this long; 0 = off
+YTDL_CACHE_MAX_ENTRIES = int(os.getenv("YTDL_CACHE_MAX_ENTRIES", "5000"))  # oldest uploads forgotten beyond this
+
+# ─── JOB WORKSPACES ─────────────────────────────────────────────────────────────
+WORKSPACE_ROOT       = os.getenv("WORKSPACE_ROOT", "workspaces")  # one directory per job, removed when it ends
+WORKSPACE_TMPFS      = os.getenv("WORKSPACE_TMPFS", "true").lower() in ("1", "true", "yes")  # small jobs on /dev/shm
+WORKSPACE_TMPFS_MAX  = int(os.getenv("WORKSPACE_TMPFS_MAX", str(256 * 1024 * 1024)))  # largest file put on tmpfs
+
+# ─── ADMISSION CONTROL (checked before every download) ─────────────────────────
+ADMISSION_MAX_TRANSFERS = int(os.getenv("ADMISSION_MAX_TRANSFERS", "8"))  # downloads/streams held at once
+ADMISSION_DISK_FREE_MB  = int(os.getenv("ADMISSION_DISK_FREE_MB", "1024"))  # disk always left free
+ADMISSION_MEM_FREE_MB   = int(os.getenv("ADMISSION_MEM_FREE_MB", "512"))  # memory always left available
+ADMISSION_POLL          = float(os.getenv("ADMISSION_POLL", "5"))  # seconds between re-checks while waiting
+
+# ─── FAIR SCHEDULING (downloads across users) ──────────────────────────────────
+SCHED_SLOTS            = int(os.getenv("SCHED_SLOTS", "6"))  # transfers running at once, all users together
+SCHED_PREMIUM_WEIGHT   = float(os.getenv("SCHED_PREMIUM_WEIGHT", "4"))  # premium share vs a free user's
+SCHED_PREMIUM_USER_CAP = int(os.getenv("SCHED_PREMIUM_USER_CAP", "3"))  # slots one premium user may hold
+SCHED_FREE_USER_CAP    = int(os.getenv("SCHED_FREE_USER_CAP", "1"))  # slots one free user may hold
+SCHED_STARVE_SEC       = float(os.getenv("SCHED_STARVE_SEC", "60"))  # a free item waiting this long goes next
+
+# ─── JOB QUEUE (batches, /single and yt-dlp run off the update handlers) ───────
+JOB_WORKERS          = int(os.getenv("JOB_WORKERS", "8"))  # batches running at once; the rest wait in order
+JOB_SINGLE_WORKERS   = int(os.getenv("JOB_SINGLE_WORKERS", "4"))  # /single jobs at once, never behind batches
+JOB_YTDL_WORKERS     = int(os.getenv("JOB_YTDL_WORKERS", "4"))  # /dl and /adl jobs at once, never behind batches
+
+# ─── NODES (one frontend, N workers sharing MongoDB) ────────────────────────────
+NODE_ROLE            = os.getenv("NODE_ROLE", "all").lower()  # all | frontend (updates only) | worker (jobs only)
+NODE_ID              = os.getenv("NODE_ID", f"{socket.gethostname()}-{os.getpid()}")
+JOB_STORE            = "mongo" if NODE_ROLE != "all" else os.getenv("JOB_STORE", "memory").lower()  # memory | mongo
+JOB_LEASE_SEC        = int(os.getenv("JOB_LEASE_SEC", "60"))       # a job/lock not renewed for this long is taken over
+JOB_HEARTBEAT_SEC    = int(os.getenv("JOB_HEARTBEAT_SEC", "15"))   # how often a running job renews its lease
+JOB_POLL_SEC         = float(os.getenv("JOB_POLL_SEC", "2"))       # idle worker polls for new jobs this often
+
 # ─── UI / LINKS ─────────────────────────────────────────────────────────────────
 JOIN_LINK     = os.getenv("JOIN_LINK", "https://t.me/az_bots_solution")
 ADMIN_CONTACT = os.getenv("ADMIN_CONTACT", "https://t.me/eurnyme")
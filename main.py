@@ -4,48 +4,48 @@ from shared_client import start_client, app
 import importlib
 import os
 import sys
-from utils.func import cleanup_temp_images
+from utils.workspace import WORKSPACES
+from utils.job_queue import JOBS
+from utils.leases import USER_LEASES
 from pyrogram.errors import FloodWait
 
 
 async def reset_active_batches_on_start():
-    # Stop all running/pending/ytdl tasks on restart and notify users.
+    # Batches with a checkpoint are offered a resume; everything else
+    # (pending steps, ytdl tasks) is reset and the user is notified.
     try:
         from plugins import batch as batch_mod
         from plugins import ytdl as ytdl_mod
+        from utils.func import get_batch_checkpoints
     except Exception:
         return
 
+    checkpoints = await get_batch_checkpoints()
+    resumable = {str(cp.get("user_id")) for cp in checkpoints}
+
     active_ids = list(batch_mod.ACTIVE_USERS.keys())
     pending_ids = list(batch_mod.Z.keys())
     ytdl_ids = list(ytdl_mod.ongoing_downloads.keys())
-    notify_ids = set(active_ids) | set(pending_ids) | set(ytdl_ids)
-    if not notify_ids:
-        return
-
-    # Mark cancel requested and clear runtime states
-    for uid_str in active_ids:
-        try:
-            batch_mod.ACTIVE_USERS[str(uid_str)]["cancel_requested"] = True
-        except Exception:
-            pass
-
-    try:
-        await batch_mod.save_active_users_to_file()
-    except Exception:
-        pass
+    notify_ids = {str(x) for x in set(active_ids) | set(pending_ids) | set(ytdl_ids)} - resumable
 
+    # Clear runtime states of the previous process
     batch_mod.Z.clear()
     batch_mod.P.clear()
     batch_mod.PROCESSED_KEYS.clear()
-    batch_mod.USER_LOCKS.clear()
+    USER_LEASES.clear()
 
     try:
         ytdl_mod.ongoing_downloads.clear()
     except Exception:
         pass
 
-    # Notify users with active/pending/ytdl tasks
+    try:
+        batch_mod.ACTIVE_USERS.clear()
+        await batch_mod.save_active_users_to_file()
+    except Exception:
+        pass
+
+    # Notify users with active/pending/ytdl tasks that cannot be resumed
     notify_text = "⚠️ Bot restarted. Your task has been reset. Please retry."
     for uid_str in notify_ids:
         try:
@@ -59,16 +59,27 @@ async def reset_active_batches_on_start():
         except Exception:
             pass
 
-    try:
-        batch_mod.ACTIVE_USERS.clear()
-        await batch_mod.save_active_users_to_file()
-    except Exception:
-        pass
+    if JOBS.distributed:
+        # batches that were running here are jobs whose lease will expire:
+        # a worker takes them over and resumes from the checkpoint
+        return
+
+    for cp in checkpoints:
+        try:
+            await batch_mod.offer_resume(cp)
+        except FloodWait as e:
+            await asyncio.sleep(e.value)
+            try:
+                await batch_mod.offer_resume(cp)
+            except Exception:
+                pass
+        except Exception:
+            pass
 
 async def cleanup_loop(interval_seconds: int = 3600, max_age_hours: int = 24):
     while True:
         try:
-            cleanup_temp_images(directory=".", max_age_hours=max_age_hours)
+            WORKSPACES.sweep(max_age_hours=max_age_hours)
         except Exception:
             pass
         await asyncio.sleep(interval_seconds)
@@ -76,6 +87,7 @@ async def cleanup_loop(interval_seconds: int = 3600, max_age_hours: int = 24):
 async def load_and_run_plugins():
     await start_client()
     await reset_active_batches_on_start()
+    WORKSPACES.sweep(max_age_hours=0)  # nothing survives a restart
     asyncio.create_task(cleanup_loop())
     plugin_dir = "plugins"
     plugins = [f[:-3] for f in os.listdir(plugin_dir) if f.endswith(".py") and f != "__init__.py"]
@@ -86,6 +98,9 @@ async def load_and_run_plugins():
             print(f"Running {plugin} plugin...")
             await getattr(module, f"run_{plugin}_plugin")()  
 
+    # every plugin has registered its job handlers by now
+    JOBS.start()
+
 async def main():
     await load_and_run_plugins()
     while True:
@@ -20,10 +20,11 @@ from plugins.batch import (
     Z,
     P,
     PROCESSED_KEYS,
-    USER_LOCKS,
     request_batch_cancel,
 )
 from plugins.ytdl import ongoing_downloads
+from utils.job_queue import JOBS
+from utils.leases import USER_LEASES
 
 
 def is_owner(uid: int) -> bool:
@@ -83,11 +84,18 @@ async def killall_cmd(client, message):
     except Exception:
         pass
 
+    # ...and every queued or running job, on every node
+    try:
+        await JOBS.cancel_pending(None)
+        await JOBS.request_cancel(None)
+    except Exception:
+        pass
+
     # 2) Clear pending conversational states and progress caches
     Z.clear()
     P.clear()
     PROCESSED_KEYS.clear()
-    USER_LOCKS.clear()
+    USER_LEASES.clear()
 
     # 3) Reset ytdl in-memory locks so users can retry
     ytdl_users = list(ongoing_downloads.keys())
@@ -3,82 +3,114 @@
 import os
 import re
 import time
-import json
 import asyncio
-from typing import Dict, Any, Optional, Set, Tuple
+import contextlib
+import glob
+import hashlib
+import logging
+from typing import Dict, Any, Optional, Set, Tuple, List, Callable, Awaitable
 
 from pyrogram import Client, filters
-from pyrogram.types import Message
+from pyrogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 
 from config import API_ID, API_HASH, LOG_GROUP, STRING, FORCE_SUB, FREEMIUM_LIMIT, PREMIUM_LIMIT, FREE_BATCH_DAILY_LIMIT
+from config import BATCH_FETCH_WORKERS, BATCH_DOWNLOAD_WORKERS, BATCH_UPLOAD_WORKERS, BATCH_QUEUE_SIZE, BATCH_PREFETCH_CHUNK
+from config import BATCH_AUTO_RESUME, BATCH_CHECKPOINT_EVERY, STREAM_TRANSFER
+from config import CLIENT_POOL_SIZE, CLIENT_IDLE_TTL, CLIENT_HEALTH_EVERY, DOWNLOAD_CONNECTIONS
 from utils.func import get_user_data, screenshot, thumbnail, get_video_metadata, check_and_increment_free_batch_limit
-from utils.func import cleanup_temp_file, cleanup_temp_images
+from utils.func import cleanup_temp_file
 from utils.func import get_user_data_key, process_text_with_rules, is_premium_user, E
+from utils.func import UserSettings, load_user_settings, refresh_user_settings
+from utils.func import save_batch_checkpoint, update_batch_checkpoint, get_batch_checkpoint, delete_batch_checkpoint
 from shared_client import app as X
-from plugins.settings import rename_file
+from plugins.settings import rename_file, renamed_name
 from plugins.start import subscribe as sub
 from utils.custom_filters import login_in_progress
 from utils.encrypt import dcs
+from utils.batch_engine import BatchEngine, BatchItem
+from utils.client_pool import ClientPool
+from utils.journal import Journal
+from utils.rpc import RPC
+from utils.peers import PEERS
+from utils.workspace import WORKSPACES
+from utils.admission import ADMISSION, AdmissionError, DISK, MEMORY, STREAM
+from utils.scheduler import SCHEDULER
+from utils.job_queue import JOBS, Job, BATCH, SINGLE, YTDL_VIDEO, YTDL_AUDIO
+from utils.leases import USER_LEASES, SESSION_LEASES
+from utils.file_cache import FILE_CACHE, cache_variant, content_variant
+from utils.transfer import VIDEO_EXTS, AUDIO_EXTS, BOT_UPLOAD_LIMIT, BIG_FILE_MIN
+from utils.transfer import media_of, media_size, can_buffer, can_stream, download_to_memory, download_to_file, stream_upload, upload_file, send_uploaded
+from utils.transfer import ChunkHasher, hash_bytes, source_video_attrs, source_thumb
+
+logger = logging.getLogger(__name__)
 
 # --------------------------------------------------------------------------
 # Keep compatibility with existing globals (other files may import these)
 # --------------------------------------------------------------------------
 Y = None if not STRING else __import__("shared_client").userbot
-Z, P, UB, UC, emp = {}, {}, {}, {}, {}
+Z, P, emp = {}, {}, {}
+# per-user bot / login clients, bounded and evicted when idle
+UB = ClientPool("user bots", CLIENT_POOL_SIZE, CLIENT_IDLE_TTL, CLIENT_HEALTH_EVERY)
+UC = ClientPool("user sessions", CLIENT_POOL_SIZE, CLIENT_IDLE_TTL, CLIENT_HEALTH_EVERY)
 
-ACTIVE_USERS = {}
-ACTIVE_USERS_FILE = "active_users.json"
+ACTIVE_USERS_FILE = "active_users.json"      # legacy snapshot, imported once
+ACTIVE_USERS_JOURNAL = "active_users.journal"
+JOURNAL = Journal(ACTIVE_USERS_JOURNAL)
+ACTIVE_USERS = JOURNAL.state
 
 # In-memory anti-duplicate (runtime only)
 PROCESSED_KEYS: Dict[int, Set[str]] = {}  # uid -> set("chat:msgid")
-USER_LOCKS: Dict[int, asyncio.Lock] = {}  # uid -> lock
 
 # --------------------------------------------------------------------------
 # Utils
 # --------------------------------------------------------------------------
-def _lock(uid: int) -> asyncio.Lock:
-    if uid not in USER_LOCKS:
-        USER_LOCKS[uid] = asyncio.Lock()
-    return USER_LOCKS[uid]
+def _lock(uid: int):
+    # held across every node sharing the job store
+    return USER_LEASES.hold(uid)
+
+def _sessions(uid: int):
+    """
+    Held by jobs that use the user's own bot and login: one Telegram
+    session must not be connected from two nodes at once, so the node
+    holding this runs the user's clients and stops them before another
+    node may take over.
+    """
+    async def stop_clients():
+        await UB.evict(uid)
+        await UC.evict(uid)
+    return SESSION_LEASES.share(uid, on_release=stop_clients)
+
+def userbot_ready() -> bool:
+    # with several nodes the STRING userbot runs on one of them at a time (see shared_client)
+    return Y is not None and bool(getattr(Y, "is_connected", False))
+
+def _rev(secret: str) -> str:
+    # names the credentials a pooled client was started with, without keeping them
+    return hashlib.sha1(secret.encode()).hexdigest()[:12]
 
 def sanitize(filename: str) -> str:
     return re.sub(r'[<>:"/\\|?*\']', "_", filename).strip(" .")[:255]
 
 def load_active_users() -> Dict[str, Dict[str, Any]]:
-    try:
-        if os.path.exists(ACTIVE_USERS_FILE):
-            with open(ACTIVE_USERS_FILE, "r", encoding="utf-8") as f:
-                return json.load(f) or {}
-    except Exception:
-        pass
-    return {}
+    return JOURNAL.load(legacy_json=ACTIVE_USERS_FILE)
 
 async def save_active_users_to_file() -> None:
-    try:
-        with open(ACTIVE_USERS_FILE, "w", encoding="utf-8") as f:
-            json.dump(ACTIVE_USERS, f)
-    except Exception:
-        pass
+    # ACTIVE_USERS was changed in place by the caller: write a compacted snapshot
+    JOURNAL.checkpoint()
 
 async def add_active_batch(user_id: int, batch_info: Dict[str, Any]) -> None:
-    ACTIVE_USERS[str(user_id)] = batch_info
-    await save_active_users_to_file()
+    JOURNAL.set(str(user_id), batch_info)
 
 def is_user_active(user_id: int) -> bool:
     return str(user_id) in ACTIVE_USERS
 
 async def update_batch_progress(user_id: int, current: int, success: int) -> None:
-    k = str(user_id)
-    if k in ACTIVE_USERS:
-        ACTIVE_USERS[k]["current"] = current
-        ACTIVE_USERS[k]["success"] = success
-        await save_active_users_to_file()
+    JOURNAL.patch(str(user_id), {"current": current, "success": success})
 
 async def request_batch_cancel(user_id: int) -> bool:
     k = str(user_id)
     if k in ACTIVE_USERS:
-        ACTIVE_USERS[k]["cancel_requested"] = True
-        await save_active_users_to_file()
+        JOURNAL.patch(k, {"cancel_requested": True})
         return True
     return False
 
@@ -87,15 +119,15 @@ def should_cancel(user_id: int) -> bool:
     return k in ACTIVE_USERS and bool(ACTIVE_USERS[k].get("cancel_requested", False))
 
 async def remove_active_batch(user_id: int) -> None:
-    ACTIVE_USERS.pop(str(user_id), None)
-    await save_active_users_to_file()
+    JOURNAL.delete(str(user_id))
 
 def get_batch_info(user_id: int) -> Optional[Dict[str, Any]]:
     return ACTIVE_USERS.get(str(user_id))
 
-ACTIVE_USERS = load_active_users()
+load_active_users()
 
 async def upd_dlg(c: Client) -> bool:
+    # full warm-up scan; the pipeline resolves peers through PEERS instead
     try:
         async for _ in c.get_dialogs(limit=150):
             pass
@@ -111,6 +143,10 @@ async def has_user_login(uid: int) -> bool:
     ud = await get_user_data(uid)
     return bool(ud and ud.get("session_string"))
 
+async def has_user_bot(uid: int) -> bool:
+    # checked by the command handlers, which must not start the bot: it runs where the job runs
+    return bool(await get_user_data_key(uid, "bot_token", None))
+
 # --------------------------------------------------------------------------
 # Step 1: Parse Telegram link
 # E(link) returns (chat_identifier, msg_id, link_type) in your project
@@ -129,48 +165,51 @@ def parse_link(link: str) -> Tuple[Optional[str], Optional[int], Optional[str]]:
 async def get_ubot(uid: int) -> Optional[Client]:
     bt = await get_user_data_key(uid, "bot_token", None)
     if not bt:
+        await UB.evict(uid)
         return None
-    if uid in UB:
-        return UB.get(uid)
-    try:
-        bot = Client(f"user_{uid}", bot_token=bt, api_id=API_ID, api_hash=API_HASH)
+    rev = _rev(bt)
+
+    async def start() -> Client:
+        # the session file is per token: a file left from a replaced token would sign in as the old bot
+        for stale in glob.glob(f"user_{uid}.session") + glob.glob(f"user_{uid}_*.session"):
+            if stale != f"user_{uid}_{rev}.session":
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+        bot = RPC.install(Client(f"user_{uid}_{rev}", bot_token=bt, api_id=API_ID, api_hash=API_HASH, max_concurrent_transmissions=DOWNLOAD_CONNECTIONS))
         await bot.start()
-        UB[uid] = bot
         return bot
-    except Exception:
-        return None
+
+    # /setbot and /rembot may run on another node: the token in Mongo decides
+    return await UB.acquire(uid, start, rev=rev)
 
 async def get_uclient(uid: int) -> Optional[Client]:
     """
     Returns the user's logged-in Pyrogram client if session exists.
     (Does NOT change login flow or DB keys.)
     """
-    if uid in UC:
-        return UC.get(uid)
-
     ud = await get_user_data(uid)
-    if not ud:
-        return None
-
-    enc = ud.get("session_string")
+    enc = ud.get("session_string") if ud else None
     if not enc:
+        # logged out, maybe through another node: drop what this node still runs
+        await UC.evict(uid)
         return None
 
-    try:
+    async def start() -> Optional[Client]:
         ss = dcs(enc)
-        cl = Client(
+        cl = RPC.install(Client(
             f"{uid}_client",
             api_id=API_ID,
             api_hash=API_HASH,
             device_model="v3saver",
             session_string=ss,
-        )
+            max_concurrent_transmissions=DOWNLOAD_CONNECTIONS,
+        ))
         await cl.start()
-        await upd_dlg(cl)
-        UC[uid] = cl
         return cl
-    except Exception:
-        return None
+
+    return await UC.acquire(uid, start, rev=_rev(enc))
 
 # --------------------------------------------------------------------------
 # Step 3: Fetch message safely
@@ -190,6 +229,7 @@ async def get_msg(bot_client: Client, user_client: Optional[Client], chat_id: st
             # fallback to user
             if user_client:
                 try:
+                    await PEERS.ensure(user_client, chat_id)
                     xm = await user_client.get_messages(chat_id, msg_id)
                     if xm and not getattr(xm, "empty", False):
                         return xm
@@ -201,7 +241,7 @@ async def get_msg(bot_client: Client, user_client: Optional[Client], chat_id: st
         if not user_client:
             return None
 
-        await upd_dlg(user_client)
+        await PEERS.ensure(user_client, chat_id)
 
         # handle -100 / - formats
         s = str(chat_id)
@@ -226,6 +266,83 @@ async def get_msg(bot_client: Client, user_client: Optional[Client], chat_id: st
     except Exception:
         return None
 
+# --------------------------------------------------------------------------
+# Bulk fetch for batches: one get_messages RPC per chunk of ids (max 200)
+# The working chat-id spelling is resolved once per batch and reused.
+# --------------------------------------------------------------------------
+MAX_IDS_PER_RPC = 200
+
+def _usable(xm) -> bool:
+    return bool(xm) and not getattr(xm, "empty", False)
+
+async def _get_many(c: Client, chat_id, ids: List[int]) -> Dict[int, Message]:
+    found: Dict[int, Message] = {}
+    for k in range(0, len(ids), MAX_IDS_PER_RPC):
+        part = ids[k:k + MAX_IDS_PER_RPC]
+        xs = await c.get_messages(chat_id, part)
+        if not isinstance(xs, list):
+            xs = [xs]
+        for mid, xm in zip(part, xs):
+            if _usable(xm):
+                found[mid] = xm
+    return found
+
+class MessagePrefetcher:
+    """Resolves the source chat once and fetches message metadata in chunks."""
+
+    def __init__(self, bot_client: Client, user_client: Optional[Client], chat_id: str, lt: str):
+        self.bot_client = bot_client
+        self.user_client = user_client
+        self.chat_id = chat_id
+        self.lt = lt
+        self._resolved = None
+        self._lock = asyncio.Lock()
+
+    def _candidates(self) -> List[str]:
+        # handle -100 / - formats
+        s = str(self.chat_id)
+        if s.startswith("-100"):
+            return [s, f"-{s[4:]}"]
+        if s.isdigit():
+            return [f"-100{s}", f"-{s}", s]
+        return [s]
+
+    async def _resolve(self, probe_ids: List[int]) -> Dict[int, Message]:
+        await PEERS.ensure(self.user_client, self.chat_id)
+        for cid in self._candidates():
+            try:
+                found = await _get_many(self.user_client, cid, probe_ids)
+            except Exception:
+                continue
+            self._resolved = cid
+            return found
+        return {}
+
+    async def fetch(self, ids: List[int]) -> List[Optional[Message]]:
+        found: Dict[int, Message] = {}
+        try:
+            if self.lt == "public":
+                try:
+                    found = await _get_many(self.bot_client, self.chat_id, ids)
+                except Exception:
+                    found = {}
+                missing = [mid for mid in ids if mid not in found]
+                if missing and self.user_client:
+                    try:
+                        await PEERS.ensure(self.user_client, self.chat_id)
+                        found.update(await _get_many(self.user_client, self.chat_id, missing))
+                    except Exception:
+                        pass
+            elif self.user_client:
+                async with self._lock:
+                    if self._resolved is None:
+                        found = await self._resolve(ids)
+                    else:
+                        found = await _get_many(self.user_client, self._resolved, ids)
+        except Exception:
+            pass
+        return [found.get(mid) for mid in ids]
+
 # --------------------------------------------------------------------------
 # Progress callback (safe)
 # --------------------------------------------------------------------------
@@ -238,6 +355,10 @@ async def prog(c, t, C: Client, h: int, m: int, st: float, mode: str = "Transfer
         interval = 10 if t >= 100 * 1024 * 1024 else 20 if t >= 50 * 1024 * 1024 else 30 if t >= 10 * 1024 * 1024 else 50
         step = int(p // interval) * interval
         if m not in P or P[m] != step or p >= 100:
+            # progress is lossy: skip this step rather than queue behind a
+            # throttled chat and stall the transfer that awaits us
+            if p < 100 and not RPC.ready(C, "edit_message_text", h):
+                return
             P[m] = step
             c_mb = c / (1024 * 1024)
             t_mb = t / (1024 * 1024)
@@ -273,6 +394,14 @@ async def prog(c, t, C: Client, h: int, m: int, st: float, mode: str = "Transfer
 # --------------------------------------------------------------------------
 # Direct send optimization (public only)
 # --------------------------------------------------------------------------
+DIRECT_MEDIA = ("video", "video_note", "voice", "sticker", "audio", "photo", "document")
+
+
+def direct_sendable(c: Client, m: Message) -> bool:
+    """file_ids are only valid for the client that fetched the message."""
+    return getattr(m, "_client", None) is c and any(getattr(m, a, None) for a in DIRECT_MEDIA)
+
+
 async def send_direct(c: Client, m: Message, tcid: int, ft: Optional[str] = None, rtmid: Optional[int] = None) -> bool:
     try:
         if m.video:
@@ -298,113 +427,438 @@ async def send_direct(c: Client, m: Message, tcid: int, ft: Optional[str] = None
 
 # --------------------------------------------------------------------------
 # Step 4/5/6: Process rules → Download → Upload
+#
+# Split in two halves so the batch engine can overlap them:
+#   prepare_msg: target/caption rules, download, rename  (download stage)
+#   deliver_msg: upload / send to target                 (upload stage)
+# process_msg runs both back to back (used by /single).
+#
+# Transfer modes (STREAM_TRANSFER on):
+#   small media  -> downloaded into memory, uploaded from the buffer
+#   large media  -> source stream piped into the upload (deliver_msg)
+#   everything else, or when a stream fails -> temp file on disk
 # --------------------------------------------------------------------------
-async def process_msg(bot_client: Client, user_client: Client, msg: Message, did: int, lt: str, uid: int, chat_key: str) -> str:
-    try:
-        # target config (KEEP key: chat_id)
-        cfg_chat = await get_user_data_key(uid, "chat_id", None)
-        tcid = did
-        rtmid = None
-        if cfg_chat:
-            try:
-                if "/" in str(cfg_chat):
-                    a, b = str(cfg_chat).split("/", 1)
-                    tcid = int(a)
-                    rtmid = int(b) if b else None
-                else:
-                    tcid = int(cfg_chat)
-            except Exception:
-                tcid = did
-                rtmid = None
 
-        # text/caption rules (KEEP behavior)
-        orig_text = msg.caption.markdown if msg.caption else ""
-        proc_text = await process_text_with_rules(uid, orig_text)
-        user_cap = await get_user_data_key(uid, "caption", "")
-        ft = f"{proc_text}\n\n{user_cap}" if proc_text and user_cap else (user_cap if user_cap else proc_text)
+async def _noop_turn() -> None:
+    return None
 
-        # For PUBLIC: try direct file_id send (no download) if possible
-        if lt == "public":
-            ok = await send_direct(bot_client, msg, tcid, ft, rtmid)
-            if ok:
-                return "Sent directly."
 
-        # Download
-        st = time.time()
-        pmsg = await bot_client.send_message(did, "Downloading...")
-
-        # choose file name safely
-        name = str(int(time.time()))
-        if msg.video:
-            name = sanitize(msg.video.file_name or f"{time.time()}.mp4")
-        elif msg.audio:
-            name = sanitize(msg.audio.file_name or f"{time.time()}.mp3")
-        elif msg.document:
-            name = sanitize(msg.document.file_name or f"{time.time()}")
-        elif msg.photo:
-            name = sanitize(f"{time.time()}.jpg")
-
-        fpath = await user_client.download_media(
-            msg,
-            file_name=name,
-            progress=prog,
-            progress_args=(bot_client, did, pmsg.id, st, "Downloading"),
+def resolve_target(settings: UserSettings, did: int) -> Tuple[int, Optional[int]]:
+    # target config (KEEP key: chat_id)
+    cfg_chat = settings.chat_id
+    tcid = did
+    rtmid = None
+    if cfg_chat:
+        try:
+            if "/" in str(cfg_chat):
+                a, b = str(cfg_chat).split("/", 1)
+                tcid = int(a)
+                rtmid = int(b) if b else None
+            else:
+                tcid = int(cfg_chat)
+        except Exception:
+            tcid = did
+            rtmid = None
+    return tcid, rtmid
+
+
+async def prepare_msg(bot_client: Client, user_client: Client, msg: Message, did: int, lt: str, uid: int, settings: Optional[UserSettings] = None, order: Optional[Tuple[Any, int]] = None, slot: Optional[Callable[[], Any]] = None) -> Dict[str, Any]:
+    """
+    Everything that can run ahead of the upload: resolves the target, applies
+    caption rules and downloads + renames the media. Returns a job dict for
+    deliver_msg; job["result"] is set when the item is already finished.
+    `settings` is the job's snapshot; loaded here when not given. `order`
+    is (batch, seq) for items delivered in source order. `slot()` is the
+    user's share of the global transfer slots (SCHEDULER).
+    """
+    if settings is None:
+        settings = await load_user_settings(uid)
+    tcid, rtmid = resolve_target(settings, did)
+
+    # text/caption rules (KEEP behavior)
+    orig_text = msg.caption.markdown if msg.caption else ""
+    proc_text = await process_text_with_rules(uid, orig_text, settings)
+    user_cap = settings.caption
+    ft = f"{proc_text}\n\n{user_cap}" if proc_text and user_cap else (user_cap if user_cap else proc_text)
+
+    job: Dict[str, Any] = {
+        "msg": msg, "did": did, "lt": lt, "uid": uid,
+        "tcid": tcid, "rtmid": rtmid, "ft": ft,
+        "user_client": user_client, "settings": settings,
+        "fpath": None, "pmsg": None, "result": None, "order": order, "slot": slot,
+    }
+
+    # For PUBLIC: media the bot fetched itself is sent by file_id in
+    # deliver_msg (no download). Anything the user session had to fetch
+    # carries file_ids the bot can't send, so it is downloaded here, ahead
+    # of its turn, instead of after a failed direct send.
+    if lt == "public" and direct_sendable(bot_client, msg):
+        job["direct"] = True
+        return job
+
+    # delivered before (by anyone): deliver_msg resends it without a transfer
+    if await lookup_cached(job):
+        return job
+
+    await download_job(bot_client, job)
+    return job
+
+
+def _unique_id(msg: Message) -> Optional[str]:
+    return getattr(media_of(msg)[1], "file_unique_id", None)
+
+
+async def lookup_cached(job: Dict[str, Any]) -> bool:
+    """Same post delivered before, or the same Telegram file under another post."""
+    msg: Message = job["msg"]
+    named = has_source_name(msg)
+    th = thumbnail(job["uid"])
+    job["cache_key"] = FILE_CACHE.key(msg, cache_variant(job["settings"], named, th))
+    job["content_variant"] = content_variant(await final_name(job, media_file_name(msg)) if named else None, th)
+    job["cached"] = (
+        await FILE_CACHE.lookup(job["cache_key"])
+        or await FILE_CACHE.lookup_unique(_unique_id(msg), job["content_variant"])
+    )
+    return bool(job["cached"])
+
+
+async def lookup_content(job: Dict[str, Any]) -> None:
+    """The downloaded bytes were uploaded before under another post: reuse that upload."""
+    if job.get("cached") or not job.get("digest") or "content_variant" not in job:
+        return
+    job["cached"] = await FILE_CACHE.lookup_content(job["digest"], media_size(job["msg"]), job["content_variant"])
+
+
+async def remember_result(bot_client: Client, job: Dict[str, Any], sent: Optional[Message], log_msg_id: Optional[int] = None) -> None:
+    msg: Message = job["msg"]
+    try:
+        await FILE_CACHE.store(
+            bot_client, job.get("cache_key"), sent, media_size(msg), log_msg_id,
+            digest=job.get("digest"), variant=job.get("content_variant"), unique_id=_unique_id(msg),
         )
+    except Exception:
+        pass
 
-        if not fpath or not os.path.exists(fpath):
-            try:
-                await bot_client.edit_message_text(did, pmsg.id, "Failed.")
-            except Exception:
-                pass
-            return "Failed."
 
-        # Rename rules (only when original filename exists)
+def media_file_name(msg: Message) -> str:
+    # choose file name safely
+    name = str(int(time.time()))
+    if msg.video:
+        name = sanitize(msg.video.file_name or f"{time.time()}.mp4")
+    elif msg.audio:
+        name = sanitize(msg.audio.file_name or f"{time.time()}.mp3")
+    elif msg.document:
+        name = sanitize(msg.document.file_name or f"{time.time()}")
+    elif msg.photo:
+        name = sanitize(f"{time.time()}.jpg")
+    return name
+
+
+def has_source_name(msg: Message) -> bool:
+    return bool(
+        (msg.video and msg.video.file_name)
+        or (msg.audio and msg.audio.file_name)
+        or (msg.document and msg.document.file_name)
+    )
+
+
+async def final_name(job: Dict[str, Any], name: str) -> str:
+    """Rename rules applied to a file name that never exists on disk."""
+    if not has_source_name(job["msg"]):
+        return name
+    try:
+        return os.path.basename(await renamed_name(name, job["uid"], job["settings"]))
+    except Exception:
+        return name
+
+
+async def video_meta(job: Dict[str, Any], fpath: Optional[str], th) -> Tuple[int, int, int, Any]:
+    """
+    Duration, width, height and thumbnail of a video upload. The source's
+    own attributes and thumbnail are used when it has them; the file is
+    probed and a frame extracted only for what is missing.
+    """
+    msg: Message = job["msg"]
+    attrs = source_video_attrs(msg)
+    if attrs is None and fpath:
+        attrs = await get_video_metadata(fpath)
+    attrs = attrs or {"duration": 1, "width": 1, "height": 1}
+    dur = attrs["duration"]
+    if not th:
+        th = await source_thumb(job["user_client"], msg)
+    if not th and fpath:
+        th = await screenshot(fpath, dur, job["uid"])
+    return dur, attrs["width"], attrs["height"], th
+
+
+def transfer_slot(job: Dict[str, Any]):
+    """
+    Held around each actual transfer, wherever it runs (download stage,
+    streamed upload, public-link fallback), and only once the transfer is
+    admitted: a slot is never held while waiting for disk or memory.
+    """
+    slot = job.get("slot")
+    return slot() if slot else contextlib.nullcontext()
+
+
+async def admit(bot_client: Client, job: Dict[str, Any], kind: str, path: Optional[str] = None) -> None:
+    """Waits until the job's transfer fits (disk, memory, transfer slots); discard_job releases it."""
+    ADMISSION.release(job.pop("ticket", None))
+    pmsg = job["pmsg"]
+
+    async def waiting(reason: str) -> None:
+        try:
+            await bot_client.edit_message_text(job["did"], pmsg.id, f"Waiting for resources: {reason}")
+        except Exception:
+            pass
+
+    job["ticket"] = await ADMISSION.acquire(
+        kind, media_size(job["msg"]), path=path, order=job.get("order"), label=str(job["uid"]), on_wait=waiting,
+    )
+
+
+def tracked_prog(job: Dict[str, Any]):
+    """prog that also tells the job's admission ticket how much is written, so only the rest stays reserved."""
+    async def progress(current, total, *args):
+        ticket = job.get("ticket")
+        if ticket is not None:
+            ticket.written = current
+        await prog(current, total, *args)
+    return progress
+
+
+async def download_job(bot_client: Client, job: Dict[str, Any], stream: bool = STREAM_TRANSFER) -> None:
+    msg: Message = job["msg"]
+    did, uid = job["did"], job["uid"]
+
+    # Download
+    st = time.time()
+    pmsg = job.get("pmsg")
+    if not pmsg:
+        with RPC.status():
+            pmsg = await bot_client.send_message(did, "Downloading...")
+    job["pmsg"] = pmsg
+    name = media_file_name(msg)
+
+    if stream and can_buffer(msg, name):
+        await admit(bot_client, job, MEMORY)
+        try:
+            async with transfer_slot(job):
+                buf = await download_to_memory(
+                    job["user_client"],
+                    msg,
+                    await final_name(job, name),
+                    progress=tracked_prog(job),
+                    progress_args=(bot_client, did, pmsg.id, st, "Downloading"),
+                )
+        except Exception:
+            buf = None
+        if buf is not None:
+            job["buf"] = buf
+            job["digest"] = await asyncio.to_thread(hash_bytes, buf.getbuffer())
+            await lookup_content(job)
+            return
+    elif stream and can_stream(msg, name, big_ok=userbot_ready()):
+        # nothing to fetch ahead: deliver_msg pipes the source into the upload,
+        # hashing it on the way. lookup_cached already matched the
+        # file_unique_id; the content hash only serves later lookups, since
+        # reading the source twice to check it first costs a whole download.
+        await admit(bot_client, job, STREAM)
+        job["stream"] = await final_name(job, name)
+        return
+
+    if not job.get("ws"):
+        job["ws"] = WORKSPACES.open(uid, media_size(msg))
+    try:
+        await admit(bot_client, job, DISK, job["ws"].path)
+    except AdmissionError as e:
         try:
-            await bot_client.edit_message_text(did, pmsg.id, "Renaming...")
+            await bot_client.edit_message_text(did, pmsg.id, f"Failed: {e}")
         except Exception:
             pass
+        job["result"] = "Failed."
+        return
+    hasher = ChunkHasher()
+    try:
+        async with transfer_slot(job):
+            fpath = await download_to_file(
+                job["user_client"],
+                msg,
+                job["ws"].file(name),
+                hasher=hasher,
+                progress=tracked_prog(job),
+                progress_args=(bot_client, did, pmsg.id, st, "Downloading"),
+            )
+    except Exception:
+        fpath = None
+    if fpath:
+        job["digest"] = hasher.hexdigest()
+        await lookup_content(job)
 
+    if not fpath or not os.path.exists(fpath):
         try:
-            if (
-                (msg.video and msg.video.file_name)
-                or (msg.audio and msg.audio.file_name)
-                or (msg.document and msg.document.file_name)
-            ):
-                fpath = await rename_file(fpath, uid, pmsg)
+            await bot_client.edit_message_text(did, pmsg.id, "Failed.")
         except Exception:
             pass
+        job["result"] = "Failed."
+        return
+
+    # Rename rules (only when original filename exists)
+    try:
+        await bot_client.edit_message_text(did, pmsg.id, "Renaming...")
+    except Exception:
+        pass
+
+    try:
+        if has_source_name(msg):
+            fpath = await rename_file(fpath, uid, pmsg, job["settings"])
+    except Exception:
+        pass
+
+    job["fpath"] = fpath
+
+
+async def stream_job(bot_client: Client, job: Dict[str, Any], turn: Callable[[], Awaitable[None]]) -> Optional[str]:
+    """
+    Pipes the source media into the upload. Returns None when the stream
+    failed before anything was sent, so the caller can retry from disk.
+    """
+    msg: Message = job["msg"]
+    did, uid = job["did"], job["uid"]
+    tcid, rtmid, ft = job["tcid"], job["rtmid"], job["ft"]
+    pmsg, name = job["pmsg"], job["stream"]
+    size = media_size(msg)
+
+    # > 2GB goes through the premium userbot and the log group (same as the disk route)
+    big = size > BOT_UPLOAD_LIMIT
+    up = Y if big else bot_client
+    try:
+        await bot_client.edit_message_text(did, pmsg.id, "Streaming...")
+    except Exception:
+        pass
+
+    st = time.time()
+    th = thumbnail(uid)
+    if not th and (msg.video or msg.animation):
+        th = await source_thumb(job["user_client"], msg)
+    hasher = None if job.get("digest") else ChunkHasher()
+    try:
+        if big:
+            await PEERS.ensure(Y, LOG_GROUP)
+        async with transfer_slot(job):
+            file = await stream_upload(
+                job["user_client"], up, msg, name, size,
+                progress=prog,
+                progress_args=(bot_client, did, pmsg.id, st, "Streaming"),
+                hasher=hasher,
+            )
+        if hasher:
+            job["digest"] = hasher.hexdigest()
+        if not big:
+            await turn()
+        sent = await send_uploaded(
+            up,
+            LOG_GROUP if big else tcid,
+            msg,
+            file,
+            name,
+            caption=ft if msg.caption else None,
+            thumb=th,
+            reply_to=rtmid,
+        )
+    except Exception as e:
+        logger.warning(f"Stream transfer failed, using temp file: {e}")
+        return None
+
+    if big:
+        await turn()
+        copied = await bot_client.copy_message(did, LOG_GROUP, sent.id)
+        await remember_result(bot_client, job, copied, log_msg_id=sent.id)
+    else:
+        await remember_result(bot_client, job, sent)
+    try:
+        await bot_client.delete_messages(did, pmsg.id)
+    except Exception:
+        pass
+    return "Done (Large file)." if big else "Done."
+
+
+async def deliver_msg(bot_client: Client, job: Dict[str, Any], turn: Callable[[], Awaitable[None]] = _noop_turn) -> str:
+    """
+    Upload half of the pipeline. `turn` is awaited right before the send
+    that lands in the target chat so batches keep source order.
+    """
+    msg: Message = job["msg"]
+    did, uid = job["did"], job["uid"]
+    tcid, rtmid, ft = job["tcid"], job["rtmid"], job["ft"]
+    th = None
+
+    try:
+        if job.get("direct"):
+            await turn()
+            ok = await send_direct(bot_client, msg, tcid, ft, rtmid)
+            if ok:
+                return "Sent directly."
+            # rare (e.g. the file was deleted meanwhile): the fallback below
+            # runs with the turn already taken
+            await lookup_cached(job)
+
+        if job.get("cached"):
+            result = await send_cached(bot_client, job, turn)
+            if result:
+                return result
+
+        if not (job["fpath"] or job.get("buf") or job.get("stream")):
+            await download_job(bot_client, job)
+            if job.get("result"):
+                return job["result"]
+            if job.get("cached"):
+                # content match found while downloading
+                result = await send_cached(bot_client, job, turn)
+                if result:
+                    return result
+
+        if job.get("stream"):
+            result = await stream_job(bot_client, job, turn)
+            if result:
+                return result
+            await download_job(bot_client, job, stream=False)
+            if job.get("result"):
+                return job["result"]
+
+        fpath, buf, pmsg = job["fpath"], job.get("buf"), job["pmsg"]
+        src = buf or fpath
 
         # Large file route (KEEP old behavior)
-        fsize_gb = os.path.getsize(fpath) / (1024 * 1024 * 1024)
+        fsize_gb = os.path.getsize(fpath) / (1024 * 1024 * 1024) if fpath else 0
         th = thumbnail(uid)
 
-        if fsize_gb > 2 and Y:
+        if fsize_gb > 2 and userbot_ready():
             try:
                 await bot_client.edit_message_text(did, pmsg.id, "File is larger than 2GB. Using alternative method...")
             except Exception:
                 pass
 
-            await upd_dlg(Y)
-            mtd = await get_video_metadata(fpath)
-            dur, w, h = mtd["duration"], mtd["width"], mtd["height"]
-            th = await screenshot(fpath, dur, uid)
+            await PEERS.ensure(Y, LOG_GROUP)
+            dur, w, h, th = await video_meta(job, fpath, th)
 
             st = time.time()
-            sent = await Y.send_document(
+            name = os.path.basename(fpath)
+            file = await upload_file(Y, fpath, name, progress=prog, progress_args=(bot_client, did, pmsg.id, st, "Uploading"))
+            sent = await send_uploaded(
+                Y,
                 LOG_GROUP,
-                fpath,
-                thumb=th,
+                msg,
+                file,
+                name,
                 caption=ft if msg.caption else None,
-                progress=prog,
-                progress_args=(bot_client, did, pmsg.id, st, "Uploading"),
-                reply_to_message_id=rtmid,
+                thumb=th,
+                reply_to=rtmid,
+                kind="document",
             )
-            await bot_client.copy_message(did, LOG_GROUP, sent.id)
-            try:
-                os.remove(fpath)
-            except Exception:
-                pass
-            cleanup_temp_file(th, uid)
+            await turn()
+            copied = await bot_client.copy_message(did, LOG_GROUP, sent.id)
+            await remember_result(bot_client, job, copied, log_msg_id=sent.id)
             try:
                 await bot_client.delete_messages(did, pmsg.id)
             except Exception:
@@ -418,77 +872,425 @@ async def process_msg(bot_client: Client, user_client: Client, msg: Message, did
             pass
 
         st = time.time()
-        file_ext = os.path.splitext(fpath)[1].lower()
-        video_exts = {".mp4", ".avi", ".mkv", ".mov", ".wmv", ".flv", ".webm", ".m4v", ".3gp", ".ogv"}
-        audio_exts = {".mp3", ".wav", ".flac", ".aac", ".ogg", ".wma", ".m4a", ".opus", ".aiff", ".ac3"}
+        file_name = os.path.basename(getattr(src, "name", src))
+        file_ext = os.path.splitext(file_name)[1].lower()
+        fsize = buf.getbuffer().nbytes if buf is not None else os.path.getsize(fpath)
+
+        async def send_parts(kind: str, **attrs) -> Optional[Message]:
+            # big files: parts go up in parallel before our turn, only the send waits
+            file = await upload_file(bot_client, src, file_name, progress=prog, progress_args=(bot_client, did, pmsg.id, st, "Uploading"))
+            await turn()
+            return await send_uploaded(bot_client, tcid, msg, file, file_name, caption=ft if msg.caption else None, thumb=th, reply_to=rtmid, kind=kind, **attrs)
+
+        parallel = fsize >= BIG_FILE_MIN
 
         try:
-            if msg.video or (msg.document and file_ext in video_exts):
-                mtd = await get_video_metadata(fpath)
-                dur, w, h = mtd["duration"], mtd["width"], mtd["height"]
-                th = await screenshot(fpath, dur, uid)
-                await bot_client.send_video(
-                    tcid,
-                    video=fpath,
-                    caption=ft if msg.caption else None,
-                    thumb=th,
-                    width=w,
-                    height=h,
-                    duration=dur,
-                    progress=prog,
-                    progress_args=(bot_client, did, pmsg.id, st, "Uploading"),
-                    reply_to_message_id=rtmid,
-                )
+            if msg.video or (msg.document and file_ext in VIDEO_EXTS):
+                dur, w, h, th = await video_meta(job, fpath, th)
+                if parallel:
+                    sent = await send_parts("video", duration=dur, width=w, height=h)
+                else:
+                    await turn()
+                    sent = await bot_client.send_video(
+                        tcid,
+                        video=src,
+                        caption=ft if msg.caption else None,
+                        thumb=th,
+                        width=w,
+                        height=h,
+                        duration=dur,
+                        progress=prog,
+                        progress_args=(bot_client, did, pmsg.id, st, "Uploading"),
+                        reply_to_message_id=rtmid,
+                    )
             elif msg.video_note:
-                await bot_client.send_video_note(tcid, video_note=fpath, progress=prog, progress_args=(bot_client, did, pmsg.id, st, "Uploading"), reply_to_message_id=rtmid)
+                await turn()
+                sent = await bot_client.send_video_note(tcid, video_note=src, progress=prog, progress_args=(bot_client, did, pmsg.id, st, "Uploading"), reply_to_message_id=rtmid)
             elif msg.voice:
-                await bot_client.send_voice(tcid, fpath, progress=prog, progress_args=(bot_client, did, pmsg.id, st, "Uploading"), reply_to_message_id=rtmid)
+                await turn()
+                sent = await bot_client.send_voice(tcid, src, progress=prog, progress_args=(bot_client, did, pmsg.id, st, "Uploading"), reply_to_message_id=rtmid)
             elif msg.sticker:
-                await bot_client.send_sticker(tcid, msg.sticker.file_id, reply_to_message_id=rtmid)
-            elif msg.audio or (msg.document and file_ext in audio_exts):
-                await bot_client.send_audio(tcid, audio=fpath, caption=ft if msg.caption else None, thumb=th, progress=prog, progress_args=(bot_client, did, pmsg.id, st, "Uploading"), reply_to_message_id=rtmid)
+                await turn()
+                sent = await bot_client.send_sticker(tcid, msg.sticker.file_id, reply_to_message_id=rtmid)
+            elif msg.audio or (msg.document and file_ext in AUDIO_EXTS):
+                if parallel:
+                    sent = await send_parts("audio")
+                else:
+                    await turn()
+                    sent = await bot_client.send_audio(tcid, audio=src, caption=ft if msg.caption else None, thumb=th, progress=prog, progress_args=(bot_client, did, pmsg.id, st, "Uploading"), reply_to_message_id=rtmid)
             elif msg.photo:
-                await bot_client.send_photo(tcid, photo=fpath, caption=ft if msg.caption else None, progress=prog, progress_args=(bot_client, did, pmsg.id, st, "Uploading"), reply_to_message_id=rtmid)
+                await turn()
+                sent = await bot_client.send_photo(tcid, photo=src, caption=ft if msg.caption else None, progress=prog, progress_args=(bot_client, did, pmsg.id, st, "Uploading"), reply_to_message_id=rtmid)
             elif msg.document:
-                await bot_client.send_document(tcid, document=fpath, caption=ft if msg.caption else None, progress=prog, progress_args=(bot_client, did, pmsg.id, st, "Uploading"), reply_to_message_id=rtmid)
+                if parallel:
+                    sent = await send_parts("document")
+                else:
+                    await turn()
+                    sent = await bot_client.send_document(tcid, document=src, caption=ft if msg.caption else None, progress=prog, progress_args=(bot_client, did, pmsg.id, st, "Uploading"), reply_to_message_id=rtmid)
             elif msg.text:
-                await bot_client.send_message(tcid, text=msg.text.markdown, reply_to_message_id=rtmid)
+                await turn()
+                sent = await bot_client.send_message(tcid, text=msg.text.markdown, reply_to_message_id=rtmid)
             else:
-                await bot_client.send_document(tcid, document=fpath, caption=ft if msg.caption else None, progress=prog, progress_args=(bot_client, did, pmsg.id, st, "Uploading"), reply_to_message_id=rtmid)
+                if parallel:
+                    sent = await send_parts("document")
+                else:
+                    await turn()
+                    sent = await bot_client.send_document(tcid, document=src, caption=ft if msg.caption else None, progress=prog, progress_args=(bot_client, did, pmsg.id, st, "Uploading"), reply_to_message_id=rtmid)
 
         except Exception as e:
             try:
                 await bot_client.edit_message_text(did, pmsg.id, f"Upload failed: {str(e)[:60]}")
             except Exception:
                 pass
-            try:
-                if os.path.exists(fpath):
-                    os.remove(fpath)
-            except Exception:
-                pass
             return "Failed."
 
-        # cleanup
+        await remember_result(bot_client, job, sent)
         try:
-            os.remove(fpath)
+            await bot_client.delete_messages(did, pmsg.id)
         except Exception:
             pass
+
+        return "Done."
+
+    except Exception as e:
+        return f"Error: {str(e)[:60]}"
+    finally:
+        discard_job(job)
         cleanup_temp_file(th, uid)
+
+
+async def send_cached(bot_client: Client, job: Dict[str, Any], turn: Callable[[], Awaitable[None]]) -> Optional[str]:
+    """Delivers a cache hit; None (and the hit dropped) when it could not be reused."""
+    msg: Message = job["msg"]
+    await turn()
+    sent = await FILE_CACHE.send(bot_client, job["cached"], job["tcid"], job["ft"] if msg.caption else None, job["rtmid"])
+    job["cached"] = None
+    if not sent:
+        return None
+    pmsg = job.get("pmsg")
+    if pmsg:
         try:
-            await bot_client.delete_messages(did, pmsg.id)
+            await bot_client.delete_messages(job["did"], pmsg.id)
         except Exception:
             pass
+    return "Done (cached)."
 
-        return "Done."
 
+def discard_job(job: Dict[str, Any]) -> None:
+    job["buf"] = None
+    job["fpath"] = None
+    # the download, its renamed copy and any screenshot go with the directory
+    WORKSPACES.release(job.pop("ws", None))
+    ADMISSION.release(job.pop("ticket", None))
+
+
+async def process_msg(bot_client: Client, user_client: Client, msg: Message, did: int, lt: str, uid: int, chat_key: str, settings: Optional[UserSettings] = None, slot: Optional[Callable[[], Any]] = None) -> str:
+    try:
+        job = await prepare_msg(bot_client, user_client, msg, did, lt, uid, settings, slot=slot)
     except Exception as e:
         return f"Error: {str(e)[:60]}"
-    finally:
+    if job.get("result"):
+        discard_job(job)
+        return job["result"]
+    return await deliver_msg(bot_client, job)
+
+# --------------------------------------------------------------------------
+# Batch runner (pipelined)
+# --------------------------------------------------------------------------
+async def run_batch(bot_client: Client, user_client: Optional[Client], uid: int, did: int, i: str, start_id: int, count: int, lt: str, pt: Message, settings: Optional[UserSettings] = None, done: int = 0, success: int = 0, total: Optional[int] = None) -> int:
+    """
+    Runs a batch through BatchEngine: fetch / download / upload stages with
+    their own worker counts, delivering to the target chat in source order.
+    `done`/`success`/`total` carry the counters of a resumed batch.
+    Returns the number of successfully delivered items.
+    """
+    total = total or count
+    seen = PROCESSED_KEYS.setdefault(uid, set())
+    ids = []
+    for mid in range(start_id, start_id + count):
+        key = f"{i}:{mid}"
+        if key in seen:
+            continue
+        seen.add(key)
+        ids.append(mid)
+
+    state = {"done": done, "success": success, "settings": settings or await load_user_settings(uid)}
+    state["premium"] = await is_premium_user(uid)
+
+    prefetcher = MessagePrefetcher(bot_client, user_client, i, lt)
+
+    async def download(item: BatchItem) -> None:
+        # refresh point: picks up /settings changes made mid-batch
+        state["settings"] = await refresh_user_settings(state["settings"])
+        # transfers of all users share global slots; premium users are served first
+        job = await prepare_msg(
+            bot_client, user_client or bot_client, item.msg, did, lt, uid, state["settings"],
+            order=(id(state), item.seq), slot=lambda: SCHEDULER.slot(uid, state["premium"]),
+        )
+        item.data["job"] = job
+        if job.get("result"):
+            item.result = job["result"]
+            discard_job(job)
+
+    async def upload(item: BatchItem) -> str:
+        return await deliver_msg(bot_client, item.data["job"], item.turn)
+
+    async def on_result(item: BatchItem) -> None:
+        state["done"] += 1
+        if item.msg is None:
+            res = "Skipped (not found/access)."
+        else:
+            res = item.result or "Failed."
+            if "Done" in res or "Sent" in res or "Copied" in res:
+                state["success"] += 1
+        await update_batch_progress(uid, state["done"], state["success"])
+        await checkpoint_batch(uid, item.msg_id, state["done"], state["success"])
         try:
-            cleanup_temp_images(directory=".", max_age_hours=0)
+            await pt.edit(f"{state['done']}/{total}: {res} | ✅ {state['success']}")
         except Exception:
             pass
 
+    engine = BatchEngine(
+        ids,
+        prefetcher.fetch,
+        download,
+        upload,
+        fetch_workers=BATCH_FETCH_WORKERS,
+        download_workers=BATCH_DOWNLOAD_WORKERS,
+        upload_workers=BATCH_UPLOAD_WORKERS,
+        queue_size=BATCH_QUEUE_SIZE,
+        fetch_chunk=min(BATCH_PREFETCH_CHUNK, MAX_IDS_PER_RPC),
+        on_result=on_result,
+        should_cancel=lambda: should_cancel(uid),
+    )
+    await engine.run()
+
+    if should_cancel(uid):
+        try:
+            await pt.edit(f"Cancelled at {state['done']}/{total}. Success: {state['success']}")
+        except Exception:
+            pass
+    return state["success"]
+
+# --------------------------------------------------------------------------
+# Checkpoints: survive restarts (stored in Mongo, deploys wipe local disk)
+# --------------------------------------------------------------------------
+_CHECKPOINT_TS: Dict[int, float] = {}
+
+async def checkpoint_batch(uid: int, last_id: int, done: int, success: int, force: bool = False) -> None:
+    now = time.time()
+    if not force and now - _CHECKPOINT_TS.get(uid, 0) < BATCH_CHECKPOINT_EVERY:
+        return
+    _CHECKPOINT_TS[uid] = now
+    try:
+        await update_batch_checkpoint(uid, last_id, done, success)
+    except Exception:
+        pass
+
+async def execute_batch(ubot: Client, uc: Optional[Client], uid: int, did: int, i: str, start_id: int, count: int, lt: str, done: int = 0, success: int = 0, total: Optional[int] = None, job: Optional[Job] = None) -> None:
+    """
+    Registers the batch (ACTIVE_USERS + Mongo checkpoint), runs it and
+    cleans up. A fresh batch starts with done=0; a resumed one passes the
+    counters it stopped at. When `job` lost its lease the batch is another
+    node's now: its checkpoint and ACTIVE_USERS record are left alone.
+    """
+    total = total or count
+    pt = await X.send_message(did, "Processing batch..." if not done else f"Resuming batch from {done}/{total}...")
+
+    await add_active_batch(
+        uid,
+        {
+            "total": total,
+            "current": done,
+            "success": success,
+            "cancel_requested": False,
+            "progress_message_id": pt.id,
+            "job_id": str(job.id) if job else None,
+        },
+    )
+    # a resumed batch re-saves the checkpoint it was started from (the
+    # original first id is `done` items before the one it carries on at)
+    try:
+        await save_batch_checkpoint(uid, {
+            "cid": i, "lt": lt, "did": did,
+            "start_id": start_id - done, "count": total,
+            "last_id": start_id - 1,
+            "done": done, "success": success,
+        })
+    except Exception:
+        pass
+
+    finished = False
+    try:
+        settings = await load_user_settings(uid)
+        with UB.hold(uid), UC.hold(uid):
+            success = await run_batch(ubot, uc, uid, did, i, start_id, count, lt, pt, settings, done, success, total)
+        finished = True
+
+        if not should_cancel(uid):
+            await X.send_message(did, f"Batch Completed ✅ Success: {success}/{total}")
+
+    finally:
+        _CHECKPOINT_TS.pop(uid, None)
+        Z.pop(uid, None)
+        if not (job and job.lost):
+            await remove_active_batch(uid)
+        if finished:
+            # completed or stopped with /cancel; after a restart or an error
+            # the checkpoint is what the batch resumes from
+            try:
+                await delete_batch_checkpoint(uid)
+            except Exception:
+                pass
+
+async def resume_batch(uid: int, job: Optional[Job] = None) -> None:
+    cp = await get_batch_checkpoint(uid)
+    if not cp:
+        return
+    if not cp.get("cid"):
+        # only the progress fields were upserted: nothing to resume from
+        await delete_batch_checkpoint(uid)
+        return
+    did = int(cp.get("did") or uid)
+    i, lt = cp["cid"], cp["lt"]
+    begin, total = int(cp["start_id"]), int(cp["count"])
+    last_id = int(cp.get("last_id") or begin - 1)
+    next_id = max(last_id + 1, begin)
+    remaining = begin + total - next_id
+
+    if remaining <= 0:
+        await delete_batch_checkpoint(uid)
+        return
+    info = get_batch_info(uid)
+    if info and not (job and info.get("job_id") == str(job.id)):
+        # a batch of this user runs here and the checkpoint is its own; a
+        # record of this same job is left from a lease this node lost
+        return
+
+    ubot = await get_ubot(uid)
+    uc = await get_uclient(uid)
+    if not ubot or (lt == "private" and not uc):
+        await delete_batch_checkpoint(uid)
+        await X.send_message(did, "⚠️ Could not resume your batch (bot/login missing). Please start it again.")
+        return
+
+    await execute_batch(
+        ubot, uc, uid, did, i, next_id, remaining, lt,
+        done=int(cp.get("done") or (next_id - begin)),
+        success=int(cp.get("success") or 0),
+        total=total,
+        job=job,
+    )
+
+async def offer_resume(cp: Dict[str, Any]) -> None:
+    """Called on startup for every checkpoint left behind by the last run."""
+    uid = int(cp["user_id"])
+    did = int(cp.get("did") or uid)
+    if BATCH_AUTO_RESUME:
+        await JOBS.submit(BATCH, uid, resume=True)
+        return
+    done, total = int(cp.get("done") or 0), int(cp.get("count") or 0)
+    await X.send_message(
+        did,
+        f"⚠️ Bot restarted while your batch was running ({done}/{total} done).\nResume from where it stopped?",
+        reply_markup=InlineKeyboardMarkup([[
+            InlineKeyboardButton("▶️ Resume", callback_data="batch_resume"),
+            InlineKeyboardButton("🗑 Discard", callback_data="batch_discard"),
+        ]]),
+    )
+
+@X.on_callback_query(filters.regex(r"^batch_(resume|discard)$"))
+async def resume_cb(c: Client, q: CallbackQuery):
+    uid = q.from_user.id
+    action = q.data.split("_", 1)[1]
+    if not await get_batch_checkpoint(uid):
+        await q.answer("Nothing to resume.", show_alert=True)
+        return
+    if action == "discard":
+        await delete_batch_checkpoint(uid)
+        await q.message.edit_text("Batch discarded.")
+        return
+    if is_user_active(uid) or await JOBS.has(uid, BATCH):
+        await q.answer("A batch of yours is already queued or running.", show_alert=True)
+        return
+    await q.message.edit_text("Resuming batch..." if await JOBS.idle(BATCH) else f"Resume queued ({await JOBS.depth(BATCH)} ahead)...")
+    await JOBS.submit(BATCH, uid, resume=True)
+
+# --------------------------------------------------------------------------
+# Jobs (run by JOBS workers, never inside an update handler)
+# --------------------------------------------------------------------------
+async def run_batch_job(job: Job) -> None:
+    async with _sessions(job.user_id):
+        await _run_batch_job(job)
+
+
+async def _run_batch_job(job: Job) -> None:
+    uid, p = job.user_id, job.payload
+    if p.get("resume") or job.attempts > 1:
+        # a job taken over from a dead node carries on from its checkpoint
+        await resume_batch(uid, job)
+        return
+    did, lt = p["did"], p["lt"]
+    if is_user_active(uid):
+        return
+    ubot = await get_ubot(uid)
+    if not ubot:
+        await X.send_message(did, "Add your bot with /setbot first")
+        return
+    uc = await get_uclient(uid)
+    if lt == "private" and not uc:
+        await X.send_message(did, "❌ Login session missing/invalid. Please /login again.")
+        return
+    await execute_batch(ubot, uc, uid, did, p["cid"], p["start_id"], p["count"], lt, job=job)
+
+
+async def run_single_job(job: Job) -> None:
+    async with _sessions(job.user_id):
+        await _run_single_job(job)
+
+
+async def _run_single_job(job: Job) -> None:
+    uid, p = job.user_id, job.payload
+    i, d, lt = p["cid"], p["mid"], p["lt"]
+
+    async def edit(text: str):
+        # the status message is addressed by id: the job may run on another node
+        await X.edit_message_text(p["pt_chat"], p["pt_id"], text)
+
+    ubot = await get_ubot(uid)
+    if not ubot:
+        await edit("Add your bot /setbot `token`")
+        return
+    uc = await get_uclient(uid)  # for private must exist, for public optional
+    if lt == "private" and not uc:
+        await edit("❌ Login session missing/invalid. Please /login again.")
+        return
+
+    if p.get("queued"):
+        await edit("Processing...")
+    msg = await get_msg(ubot, uc, i, d, lt)
+    if not msg:
+        await edit("Message not found / deleted / no access.")
+        return
+
+    # Anti-duplicate (runtime)
+    seen = PROCESSED_KEYS.setdefault(uid, set())
+    key = f"{i}:{d}"
+    if key in seen:
+        await edit("Already processed (duplicate).")
+        return
+    seen.add(key)
+
+    settings = await load_user_settings(uid)
+    premium = await is_premium_user(uid)
+    with UB.hold(uid), UC.hold(uid):
+        res = await process_msg(ubot, uc or ubot, msg, p["did"], lt, uid, i, settings, slot=lambda: SCHEDULER.slot(uid, premium))
+    await edit(f"1/1: {res}")
+
+
+JOBS.register(BATCH, run_batch_job, on_cancel=lambda job: request_batch_cancel(job.user_id))
+JOBS.register(SINGLE, run_single_job)
+
 # --------------------------------------------------------------------------
 # Command handlers (KEEP commands)
 # --------------------------------------------------------------------------
@@ -497,8 +1299,6 @@ async def process_cmd(c: Client, m: Message):
     uid = m.from_user.id
     cmd = m.command[0]
 
-    cleanup_temp_images()
-
     if FREEMIUM_LIMIT == 0 and not await is_premium_user(uid):
         await m.reply_text("This bot does not provide free servies, get subscription from OWNER")
         return
@@ -515,12 +1315,11 @@ async def process_cmd(c: Client, m: Message):
     async with _lock(uid):
         pro = await m.reply_text("Doing some checks hold on...")
 
-        if is_user_active(uid):
+        if is_user_active(uid) or await JOBS.has(uid, BATCH):
             await pro.edit("You have an active task. Use /stop to cancel it.")
             return
 
-        ubot = await get_ubot(uid)
-        if not ubot:
+        if not await has_user_bot(uid):
             await pro.edit("Add your bot with /setbot first")
             return
 
@@ -530,13 +1329,30 @@ async def process_cmd(c: Client, m: Message):
 @X.on_message(filters.command(["cancel", "stop"]))
 async def cancel_cmd(c: Client, m: Message):
     uid = m.from_user.id
+    if await JOBS.cancel_pending(uid):
+        Z.pop(uid, None)
+        await m.reply_text("Queued task cancelled.")
+        return
+
     if is_user_active(uid):
         if await request_batch_cancel(uid):
+            # the record may be left from a batch another node took over
+            await JOBS.request_cancel(uid, BATCH)
             await m.reply_text("Cancellation requested. Batch will stop after current file completes.")
         else:
             await m.reply_text("Failed to request cancellation.")
         return
 
+    # running on another node: its worker sees the flag on the next heartbeat
+    if await JOBS.request_cancel(uid, BATCH):
+        await m.reply_text("Cancellation requested. Batch will stop after current file completes.")
+        return
+
+    # a running /dl or /adl stops at once: its yt-dlp process is killed
+    if await JOBS.request_cancel(uid, (YTDL_VIDEO, YTDL_AUDIO)):
+        await m.reply_text("Download cancelled.")
+        return
+
     # also cancel any pending conversational state
     if uid in Z:
         Z.pop(uid, None)
@@ -583,8 +1399,7 @@ async def text_handler(c: Client, m: Message):
     async with _lock(uid):
         step = Z[uid].get("step")
 
-        ubot = await get_ubot(uid)
-        if not ubot:
+        if not await has_user_bot(uid):
             await m.reply_text("Add your bot /setbot `token`")
             Z.pop(uid, None)
             return
@@ -634,31 +1449,13 @@ async def text_handler(c: Client, m: Message):
                 Z.pop(uid, None)
                 return
 
-            pt = await m.reply_text("Processing...")
-
-            uc = await get_uclient(uid)  # for private must exist, for public optional
-            if lt == "private" and not uc:
-                await pt.edit("❌ Login session missing/invalid. Please /login again.")
-                Z.pop(uid, None)
+            if await JOBS.has(uid, SINGLE):
+                await m.reply_text("Your previous link is still queued. Please wait.")
                 return
 
-            msg = await get_msg(ubot, uc, i, d, lt)
-            if not msg:
-                await pt.edit("Message not found / deleted / no access.")
-                Z.pop(uid, None)
-                return
-
-            # Anti-duplicate (runtime)
-            seen = PROCESSED_KEYS.setdefault(uid, set())
-            key = f"{i}:{d}"
-            if key in seen:
-                await pt.edit("Already processed (duplicate).")
-                Z.pop(uid, None)
-                return
-            seen.add(key)
-
-            res = await process_msg(ubot, uc or ubot, msg, m.chat.id, lt, uid, i)
-            await pt.edit(f"1/1: {res}")
+            queued = not await JOBS.idle(SINGLE)
+            pt = await m.reply_text(f"Queued ({await JOBS.depth(SINGLE)} ahead)..." if queued else "Processing...")
+            await JOBS.submit(SINGLE, uid, pt_chat=pt.chat.id, pt_id=pt.id, cid=i, mid=d, lt=lt, did=m.chat.id, queued=queued)
             Z.pop(uid, None)
             return
 
@@ -684,75 +1481,20 @@ async def text_handler(c: Client, m: Message):
                 Z.pop(uid, None)
                 return
 
-            uc = await get_uclient(uid)
-            if lt == "private" and not uc:
-                await m.reply_text("❌ Login session missing/invalid. Please /login again.")
-                Z.pop(uid, None)
-                return
-
-            if is_user_active(uid):
+            # the session itself is started and checked by the job, on the node that runs it
+            if is_user_active(uid) or await JOBS.has(uid, BATCH):
                 await m.reply_text("Active task exists. Use /stop first.")
                 Z.pop(uid, None)
                 return
 
-            pt = await m.reply_text("Processing batch...")
-
-            await add_active_batch(
-                uid,
-                {
-                    "total": count,
-                    "current": 0,
-                    "success": 0,
-                    "cancel_requested": False,
-                    "progress_message_id": pt.id,
-                },
-            )
-
-            success = 0
-            seen = PROCESSED_KEYS.setdefault(uid, set())
-
-            try:
-                for j in range(count):
-                    if should_cancel(uid):
-                        try:
-                            await pt.edit(f"Cancelled at {j}/{count}. Success: {success}")
-                        except Exception:
-                            pass
-                        break
-
-                    await update_batch_progress(uid, j, success)
-                    mid = start_id + j
-
-                    key = f"{i}:{mid}"
-                    if key in seen:
-                        continue
-                    seen.add(key)
-
-                    msg = await get_msg(ubot, uc, i, mid, lt)
-                    if not msg:
-                        # deleted/expired/no access -> skip
-                        try:
-                            await pt.edit(f"{j+1}/{count}: Skipped (not found/access). ✅ {success}")
-                        except Exception:
-                            pass
-                        await asyncio.sleep(2)
-                        continue
-
-                    res = await process_msg(ubot, uc or ubot, msg, m.chat.id, lt, uid, i)
-                    if "Done" in res or "Sent" in res or "Copied" in res:
-                        success += 1
-
-                    try:
-                        await pt.edit(f"{j+1}/{count}: {res} | ✅ {success}")
-                    except Exception:
-                        pass
-
-                    await asyncio.sleep(3)
+            Z.pop(uid, None)
+            queued = not await JOBS.idle(BATCH)
+            ahead = await JOBS.submit(BATCH, uid, cid=i, start_id=start_id, count=count, lt=lt, did=m.chat.id)
+            if queued:
+                await m.reply_text(f"Batch queued ({ahead} ahead). It starts as soon as a worker is free.")
+            return
 
-                if not should_cancel(uid):
-                    await m.reply_text(f"Batch Completed ✅ Success: {success}/{count}")
 
-            finally:
-                await remove_active_batch(uid)
-                Z.pop(uid, None)
-            return
+async def run_batch_plugin():
+    UB.start_sweeper()
+    UC.start_sweeper()
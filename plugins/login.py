@@ -3,6 +3,7 @@
 from pyrogram import Client, filters
 from pyrogram.types import Message
 from pyrogram.errors import BadRequest, SessionPasswordNeeded, PhoneCodeInvalid, PhoneCodeExpired, MessageNotModified
+import glob
 import logging
 import os
 from config import API_HASH, API_ID
@@ -47,8 +48,8 @@ async def set_bot_token(C, m):
                 del UB[user_id]  # Remove from dictionary
                 
             try:
-                if os.path.exists(f"user_{user_id}.session"):
-                    os.remove(f"user_{user_id}.session")
+                for path in glob.glob(f"user_{user_id}.session") + glob.glob(f"user_{user_id}_*.session"):
+                    os.remove(path)
             except Exception:
                 pass
             
@@ -77,8 +78,8 @@ async def rem_bot_token(C, m):
                 del UB[user_id]  # Remove from dictionary # Remove from dictionary
             print(f"Stopped and removed old bot for user {user_id}")
             try:
-                if os.path.exists(f"user_{user_id}.session"):
-                    os.remove(f"user_{user_id}.session")
+                for path in glob.glob(f"user_{user_id}.session") + glob.glob(f"user_{user_id}_*.session"):
+                    os.remove(path)
             except Exception:
                 pass
         except Exception as e:
@@ -86,8 +87,8 @@ async def rem_bot_token(C, m):
             if UB.get(user_id, None):
                 del UB[user_id]  # Remove from dictionary  # Remove from dictionary
             try:
-                if os.path.exists(f"user_{user_id}.session"):
-                    os.remove(f"user_{user_id}.session")
+                for path in glob.glob(f"user_{user_id}.session") + glob.glob(f"user_{user_id}_*.session"):
+                    os.remove(path)
             except Exception:
                 pass
     await remove_user_bot(user_id)
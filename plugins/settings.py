@@ -111,7 +111,8 @@ __👉 **Note:** if you are using custom bot then your bot should be admin that
                     'rename_tag': '',
                     'caption': '',
                     'chat_id': ''
-                }}
+                },
+                 '$inc': {'settings_rev': 1}}
             )
             thumbnail_path = f'{user_id}.jpg'
             if os.path.exists(thumbnail_path):
@@ -228,37 +229,46 @@ def generate_random_name(length=7):
     return ''.join(random.choice(characters) for _ in range(length))
 
 
-async def rename_file(file, sender, edit):
-    try:
+async def renamed_name(file, sender, settings=None):
+    if settings is not None:
+        delete_words = list(settings.delete_words)
+        custom_rename_tag = settings.rename_tag
+        replacements = dict(settings.replacement_words)
+    else:
         delete_words = await get_user_data_key(sender, 'delete_words', [])
         custom_rename_tag = await get_user_data_key(sender, 'rename_tag', '')
         replacements = await get_user_data_key(sender, 'replacement_words', {})
-        
-        last_dot_index = str(file).rfind('.')
-        if last_dot_index != -1 and last_dot_index != 0:
-            ggn_ext = str(file)[last_dot_index + 1:]
-            if ggn_ext.isalpha() and len(ggn_ext) <= 9:
-                if ggn_ext.lower() in VIDEO_EXTENSIONS:
-                    original_file_name = str(file)[:last_dot_index]
-                    file_extension = 'mp4'
-                else:
-                    original_file_name = str(file)[:last_dot_index]
-                    file_extension = ggn_ext
-            else:
+    
+    last_dot_index = str(file).rfind('.')
+    if last_dot_index != -1 and last_dot_index != 0:
+        ggn_ext = str(file)[last_dot_index + 1:]
+        if ggn_ext.isalpha() and len(ggn_ext) <= 9:
+            if ggn_ext.lower() in VIDEO_EXTENSIONS:
                 original_file_name = str(file)[:last_dot_index]
                 file_extension = 'mp4'
+            else:
+                original_file_name = str(file)[:last_dot_index]
+                file_extension = ggn_ext
         else:
-            original_file_name = str(file)
+            original_file_name = str(file)[:last_dot_index]
             file_extension = 'mp4'
-        
-        for word in delete_words:
-            original_file_name = original_file_name.replace(word, '')
-        
-        for word, replace_word in replacements.items():
-            original_file_name = original_file_name.replace(word, replace_word)
-        
-        new_file_name = f'{original_file_name} {custom_rename_tag}.{file_extension}'
-        
+    else:
+        original_file_name = str(file)
+        file_extension = 'mp4'
+    
+    for word in delete_words:
+        original_file_name = original_file_name.replace(word, '')
+    
+    for word, replace_word in replacements.items():
+        original_file_name = original_file_name.replace(word, replace_word)
+    
+    return f'{original_file_name} {custom_rename_tag}.{file_extension}'
+
+
+async def rename_file(file, sender, edit, settings=None):
+    try:
+        # rules apply to the file name, never to the directory it sits in
+        new_file_name = os.path.join(os.path.dirname(file), os.path.basename(await renamed_name(os.path.basename(file), sender, settings)))
         os.rename(file, new_file_name)
         return new_file_name
     except Exception as e:
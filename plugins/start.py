@@ -8,6 +8,14 @@ from config import LOG_GROUP, OWNER_ID, FORCE_SUB
 
 from utils.func import is_user_banned_db, save_user_data, unban_user_db, unban_all_users_db, reset_warnings_db, get_banned_user_ids, get_banned_count
 from pyrogram.errors import FloodWait, MessageNotModified
+from utils.rpc import RPC
+from utils.probe import PROBE
+from utils.media_jobs import MEDIA_JOBS
+from utils.workspace import WORKSPACES
+from utils.admission import ADMISSION
+from utils.scheduler import SCHEDULER
+from utils.job_queue import JOBS
+from utils.ytdl_pool import YTDL_POOL
 from utils.func import users_collection, add_premium_user
 
 # /bstats live updater tasks (per chat)
@@ -27,8 +35,8 @@ def _bstats_bar(pct: int, width: int = 20) -> str:
     return "█" * filled + "░" * (width - filled)
 
 
-def _bstats_render(active, pending, ytdl) -> str:
-    running = (len(active) + len(pending) + len(ytdl)) > 0
+def _bstats_render(active, pending, ytdl, rpc=None, pools=None, probe=None, media=None, ws=None, admission=None, sched=None, jobs=None, ytdlp=None) -> str:
+    running = (len(active) + len(pending) + len(ytdl)) > 0 or bool(jobs and (jobs["running"] or jobs["queued"]))
     header = [
         "━━━━━━━━━━━━━━━━━━━━",
         "📊 **TASK REPORT**",
@@ -54,6 +62,46 @@ def _bstats_render(active, pending, ytdl) -> str:
             body.append(f"`{_bstats_bar(pct)}`")
             body.append("")
 
+    if rpc:
+        blocked = [k for k, v in rpc.items() if v["blocked_for"] > 0]
+        queued = sum(v["queued"] for v in rpc.values())
+        busiest = sorted(rpc.items(), key=lambda kv: (-kv[1]["queued"], kv[1]["rate"]))[:3]
+        body.append(f"⏱ **RPC**  `📥 {queued} queued`  `⛔ {len(blocked)} in FloodWait`")
+        for k, v in busiest:
+            body.append(f"`{k}`  `q{v['queued']}`  `{v['rate']}/s`  `floods {v['floods']}`")
+
+    for name, v in (pools or {}).items():
+        body.append(f"🔌 **{name}**  `{v['size']}/{v['max']}`  `hit {v['hits']}`  `miss {v['misses']}`  `evicted {v['evicted_lru'] + v['evicted_idle']}`")
+
+    if probe and probe["calls"]:
+        body.append(f"🎞 **Probe**  `{probe['backend']}`  `{probe['probes']} run`  `{probe['hits']} cached`  `avg {probe['avg_ms']}ms`  `p95 {probe['p95_ms']}ms`")
+
+    if media and media["kinds"]:
+        body.append(f"⚙️ **ffmpeg**  `{media['running']}/{media['workers']} running`  `{media['queued']} queued`")
+        for k, v in media["kinds"].items():
+            body.append(f"`{k}`  `{v['jobs']} jobs`  `wait {v['avg_wait_ms']}ms`  `run {v['avg_run_ms']}ms`  `✖{v['failed'] + v['timeouts']}`")
+
+    if ytdlp and ytdlp["requests"]:
+        body.append(f"📺 **yt-dlp**  `{ytdlp['busy']}/{ytdlp['workers']} processes`  `{ytdlp['queued']} queued`  `wait {ytdlp['avg_wait_ms']}ms`  `run {ytdlp['avg_run_ms']}ms`  `✖{ytdlp['failed']}`  `info {ytdlp['info_hits']} cached`")
+
+    if ws and ws["active"]:
+        body.append(f"📁 **Workspaces**  `{ws['active']} open`  `{ws['bytes'] / (1024 * 1024):.1f} MB`  `{ws['tmpfs']} on tmpfs`")
+
+    if admission and (admission["running"] or admission["waiting"]):
+        body.append(f"🚦 **Admission**  `{admission['running']}/{admission['max']} transfers`  `💾 {admission['reserved_disk'] / (1024 * 1024):.0f} MB`  `⏸ {len(admission['waiting'])} waiting`")
+        for label, reason in admission["waiting"][:3]:
+            body.append(f"`{label}`  `{reason}`")
+
+    if sched and (sched["running"] or sched["users"]):
+        p, f = sched["lanes"]["premium"], sched["lanes"]["free"]
+        body.append(f"⚖️ **Scheduler**  `{sched['running']}/{sched['slots']} slots`  `💎 q{p['queued']} {p['avg_wait_ms']}ms`  `🆓 q{f['queued']} {f['avg_wait_ms']}ms`")
+
+    if jobs and (jobs["running"] or jobs["queued"]):
+        where = f"{jobs['running']} running on {jobs['nodes']} nodes" if jobs.get("store") == "mongo" else f"{jobs['running']}/{jobs['workers']} running"
+        body.append(f"🧵 **Jobs**  `{where}`  `📥 {jobs['queued']} queued`  `oldest {jobs['oldest_wait_s']}s`")
+        for k, v in jobs["kinds"].items():
+            body.append(f"`{k}`  `q{v['queued']}`  `run {v['running']}`  `wait {v['avg_wait_ms']}ms`")
+
     return "\n".join(header + body).rstrip()
 
 
@@ -74,7 +122,7 @@ async def _bstats_live_update(client, msg):
         active = batch_mod.ACTIVE_USERS or {}
         pending = batch_mod.Z or {}
         ytdl = ytdl_mod.ongoing_downloads or {}
-        text = _bstats_render(active, pending, ytdl)
+        text = _bstats_render(active, pending, ytdl, RPC.snapshot(), {p.name: p.snapshot() for p in (batch_mod.UB, batch_mod.UC)}, PROBE.snapshot(), MEDIA_JOBS.snapshot(), WORKSPACES.snapshot(), ADMISSION.snapshot(), SCHEDULER.snapshot(), await JOBS.snapshot(), YTDL_POOL.snapshot())
         try:
             await msg.edit_text(text, disable_web_page_preview=True)
         except MessageNotModified:
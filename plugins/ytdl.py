@@ -1,5 +1,4 @@
 
-import yt_dlp
 import os
 import tempfile
 import time
@@ -15,9 +14,13 @@ from telethon import events
 from telethon.sync import TelegramClient
 from telethon.tl.types import DocumentAttributeVideo
 from utils.func import get_video_metadata, screenshot, cleanup_temp_file
+from utils.media_jobs import MEDIA_JOBS, MediaJobError, PRIORITY_TRANSCODE
+from utils.workspace import WORKSPACES
+from utils.job_queue import JOBS, Job, YTDL_VIDEO, YTDL_AUDIO
+from utils.ytdl_pool import YTDL_POOL, YtdlError
+from utils.ytdl_cache import YTDL_CACHE
 from telethon.tl.functions.messages import EditMessageRequest
 from devgagantools import fast_upload
-from concurrent.futures import ThreadPoolExecutor
 import aiohttp 
 import aiofiles
 from config import YT_COOKIES, INSTA_COOKIES
@@ -74,8 +77,8 @@ def resolve_cookies(cookies_env_var: Optional[str]):
 
  
  
-thread_pool = ThreadPoolExecutor()
 ongoing_downloads = {}
+YTDL_KINDS = (YTDL_VIDEO, YTDL_AUDIO)
  
 def d_thumbnail(thumbnail_url, save_path):
     try:
@@ -98,11 +101,63 @@ async def download_thumbnail_async(url, path):
                     f.write(await response.read())
  
  
-async def extract_audio_async(ydl_opts, url):
-    def sync_extract():
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            return ydl.extract_info(url, download=True)
-    return await asyncio.get_event_loop().run_in_executor(thread_pool, sync_extract)
+async def send_cached(client, chat_id, progress_message, cache_key, caption):
+    # the same video and format was uploaded recently: resend it, nothing is downloaded
+    doc = await YTDL_CACHE.lookup(cache_key)
+    if doc and await YTDL_CACHE.send(client, doc, chat_id, caption):
+        await progress_message.delete()
+        return True
+    return False
+
+
+async def download_with_info(url, info_dict, cached, ydl_opts, on_progress=None, tag=""):
+    # one extraction per link: the child downloads from the info dict it already has
+    try:
+        return await YTDL_POOL.download(info_dict, ydl_opts, on_progress)
+    except YtdlError:
+        if not cached:
+            raise
+        # a cached dict's media URLs may have expired: extract once more
+        YTDL_POOL.forget(url, tag)
+        info_dict, _ = await YTDL_POOL.extract(url, ydl_opts, tag)
+        return await YTDL_POOL.download(info_dict, ydl_opts, on_progress)
+
+
+def download_progress(message, label):
+    # edits `message` from the yt-dlp child's progress events, at most every few seconds
+    last = [0.0]
+
+    async def on_progress(p):
+        now = time.time()
+        if p.get("status") != "downloading" or now - last[0] < 5 or not p.get("total"):
+            return
+        last[0] = now
+        pct = 100 * p["downloaded"] / p["total"]
+        speed = (p.get("speed") or 0) / (1024 * 1024)
+        await message.edit(
+            f"**__{label}...__**\n\n"
+            f"**__Progress:__** {pct:.1f}% of {p['total'] / (1024 * 1024):.1f} MB\n"
+            f"**__Speed:__** {speed:.2f} MB/s  **__ETA:__** {int(p.get('eta') or 0)}s"
+        )
+    return on_progress
+ 
+ 
+async def convert_to_mp3(src, dst, quality="192"):
+    # what FFmpegExtractAudio did inside yt-dlp, as a bounded pool job
+    code, _, err = await MEDIA_JOBS.run(
+        ["ffmpeg", "-y", "-i", src, "-vn", "-codec:a", "libmp3lame", "-b:a", f"{quality}k", dst],
+        priority=PRIORITY_TRANSCODE,
+        kind="extract_audio",
+    )
+    if code != 0:
+        raise MediaJobError(err.decode(errors="ignore").strip()[-200:] or "ffmpeg failed")
+
+
+def downloaded_path(info_dict, fallback=None):
+    for d in info_dict.get('requested_downloads') or []:
+        if d.get('filepath'):
+            return d['filepath']
+    return info_dict.get('filepath') or fallback
  
  
 def get_random_string(length=7):
@@ -125,25 +180,35 @@ async def process_audio(client, event, url, cookies_env_var=None):
             temp_cookie_path = temp_cookie_file.name
  
     start_time = time.time()
+    ws = WORKSPACES.open(f"adl-{event.sender_id}")
     random_filename = f"@eurnyme_{event.sender_id}"
-    download_path = f"{random_filename}.mp3"
+    download_path = ws.file(f"{random_filename}.mp3")
  
     ydl_opts = {
         'format': 'bestaudio/best',
-        'outtmpl': f"{random_filename}.%(ext)s",
+        'outtmpl': os.path.join(ws.path, f"{random_filename}.%(ext)s"),
         'cookiefile': temp_cookie_path,
-        'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '192'}],
         'quiet': False,
         'noplaylist': True,
     }
     prog = None
+    source_path = None
  
     progress_message = await event.reply("**__Starting audio extraction...__**")
  
     try:
-         
-        info_dict = await extract_audio_async(ydl_opts, url)
+        tag = cookies_env_var or ""
+        info_dict, cached = await YTDL_POOL.extract(url, ydl_opts, tag)
         title = info_dict.get('title', 'Extracted Audio')
+        caption = f"**{title}**\n\n**__Powered by AZ BOTS ADDA__**"
+        cache_key = YTDL_CACHE.key(info_dict, ydl_opts['format'], "mp3")
+        if await send_cached(client, event.chat_id, progress_message, cache_key, caption):
+            return
+        info_dict = await download_with_info(url, info_dict, cached, ydl_opts, download_progress(progress_message, "Downloading audio"), tag)
+        source_path = downloaded_path(info_dict)
+        if source_path and os.path.exists(source_path) and source_path != download_path:
+            await progress_message.edit("**__Converting to mp3...__**")
+            await convert_to_mp3(source_path, download_path)
  
         await progress_message.edit("**__Editing metadata...__**")
  
@@ -161,7 +226,7 @@ async def process_audio(client, event, url, cookies_env_var=None):
  
                 thumbnail_url = info_dict.get('thumbnail')
                 if thumbnail_url:
-                    thumbnail_path = os.path.join(tempfile.gettempdir(), "thumb.jpg")
+                    thumbnail_path = ws.file("thumb.jpg")
                     asyncio.run(download_thumbnail_async(thumbnail_url, thumbnail_path))
                     with open(thumbnail_path, 'rb') as img:
                         audio_file.tags["APIC"] = APIC(
@@ -185,7 +250,8 @@ async def process_audio(client, event, url, cookies_env_var=None):
                 name=None,
                 progress_bar_function=lambda done, total: progress_callback(done, total, chat_id)
             )
-            await client.send_file(chat_id, uploaded, caption=f"**{title}**\n\n**__Powered by AZ BOTS ADDA__**")
+            sent = await client.send_file(chat_id, uploaded, caption=caption)
+            await YTDL_CACHE.store(client, cache_key, sent, os.path.getsize(download_path))
             if prog:
                 await prog.delete()
         else:
@@ -195,15 +261,14 @@ async def process_audio(client, event, url, cookies_env_var=None):
         logger.exception("Error during audio extraction or upload")
         await event.reply(f"**__An error occurred: {e}__**")
     finally:
-        if os.path.exists(download_path):
-            os.remove(download_path)
+        ws.cleanup()
         if temp_cookie_path and os.path.exists(temp_cookie_path):
             os.remove(temp_cookie_path)
  
 @client.on(events.NewMessage(pattern="/adl"))
 async def handler(event):
     user_id = event.sender_id
-    if user_id in ongoing_downloads:
+    if user_id in ongoing_downloads or await JOBS.has(user_id, YTDL_KINDS):
         await event.reply("**You already have an ongoing download. Please wait until it completes!**")
         return
  
@@ -217,8 +282,21 @@ async def handler(event):
         ongoing_downloads.pop(user_id, None)
         return
 
-    ongoing_downloads[user_id] = True
- 
+    if not await JOBS.idle(YTDL_AUDIO):
+        await event.reply(f"**__Queued ({await JOBS.depth(YTDL_AUDIO)} ahead). Starting as soon as a worker is free...__**")
+    await JOBS.submit(YTDL_AUDIO, user_id, chat_id=event.chat_id, msg_id=event.id, url=url)
+
+
+async def job_event(job: Job):
+    # jobs carry ids, not the update: the worker may be another node
+    return await client.get_messages(job.payload["chat_id"], ids=job.payload["msg_id"])
+
+
+async def run_audio_job(job: Job):
+    event, url = await job_event(job), job.payload["url"]
+    if event is None:
+        return
+    ongoing_downloads[job.user_id] = True
     try:
         if "instagram.com" in url:
             await process_audio(client, event, url, cookies_env_var="INSTA_COOKIES")
@@ -229,31 +307,26 @@ async def handler(event):
     except Exception as e:
         await event.reply(f"**An error occurred:** `{e}`")
     finally:
-        ongoing_downloads.pop(user_id, None)
- 
+        ongoing_downloads.pop(job.user_id, None)
  
-async def fetch_video_info(url, ydl_opts, progress_message, check_duration_and_size):
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info_dict = ydl.extract_info(url, download=False)
  
-        if check_duration_and_size:
-             
-            duration = info_dict.get('duration', 0)
-            if duration and duration > 3 * 3600:   
-                await progress_message.edit("**❌ __Video is longer than 3 hours. Download aborted...__**")
-                return None
+async def fetch_video_info(url, ydl_opts, progress_message, check_duration_and_size, tag=""):
+    info_dict, cached = await YTDL_POOL.extract(url, ydl_opts, tag)
  
-             
-            estimated_size = info_dict.get('filesize_approx', 0)
-            if estimated_size and estimated_size > 2 * 1024 * 1024 * 1024:   
-                await progress_message.edit("**🤞 __Video size is larger than 2GB. Aborting download.__**")
-                return None
+    if check_duration_and_size:
+         
+        duration = info_dict.get('duration', 0)
+        if duration and duration > 3 * 3600:   
+            await progress_message.edit("**❌ __Video is longer than 3 hours. Download aborted...__**")
+            return None, cached
  
-        return info_dict
+         
+        estimated_size = info_dict.get('filesize_approx', 0)
+        if estimated_size and estimated_size > 2 * 1024 * 1024 * 1024:   
+            await progress_message.edit("**🤞 __Video size is larger than 2GB. Aborting download.__**")
+            return None, cached
  
-def download_video(url, ydl_opts):
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        ydl.download([url])
+    return info_dict, cached
  
  
 @client.on(events.NewMessage(pattern="/dl"))
@@ -261,7 +334,7 @@ async def handler(event):
     user_id = event.sender_id
  
      
-    if user_id in ongoing_downloads:
+    if user_id in ongoing_downloads or await JOBS.has(user_id, YTDL_KINDS):
         await event.reply("**You already have an ongoing ytdlp download. Please wait until it completes!**")
         return
  
@@ -275,11 +348,16 @@ async def handler(event):
         await event.reply(telegram_block_text())
         return
      
-    ongoing_downloads[user_id] = True
+    if not await JOBS.idle(YTDL_VIDEO):
+        await event.reply(f"**__Queued ({await JOBS.depth(YTDL_VIDEO)} ahead). Starting as soon as a worker is free...__**")
+    await JOBS.submit(YTDL_VIDEO, user_id, chat_id=event.chat_id, msg_id=event.id, url=url)
 
 
- 
-     
+async def run_video_job(job: Job):
+    event, url = await job_event(job), job.payload["url"]
+    if event is None:
+        return
+    ongoing_downloads[job.user_id] = True
     try:
         if "instagram.com" in url:
             await process_video(client, event, url, "INSTA_COOKIES", check_duration_and_size=False)
@@ -291,8 +369,11 @@ async def handler(event):
     except Exception as e:
         await event.reply(f"**An error occurred:** `{e}`")
     finally:
-         
-        ongoing_downloads.pop(user_id, None)
+        ongoing_downloads.pop(job.user_id, None)
+
+
+JOBS.register(YTDL_AUDIO, run_audio_job)
+JOBS.register(YTDL_VIDEO, run_video_job)
  
  
  
@@ -375,8 +456,9 @@ async def process_video(client, event, url, cookies_env_var, check_duration_and_
     
  
      
+    ws = WORKSPACES.open(f"dl-{event.sender_id}")
     random_filename = get_random_string() + ".mp4"
-    download_path = os.path.abspath(random_filename)
+    download_path = ws.file(random_filename)
     logger.info(f"Generated random download path: {download_path}")
  
      
@@ -406,12 +488,16 @@ async def process_video(client, event, url, cookies_env_var, check_duration_and_
     progress_message = await event.reply("**__Starting download...__**")
     logger.info("Starting the download process...")
     try:
-        info_dict = await fetch_video_info(url, ydl_opts, progress_message, check_duration_and_size)
+        tag = cookies_env_var or ""
+        info_dict, cached = await fetch_video_info(url, ydl_opts, progress_message, check_duration_and_size, tag)
         if not info_dict:
             return
-         
-        await asyncio.to_thread(download_video, url, ydl_opts)
         title = info_dict.get('title', 'Powered by AZ BOTS ADDA')
+        cache_key = YTDL_CACHE.key(info_dict, ydl_opts['format'], "video")
+        if await send_cached(client, event.chat_id, progress_message, cache_key, f"**{title}**"):
+            return
+         
+        await download_with_info(url, info_dict, cached, ydl_opts, download_progress(progress_message, "Downloading"), tag)
         k = await get_video_metadata(download_path)      
         W = k['width']
         H = k['height']
@@ -424,7 +510,7 @@ async def process_video(client, event, url, cookies_env_var, check_duration_and_
  
          
         if thumbnail_url:
-            thumbnail_file = os.path.join(tempfile.gettempdir(), get_random_string() + ".jpg")
+            thumbnail_file = ws.file(get_random_string() + ".jpg")
             downloaded_thumb = d_thumbnail(thumbnail_url, thumbnail_file)
             if downloaded_thumb:
                 logger.info(f"Thumbnail saved at: {downloaded_thumb}")
@@ -453,7 +539,7 @@ async def process_video(client, event, url, cookies_env_var, check_duration_and_
                 reply=prog,
                 progress_bar_function=lambda done, total: progress_callback(done, total, chat_id)
             )
-            await client.send_file(
+            sent = await client.send_file(
                 event.chat_id,
                 uploaded,
                 caption=f"**{title}**",
@@ -467,6 +553,7 @@ async def process_video(client, event, url, cookies_env_var, check_duration_and_
                 ],
                 thumb=THUMB if THUMB else None
             )
+            await YTDL_CACHE.store(client, cache_key, sent, os.path.getsize(download_path))
             if prog:
                 await prog.delete()
         else:
@@ -475,13 +562,10 @@ async def process_video(client, event, url, cookies_env_var, check_duration_and_
         logger.exception("An error occurred during download or upload.")
         await event.reply(f"**__An error occurred: {e}__**")
     finally:
-         
-        if os.path.exists(download_path):
-            os.remove(download_path)
+        # the video, yt-dlp's thumbnail and the screenshot all live in ws
+        ws.cleanup()
         if temp_cookie_path and os.path.exists(temp_cookie_path):
             os.remove(temp_cookie_path)
-        if thumbnail_file and os.path.exists(thumbnail_file):
-            os.remove(thumbnail_file)
         cleanup_temp_file(thumb_for_cleanup, event.sender_id)
  
 
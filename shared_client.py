@@ -8,25 +8,57 @@ from config import (
     TELETHON_SESSION,
     PYRO_SESSION,
     USERBOT_SESSION,
+    DOWNLOAD_CONNECTIONS,
+    NODE_ROLE,
+    JOB_STORE,
 )
 from pyrogram import Client
+from utils.rpc import RPC
+from utils.leases import SESSION_LEASES
+import asyncio
 import sys
 
-client = TelegramClient(TELETHON_SESSION, API_ID, API_HASH)
-app = Client(PYRO_SESSION, api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
-userbot = Client(USERBOT_SESSION, api_id=API_ID, api_hash=API_HASH, session_string=STRING)
+# a worker node only runs jobs: the frontend alone receives updates
+UPDATES = NODE_ROLE != "worker"
 
-async def start_client():
-    if not client.is_connected():
-        await client.start(bot_token=BOT_TOKEN)
-        print("SpyLib started...")
-    if STRING:
+client = TelegramClient(TELETHON_SESSION, API_ID, API_HASH, receive_updates=UPDATES)
+app = Client(PYRO_SESSION, api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN, max_concurrent_transmissions=DOWNLOAD_CONNECTIONS, no_updates=not UPDATES)
+userbot = Client(USERBOT_SESSION, api_id=API_ID, api_hash=API_HASH, session_string=STRING, max_concurrent_transmissions=DOWNLOAD_CONNECTIONS, no_updates=not UPDATES)
+
+# every outbound call goes through the FloodWait-aware scheduler
+RPC.install(client, TELETHON_SESSION)
+RPC.install(app)
+RPC.install(userbot)
+
+_background = []
+
+async def run_userbot():
+    # one STRING session, several nodes: it runs where the lease is, the
+    # other workers stand by and take over once that node stops renewing it
+    async with SESSION_LEASES.share("userbot"):
         try:
             await userbot.start()
             print("Userbot started...")
         except Exception as e:
             print(f"Hey honey!! check your premium string session, it may be invalid of expire {e}")
-            sys.exit(1)
+            return
+        await asyncio.Event().wait()
+
+async def start_client():
+    if not client.is_connected():
+        await client.start(bot_token=BOT_TOKEN)
+        print("SpyLib started...")
+    # a frontend only takes commands: the userbot runs where files are transferred
+    if STRING and NODE_ROLE != "frontend":
+        if JOB_STORE == "mongo":
+            _background.append(asyncio.create_task(run_userbot()))
+        else:
+            try:
+                await userbot.start()
+                print("Userbot started...")
+            except Exception as e:
+                print(f"Hey honey!! check your premium string session, it may be invalid of expire {e}")
+                sys.exit(1)
     await app.start()
     print("Pyro App Started...")
     return client, app, userbot
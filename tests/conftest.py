@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the bot runs from the repository root (`python main.py`); import its modules the same way
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from utils.admission import AdmissionController, AdmissionError, DISK, MEMORY, MB
+
+
+def controller(free_mb=1000, max_transfers=3):
+    a = AdmissionController(max_transfers=max_transfers, disk_free=0, mem_free=0, poll=0.02)
+    a.free = free_mb * MB
+    a._disk_free = lambda path: a.free
+    a._mem_available = lambda: 10_000 * MB
+    a._dev = lambda path: 1
+    return a
+
+
+def test_written_bytes_are_not_reserved_twice():
+    async def scenario():
+        a = controller()
+        first = await a.acquire(DISK, 600 * MB, path="/ws")
+        first.written, a.free = 500 * MB, 500 * MB  # 500 MB of it already on disk
+        await asyncio.wait_for(a.acquire(DISK, 300 * MB, path="/ws"), 1)
+        assert a.snapshot()["reserved_disk"] == 400 * MB
+
+    asyncio.run(scenario())
+
+
+def test_earlier_batch_item_ignores_later_ones_and_what_they_wrote():
+    async def scenario():
+        a = controller()
+        later = await a.acquire(DISK, 800 * MB, path="/ws", order=("u", 5))
+        later.written, a.free = 800 * MB, 200 * MB
+        # would deadlock if seq 2 waited for seq 5, which waits for seq 2's turn to send
+        await asyncio.wait_for(a.acquire(DISK, 900 * MB, path="/ws", order=("u", 2)), 1)
+
+    asyncio.run(scenario())
+
+
+def test_batch_items_go_in_seq_order_whatever_order_they_arrive_in():
+    async def scenario():
+        a = controller()
+        hog = await a.acquire(DISK, 900 * MB, path="/ws")
+        started = []
+
+        async def want(name, **kw):
+            t = await a.acquire(DISK, 500 * MB, path="/ws", **kw)
+            started.append(name)
+            return t
+
+        tasks = []
+        for name, kw in (("X2", {"order": ("X", 2)}), ("Y", {}), ("X1", {"order": ("X", 1)})):
+            tasks.append(asyncio.create_task(want(name, **kw)))
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+        assert started == []
+        a.release(hog)
+        while len(started) < 3:
+            await asyncio.sleep(0.01)
+            for t in list(a._held.values()):
+                a.release(t)
+        await asyncio.wait_for(asyncio.gather(*tasks), 1)
+        assert started == ["X1", "X2", "Y"]
+
+    asyncio.run(scenario())
+
+
+def test_a_later_request_passes_only_when_it_needs_something_else():
+    async def scenario():
+        a = controller()
+        hog = await a.acquire(DISK, 900 * MB, path="/ws")
+        disk = asyncio.create_task(a.acquire(DISK, 500 * MB, path="/ws"))
+        await asyncio.sleep(0.05)
+        # memory is free and the disk waiter keeps a slot: no reason to wait
+        await asyncio.wait_for(a.acquire(MEMORY, 100 * MB), 1)
+        # another disk request queues behind the earlier one
+        second = asyncio.create_task(a.acquire(DISK, 10 * MB, path="/ws"))
+        await asyncio.sleep(0.05)
+        assert not second.done()
+        a.release(hog)
+        await asyncio.wait_for(asyncio.gather(disk, second), 1)
+
+    asyncio.run(scenario())
+
+
+def test_slots_are_limited_and_released():
+    async def scenario():
+        a = controller(max_transfers=2)
+        t1 = await a.acquire(MEMORY, MB)
+        await a.acquire(MEMORY, MB)
+        third = asyncio.create_task(a.acquire(MEMORY, MB))
+        await asyncio.sleep(0.05)
+        assert not third.done()
+        a.release(t1)
+        await asyncio.wait_for(third, 1)
+
+    asyncio.run(scenario())
+
+
+def test_a_file_larger_than_the_disk_is_rejected():
+    async def scenario():
+        a = controller(free_mb=100)
+        with pytest.raises(AdmissionError):
+            await a.acquire(DISK, 500 * MB, path="/ws")
+
+    asyncio.run(scenario())
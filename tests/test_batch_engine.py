@@ -0,0 +1,69 @@
+import asyncio
+import random
+
+from utils.batch_engine import BatchEngine
+
+
+def run_batch(n, *, cancel_after=None, missing=(), fetch_chunk=1, download_delay=0.002, **kw):
+    """Runs a BatchEngine over `n` ids with fake stages; returns what each stage saw."""
+    seen = {"downloaded": 0, "delivered": 0, "max_ahead": 0, "sent": [], "results": [], "fetch_calls": 0}
+
+    async def fetch(ids):
+        seen["fetch_calls"] += 1
+        await asyncio.sleep(0.001)
+        return [None if i in missing else {"id": i} for i in ids]
+
+    async def download(item):
+        await asyncio.sleep(random.random() * download_delay)
+        seen["downloaded"] += 1
+        seen["max_ahead"] = max(seen["max_ahead"], seen["downloaded"] - seen["delivered"])
+
+    async def upload(item):
+        await asyncio.sleep(random.random() * download_delay)
+        await item.turn()
+        seen["sent"].append(item.msg_id)
+        return "Done"
+
+    async def on_result(item):
+        seen["delivered"] += 1
+        seen["results"].append((item.msg_id, item.result))
+
+    engine = BatchEngine(
+        list(range(n)), fetch, download, upload,
+        fetch_chunk=fetch_chunk, on_result=on_result,
+        should_cancel=lambda: cancel_after is not None and len(seen["results"]) >= cancel_after,
+        **kw,
+    )
+    asyncio.run(asyncio.wait_for(engine.run(), 30))
+    seen["window"] = engine.window
+    return seen
+
+
+def test_delivers_in_source_order_with_parallel_stages():
+    seen = run_batch(200, fetch_workers=2, download_workers=4, upload_workers=3, queue_size=4)
+    assert seen["sent"] == list(range(200))
+    assert [i for i, _ in seen["results"]] == list(range(200))
+    assert all(r == "Done" for _, r in seen["results"])
+
+
+def test_missing_messages_keep_their_place():
+    seen = run_batch(30, missing={3, 17}, download_workers=3, upload_workers=2)
+    assert [i for i, _ in seen["results"]] == list(range(30))
+    assert 3 not in seen["sent"] and 17 not in seen["sent"]
+    assert dict(seen["results"])[3] is None
+
+
+def test_run_ahead_is_bounded_by_the_window_not_the_fetch_chunk():
+    seen = run_batch(400, fetch_chunk=200, fetch_workers=2, download_workers=4, upload_workers=2, queue_size=4)
+    assert seen["fetch_calls"] == 2  # one get_messages per 200 ids
+    assert seen["max_ahead"] <= seen["window"]
+    assert seen["sent"] == list(range(400))
+
+
+def test_cancel_stops_after_a_contiguous_prefix():
+    seen = run_batch(500, cancel_after=40, fetch_chunk=50, fetch_workers=2, download_workers=4, upload_workers=2)
+    ids = [i for i, _ in seen["results"]]
+    assert 40 <= len(ids) < 500
+    assert ids == list(range(len(ids)))
+    # nothing past the window was downloaded after the cancel
+    assert seen["downloaded"] <= len(ids) + seen["window"]
@@ -0,0 +1,91 @@
+import asyncio
+
+from utils.job_queue import JobQueue, BATCH, SINGLE, YTDL_VIDEO
+
+
+def queue():
+    return JobQueue(workers=1, single_workers=1, ytdl_workers=1, store="memory", role="all")
+
+
+def test_short_jobs_do_not_wait_behind_a_batch():
+    async def scenario():
+        q, log, gate = queue(), [], asyncio.Event()
+
+        async def batch(job):
+            await gate.wait()
+            log.append(("batch", job.user_id))
+
+        async def short(job):
+            log.append((job.kind, job.user_id))
+
+        q.register(BATCH, batch)
+        q.register(SINGLE, short)
+        q.register(YTDL_VIDEO, short)
+        q.start()
+        assert await q.submit(BATCH, 1) == 0
+        await asyncio.sleep(0.01)
+        assert await q.submit(BATCH, 2) == 0  # the first one is running, not waiting
+        assert not await q.idle(BATCH) and await q.depth(BATCH) == 1
+        assert await q.idle(SINGLE)
+        await q.submit(SINGLE, 3)
+        await q.submit(YTDL_VIDEO, 4)
+        await asyncio.sleep(0.01)
+        assert log == [(SINGLE, 3), (YTDL_VIDEO, 4)]
+        gate.set()
+        await asyncio.sleep(0.01)
+        assert log[2:] == [("batch", 1), ("batch", 2)]
+        stats = (await q.snapshot())["kinds"]
+        assert stats[BATCH]["done"] == 2 and stats[SINGLE]["done"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_pending_jobs_can_be_dropped():
+    async def scenario():
+        q, ran, gate = queue(), [], asyncio.Event()
+
+        async def batch(job):
+            ran.append(job.user_id)
+            await gate.wait()
+
+        q.register(BATCH, batch)
+        q.start()
+        await q.submit(BATCH, 1)
+        await q.submit(BATCH, 2)
+        await asyncio.sleep(0.01)
+        assert await q.has(2, BATCH)
+        assert await q.cancel_pending(2) == 1
+        assert not await q.has(2, BATCH)
+        gate.set()
+        await asyncio.sleep(0.01)
+        assert ran == [1]
+
+    asyncio.run(scenario())
+
+
+def test_running_jobs_stop_through_their_hook_or_by_cancellation():
+    async def scenario():
+        q, stop = queue(), asyncio.Event()
+
+        async def batch(job):
+            await stop.wait()
+
+        async def ytdl(job):
+            await asyncio.Event().wait()
+
+        async def on_cancel(job):
+            stop.set()
+
+        q.register(BATCH, batch, on_cancel=on_cancel)
+        q.register(YTDL_VIDEO, ytdl)
+        q.start()
+        await q.submit(BATCH, 1)
+        await q.submit(YTDL_VIDEO, 1)
+        await asyncio.sleep(0.01)
+        assert await q.request_cancel(1) == 2
+        await asyncio.sleep(0.01)
+        assert not q.running
+        assert q.stats[BATCH]["done"] == 1  # stopped gracefully by its hook
+        assert q.stats[YTDL_VIDEO]["cancelled"] == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,67 @@
+import asyncio
+import json
+
+from utils.journal import Journal
+
+
+def test_mutations_survive_a_reload(tmp_path):
+    path = str(tmp_path / "state.journal")
+
+    async def write():
+        j = Journal(path, flush_delay=0)
+        j.load()
+        j.set("1", {"done": 0, "total": 10})
+        j.patch("1", {"done": 4})
+        j.set("2", {"done": 1})
+        j.delete("2")
+        j.patch("missing", {"done": 9})  # patching an unknown key is a no-op
+        await j.flush()
+
+    asyncio.run(write())
+    assert Journal(path).load() == {"1": {"done": 4, "total": 10}}
+
+
+def test_torn_last_line_is_ignored_and_rewritten(tmp_path):
+    path = tmp_path / "state.journal"
+    path.write_text(json.dumps({"op": "set", "k": "a", "v": 1}) + "\n" + '{"op": "set", "k": "b"', encoding="utf-8")
+
+    async def reopen():
+        j = Journal(str(path), flush_delay=0)
+        assert j.load() == {"a": 1}
+        j.set("c", 3)
+        await j.flush()
+
+    asyncio.run(reopen())
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert all(json.loads(line) for line in lines)
+    assert Journal(str(path)).load() == {"a": 1, "c": 3}
+
+
+def test_compaction_keeps_one_record_per_live_key(tmp_path):
+    path = tmp_path / "state.journal"
+
+    async def churn():
+        j = Journal(str(path), flush_delay=0, compact_every=20)
+        j.load()
+        for n in range(50):
+            j.set("k", n)
+            await j.flush()
+
+    asyncio.run(churn())
+    assert len(path.read_text(encoding="utf-8").splitlines()) <= 20
+    assert Journal(str(path)).load() == {"k": 49}
+
+
+def test_legacy_json_is_imported_once(tmp_path):
+    legacy = tmp_path / "active_users.json"
+    legacy.write_text(json.dumps({"5": {"done": 2}}), encoding="utf-8")
+    path = str(tmp_path / "state.journal")
+
+    async def migrate():
+        j = Journal(path, flush_delay=0)
+        assert j.load(legacy_json=str(legacy)) == {"5": {"done": 2}}
+        await j.flush()
+
+    asyncio.run(migrate())
+    legacy.write_text("{}", encoding="utf-8")
+    assert Journal(path).load(legacy_json=str(legacy)) == {"5": {"done": 2}}
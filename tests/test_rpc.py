@@ -0,0 +1,149 @@
+import asyncio
+
+import pytest
+from pyrogram import Client, raw
+from pyrogram.errors import FloodWait
+
+from utils.rpc import RpcScheduler
+
+
+class RecordingPacer:
+    """Lets every call through at once and remembers what it was asked."""
+
+    def __init__(self):
+        self.acquired = []
+        self.floods = []
+
+    async def acquire(self, *keys):
+        self.acquired.append(keys)
+
+    def success(self, *keys):
+        pass
+
+    def flood(self, seconds, *keys):
+        self.floods.append((seconds, keys))
+
+
+class Stop(Exception):
+    pass
+
+
+def client():
+    # a real pyrogram Client (its methods carry the sync adapter) that never connects
+    c = Client("rpc_test", api_id=1, api_hash="x", in_memory=True)
+
+    async def resolve_peer(peer_id):
+        return raw.types.InputPeerSelf()
+
+    c.resolve_peer = resolve_peer
+    return c
+
+
+def test_install_wraps_pyrogram_methods():
+    async def scenario():
+        rpc = RpcScheduler(RecordingPacer())
+        c = rpc.install(client())
+        assert c.send_message is not Client.send_message
+        assert c.send_message.__name__ == "send_message"
+        assert rpc.install(c) is c  # installing twice is a no-op
+
+    asyncio.run(scenario())
+
+
+def test_flood_wait_is_retried_through_the_pacer():
+    pacer = RecordingPacer()
+    invokes = []
+
+    async def scenario():
+        rpc = RpcScheduler(pacer, retries=2)
+        c = client()
+
+        async def invoke(query, *args, **kwargs):
+            invokes.append(type(query).__name__)
+            if len(invokes) == 1:
+                raise FloodWait(value=3)
+            raise Stop()  # the retry reached Telegram; no need to fake a reply
+
+        c.invoke = invoke
+        rpc.install(c)
+        await c.send_message(42, "hi")
+
+    with pytest.raises(Stop):
+        asyncio.run(scenario())
+    assert invokes == ["SendMessage", "SendMessage"]
+    assert pacer.acquired == [("method:rpc_test.send_message", "chat:rpc_test:42")] * 2
+    assert pacer.floods == [(3.0, ("method:rpc_test.send_message", "chat:rpc_test:42"))]
+
+
+def test_flood_wait_is_raised_once_retries_run_out():
+    rpc = RpcScheduler(RecordingPacer(), retries=1)
+
+    async def scenario():
+        c = client()
+
+        async def invoke(query, *args, **kwargs):
+            raise FloodWait(value=1)
+
+        c.invoke = invoke
+        rpc.install(c)
+        await c.send_message(42, "hi")
+
+    with pytest.raises(FloodWait):
+        asyncio.run(scenario())
+    assert rpc.floods["method:rpc_test.send_message"] == 2
+
+
+def test_copy_message_counts_once_but_unrelated_nested_calls_are_scheduled():
+    pacer = RecordingPacer()
+
+    async def scenario():
+        rpc = RpcScheduler(pacer)
+        c = client()
+
+        class Source:
+            async def copy(self, chat_id, **kwargs):
+                await c.delete_messages(chat_id, 1)  # not part of copy_message: its own call
+                return await c.send_cached_media(chat_id, "file-id")
+
+        async def get_messages(chat_id, message_ids):
+            return Source()
+
+        async def send_cached_media(chat_id, file_id, **kwargs):
+            return "sent"
+
+        async def delete_messages(chat_id, message_ids, **kwargs):
+            return 1
+
+        c.get_messages, c.send_cached_media, c.delete_messages = get_messages, send_cached_media, delete_messages
+        rpc.install(c)
+        return await c.copy_message(5, 6, 7)
+
+    assert asyncio.run(scenario()) == "sent"
+    assert [keys[0] for keys in pacer.acquired] == ["method:rpc_test.copy_message", "method:rpc_test.delete_messages"]
+
+
+def test_only_content_sends_take_the_chat_token():
+    pacer = RecordingPacer()
+
+    async def scenario():
+        rpc = RpcScheduler(pacer)
+        c = client()
+
+        async def fake(chat_id, *args, **kwargs):
+            return "ok"
+
+        c.send_document = c.send_message = c.edit_message_text = c.delete_messages = fake
+        rpc.install(c)
+        await c.send_document(42, "file")
+        await c.edit_message_text(42, 1, "50%")
+        await c.delete_messages(42, 1)
+        with rpc.status():
+            await c.send_message(42, "Downloading...")
+
+    asyncio.run(scenario())
+    assert pacer.acquired == [
+        ("method:rpc_test.send_document", "chat:rpc_test:42"),
+        ("method:rpc_test.edit_message_text",),
+        ("method:rpc_test.delete_messages",),
+        ("method:rpc_test.send_message",),
+    ]
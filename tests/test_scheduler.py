@@ -0,0 +1,95 @@
+import asyncio
+
+from utils.scheduler import FairScheduler
+
+
+def scheduler(**kw):
+    opts = {"slots": 1, "premium_weight": 2, "premium_cap": 4, "free_cap": 4, "starve_after": 60}
+    opts.update(kw)
+    return FairScheduler(**opts)
+
+
+async def queue(s, order, uid, premium=False, hold=None):
+    async with s.slot(uid, premium):
+        order.append(uid)
+        if hold is not None:
+            await hold.wait()
+
+
+def test_users_take_turns_instead_of_first_come_first_served():
+    async def scenario():
+        s, order, gate = scheduler(), [], asyncio.Event()
+        first = asyncio.create_task(queue(s, order, "a", hold=gate))
+        await asyncio.sleep(0)
+        rest = [asyncio.create_task(queue(s, order, "a")) for _ in range(3)]
+        await asyncio.sleep(0)
+        rest.append(asyncio.create_task(queue(s, order, "b")))
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.wait_for(asyncio.gather(first, *rest), 1)
+        return order
+
+    order = asyncio.run(scenario())
+    assert order[:2] == ["a", "b"]  # b queued last but goes right after a's running item
+
+
+def test_premium_lane_goes_first_until_a_free_item_starves():
+    async def scenario(starve_after):
+        s, order, gate = scheduler(starve_after=starve_after), [], asyncio.Event()
+        running = asyncio.create_task(queue(s, order, "x", hold=gate))
+        await asyncio.sleep(0)
+        free = asyncio.create_task(queue(s, order, "free"))
+        await asyncio.sleep(0)
+        premium = asyncio.create_task(queue(s, order, "premium", premium=True))
+        await asyncio.sleep(0.01)
+        gate.set()
+        await asyncio.wait_for(asyncio.gather(running, free, premium), 1)
+        return order[1:]
+
+    assert asyncio.run(scenario(starve_after=60)) == ["premium", "free"]
+    assert asyncio.run(scenario(starve_after=0)) == ["free", "premium"]
+
+
+def test_slots_and_per_user_caps_hold():
+    async def scenario():
+        s, gate, peak = scheduler(slots=3, free_cap=2), asyncio.Event(), {"all": 0, "a": 0}
+        active = {"all": 0, "a": 0}
+
+        async def item(uid):
+            async with s.slot(uid, False):
+                active["all"] += 1
+                active[uid] = active.get(uid, 0) + 1
+                peak["all"] = max(peak["all"], active["all"])
+                peak["a"] = max(peak["a"], active["a"])
+                await gate.wait()
+                active["all"] -= 1
+                active[uid] -= 1
+
+        tasks = [asyncio.create_task(item("a")) for _ in range(4)] + [asyncio.create_task(item(u)) for u in "bcd"]
+        await asyncio.sleep(0.01)
+        assert s.running == 3
+        gate.set()
+        await asyncio.wait_for(asyncio.gather(*tasks), 1)
+        assert s.running == 0 and not s._users
+        return peak
+
+    peak = asyncio.run(scenario())
+    assert peak == {"all": 3, "a": 2}
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def scenario():
+        s, order, gate = scheduler(), [], asyncio.Event()
+        running = asyncio.create_task(queue(s, order, "a", hold=gate))
+        await asyncio.sleep(0)
+        doomed = asyncio.create_task(queue(s, order, "b"))
+        after = asyncio.create_task(queue(s, order, "c"))
+        await asyncio.sleep(0)
+        doomed.cancel()
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.wait_for(asyncio.gather(running, after), 1)
+        assert s.running == 0
+        return order
+
+    assert asyncio.run(scenario()) == ["a", "c"]
@@ -0,0 +1,91 @@
+import asyncio
+from types import SimpleNamespace
+
+from pyrogram import raw
+from pyrogram.file_id import FileId, FileType
+
+from utils import transfer
+from utils.transfer import CHUNK_SIZE, iter_media
+
+
+class FakeSession:
+    started = []
+
+    def __init__(self, client, dc_id, auth_key, test_mode, is_media=False):
+        self.dc_id = dc_id
+        self.requests = []
+
+    async def start(self):
+        FakeSession.started.append(self.dc_id)
+
+    async def invoke(self, query, **kwargs):
+        self.requests.append(query)
+        left = self.size - query.offset
+        return raw.types.upload.File(type=raw.types.storage.FilePartial(), mtime=0, bytes=b"x" * max(0, min(query.limit, left)))
+
+
+class FakeStorage:
+    async def dc_id(self):
+        return 2
+
+    async def auth_key(self):
+        return b"k" * 256
+
+    async def test_mode(self):
+        return False
+
+
+def test_ranged_download_uses_one_media_session(monkeypatch):
+    size = 10 * CHUNK_SIZE + 5
+    FakeSession.size = size
+    FakeSession.started = []
+    monkeypatch.setattr(transfer, "Session", FakeSession)
+    monkeypatch.setattr(transfer, "PARALLEL_MIN_SIZE", 0)
+    monkeypatch.setattr(transfer, "DOWNLOAD_RANGE_MB", 3)
+    file_id = FileId(
+        file_type=FileType.DOCUMENT, dc_id=2, media_id=1, access_hash=2, file_reference=b"r",
+    ).encode()
+    msg = SimpleNamespace(document=SimpleNamespace(file_id=file_id, file_size=size))
+
+    async def scenario():
+        client = SimpleNamespace(
+            storage=FakeStorage(), media_sessions={}, media_sessions_lock=asyncio.Lock(),
+            get_file_semaphore=asyncio.Semaphore(4),
+        )
+        data = b"".join([c async for c in iter_media(client, msg, size, connections=4)])
+        return client, data
+
+    client, data = asyncio.run(scenario())
+    assert len(data) == size
+    assert FakeSession.started == [2]
+    offsets = sorted(q.offset for q in client.media_sessions[2].requests)
+    assert offsets == [i * CHUNK_SIZE for i in range(11)]
+
+
+class SavingSession(FakeSession):
+    async def invoke(self, query, **kwargs):
+        self.requests.append(query)
+        return True
+
+
+def test_upload_parts_go_through_the_media_session(monkeypatch):
+    FakeSession.started = []
+    monkeypatch.setattr(transfer, "Session", SavingSession)
+
+    async def scenario():
+        async def invoke(query, *args, **kwargs):
+            raise AssertionError("part sent on the main session")
+
+        client = SimpleNamespace(
+            storage=FakeStorage(), media_sessions={}, media_sessions_lock=asyncio.Lock(),
+            invoke=invoke, rnd_id=lambda: 7,
+        )
+        up = transfer.PartUploader(client, total_parts=3, big=False)
+        for part in range(3):
+            await up.put(part, b"p")
+        await up.finish()
+        return client
+
+    client = asyncio.run(scenario())
+    assert FakeSession.started == [2]
+    assert [q.file_part for q in client.media_sessions[2].requests] == [0, 1, 2]
@@ -0,0 +1,245 @@
+import asyncio
+import itertools
+import logging
+import os
+import shutil
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import ADMISSION_MAX_TRANSFERS, ADMISSION_DISK_FREE_MB, ADMISSION_MEM_FREE_MB, ADMISSION_POLL
+
+try:
+    import psutil
+except ImportError:  # disk falls back to shutil, memory goes unchecked
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# where a transfer's bytes sit until the job ends
+DISK, MEMORY, STREAM = "disk", "memory", "stream"
+
+
+class AdmissionError(Exception):
+    """The transfer can never fit, even with nothing else running."""
+
+
+def _human(n: float) -> str:
+    return f"{n / (1024 * MB):.2f} GB" if n >= 1024 * MB else f"{n / MB:.0f} MB"
+
+
+class Ticket:
+    __slots__ = ("id", "kind", "size", "dev", "order", "label", "since", "reason", "blocked_on", "written")
+
+    def __init__(self, tid: int, kind: str, size: int, dev: Optional[int], order: Optional[Tuple[Any, int]], label: str):
+        self.id = tid
+        self.kind = kind
+        self.size = size
+        self.dev = dev
+        self.order = order
+        self.label = label
+        self.since = time.monotonic()
+        self.reason = ""
+        self.blocked_on: Optional[str] = None  # "slots", DISK or MEMORY while waiting
+        self.written = 0  # bytes already on disk / in memory, reported by the transfer
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.size - self.written)
+
+
+
+class AdmissionController:
+    """
+    Reserves the bytes a transfer will need before it starts.
+
+    A disk transfer reserves the file size on the filesystem it writes to,
+    a buffered one reserves memory, and every transfer takes one of
+    `max_transfers` slots. What a held transfer has already written shows
+    in the measured free space, so only its unwritten remainder
+    (`Ticket.written`, reported by the transfer) is reserved on top. A
+    request that does not fit waits until reservations are released or
+    free space grows, polling every `poll` seconds; `Ticket.reason` says
+    what it is waiting for.
+
+    Waiting requests go in order and a later one only starts first when
+    it takes nothing the earlier one is waiting for. `order=(owner, seq)`
+    marks items of one ordered batch: they go in seq order whatever order
+    they arrived in, and a waiting item ignores later items of the same
+    batch entirely, written bytes included, since those cannot finish
+    before it (they wait for its turn to send).
+    """
+
+    def __init__(
+        self,
+        max_transfers: int = ADMISSION_MAX_TRANSFERS,
+        disk_free: int = ADMISSION_DISK_FREE_MB * MB,
+        mem_free: int = ADMISSION_MEM_FREE_MB * MB,
+        poll: float = ADMISSION_POLL,
+    ):
+        self.max_transfers = max(1, max_transfers)
+        self.disk_free = disk_free
+        self.mem_free = mem_free
+        self.poll = poll
+        self._ids = itertools.count(1)
+        self._held: Dict[int, Ticket] = {}
+        self._waiting: List[Ticket] = []
+        self._event: Optional[asyncio.Event] = None  # replaced on every wake-up
+        self.stats = {"admitted": 0, "waited": 0, "rejected": 0, "wait_s": 0.0}
+
+    # ------------------------------------------------------------------
+    # measurements
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _dev(path: Optional[str]) -> Optional[int]:
+        try:
+            return os.stat(path).st_dev if path else None
+        except OSError:
+            return None
+
+    @staticmethod
+    def _disk_free(path: str) -> int:
+        try:
+            return (psutil.disk_usage(path) if psutil else shutil.disk_usage(path)).free
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _mem_available() -> Optional[int]:
+        return psutil.virtual_memory().available if psutil else None
+
+    def _counted(self, t: Ticket) -> Callable[[Ticket], bool]:
+        def counts(h: Ticket) -> bool:
+            if t.order and h.order and h.order[0] == t.order[0] and h.order[1] > t.order[1]:
+                return False
+            return True
+        return counts
+
+    def _check(self, t: Ticket, path: Optional[str]) -> Tuple[bool, str, Optional[str]]:
+        """(fits, reason, resource it waits for)."""
+        counts = self._counted(t)
+        held = [h for h in self._held.values() if counts(h)]
+        ignored = [h for h in self._held.values() if not counts(h)]
+        if len(held) >= self.max_transfers:
+            return False, f"transfers: {len(held)}/{self.max_transfers} running", "slots"
+        if t.kind == DISK and path:
+            same_dev = lambda h: h.kind == DISK and h.dev == t.dev
+            reserved = sum(h.remaining for h in held if same_dev(h))
+            free = self._disk_free(path) + sum(h.written for h in ignored if same_dev(h)) - reserved - self.disk_free
+            if t.size > free:
+                return False, f"disk: needs {_human(t.size)}, {_human(max(free, 0))} free after reservations", DISK
+        if t.kind == MEMORY:
+            avail = self._mem_available()
+            if avail is not None:
+                reserved = sum(h.remaining for h in held if h.kind == MEMORY)
+                free = avail + sum(h.written for h in ignored if h.kind == MEMORY) - reserved - self.mem_free
+                if t.size > free:
+                    return False, f"memory: needs {_human(t.size)}, {_human(max(free, 0))} available after reservations", MEMORY
+        return True, "", None
+
+    def _never_fits(self, t: Ticket, path: Optional[str]) -> bool:
+        # with every held transfer gone, their written bytes are free again
+        if t.kind == DISK and path:
+            return t.size > self._disk_free(path) + sum(h.written for h in self._held.values() if h.kind == DISK and h.dev == t.dev) - self.disk_free
+        return False
+
+    def _passable(self, h: Ticket, t: Ticket) -> bool:
+        """`t` may start before the earlier waiter `h`: it takes nothing `h` waits for, and leaves `h` a slot."""
+        if h.blocked_on in (None, "slots") or h.blocked_on == t.kind:
+            return False
+        counts = self._counted(h)
+        return sum(1 for x in self._held.values() if counts(x)) + 1 < self.max_transfers
+
+    def _rank(self, t: Ticket) -> Tuple[int, int, int]:
+        # a batch queues where its first waiting item arrived, its items in seq order
+        if not t.order:
+            return t.id, 0, t.id
+        first = min(h.id for h in self._waiting if h.order and h.order[0] == t.order[0])
+        return first, t.order[1], t.id
+
+    def _blocker(self, t: Ticket) -> Optional[Ticket]:
+        rank = self._rank(t)
+        for h in self._waiting:
+            if h is not t and self._rank(h) < rank and not self._passable(h, t):
+                return h
+        return None
+
+    # ------------------------------------------------------------------
+    async def acquire(
+        self,
+        kind: str,
+        size: int,
+        path: Optional[str] = None,
+        order: Optional[Tuple[Any, int]] = None,
+        label: str = "",
+        on_wait: Optional[Callable[[str], Any]] = None,
+    ) -> Ticket:
+        """
+        Waits until the transfer fits and returns its ticket; `release` it
+        when the bytes are gone. `on_wait(reason)` is awaited when the
+        request starts waiting and whenever the reason changes.
+        """
+        if self._event is None:
+            self._event = asyncio.Event()
+        t = Ticket(next(self._ids), kind, max(0, int(size or 0)), self._dev(path), order, label)
+        if self._never_fits(t, path):
+            self.stats["rejected"] += 1
+            raise AdmissionError(f"not enough disk space for {_human(t.size)}")
+
+        self._waiting.append(t)
+        try:
+            while True:
+                changed = self._event  # grabbed before the check: a release after it is not missed
+                ok, reason, t.blocked_on = self._check(t, path)
+                if ok:
+                    ahead = self._blocker(t)
+                    if ahead is not None:
+                        ok, reason = False, f"queued behind {ahead.label or 'an earlier transfer'}"
+                if ok:
+                    break
+                if reason != t.reason:
+                    if not t.reason:
+                        self.stats["waited"] += 1
+                    t.reason = reason
+                    if on_wait:
+                        try:
+                            await on_wait(reason)
+                        except Exception:
+                            pass
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=self.poll)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._waiting.remove(t)
+            self._wake()
+
+        self.stats["admitted"] += 1
+        self.stats["wait_s"] += time.monotonic() - t.since
+        t.reason = ""
+        t.blocked_on = None
+        self._held[t.id] = t
+        return t
+
+    def release(self, t: Optional[Ticket]) -> None:
+        if t is not None and self._held.pop(t.id, None) is not None:
+            self._wake()
+
+    def _wake(self) -> None:
+        if self._event is not None:
+            self._event.set()
+            self._event = asyncio.Event()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "running": len(self._held),
+            "max": self.max_transfers,
+            "reserved_disk": sum(h.remaining for h in self._held.values() if h.kind == DISK),
+            "reserved_mem": sum(h.remaining for h in self._held.values() if h.kind == MEMORY),
+            "waiting": [(t.label, t.reason) for t in self._waiting],
+            **self.stats,
+        }
+
+
+ADMISSION = AdmissionController()
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BatchItem:
+    """One source message travelling through the batch pipeline."""
+
+    __slots__ = ("seq", "msg_id", "msg", "data", "result", "_engine")
+
+    def __init__(self, engine: "BatchEngine", seq: int, msg_id: int):
+        self._engine = engine
+        self.seq = seq
+        self.msg_id = msg_id
+        self.msg = None
+        self.data: Dict[str, Any] = {}
+        self.result: Optional[str] = None
+
+    async def turn(self) -> None:
+        """Wait until every earlier item has been delivered to the target chat."""
+        await self._engine._wait_turn(self.seq)
+
+
+class BatchEngine:
+    """
+    Fetch -> download -> upload pipeline with bounded queues between stages.
+
+    Hooks:
+      fetch(ids)      -> list of messages (None for missing), same order as ids
+      download(item)  -> prepares item.data (may be a no-op)
+      upload(item)    -> result string; must `await item.turn()` right before
+                         the order-sensitive send so the target chat receives
+                         items in source order.
+
+    Items are handed to upload workers in source order and at most `window`
+    items are in flight at once, so the pipeline cannot deadlock on ordering.
+    Fetching claims `fetch_chunk` ids per call independently of that: the
+    fetched messages wait in the fetch worker, and each one is only passed
+    on to download once it is inside the window.
+    """
+
+    def __init__(
+        self,
+        msg_ids: List[int],
+        fetch: Callable[[List[int]], Awaitable[List[Any]]],
+        download: Callable[[BatchItem], Awaitable[None]],
+        upload: Callable[[BatchItem], Awaitable[str]],
+        *,
+        fetch_workers: int = 1,
+        download_workers: int = 2,
+        upload_workers: int = 1,
+        queue_size: int = 4,
+        fetch_chunk: int = 1,
+        on_result: Optional[Callable[[BatchItem], Awaitable[None]]] = None,
+        should_cancel: Optional[Callable[[], bool]] = None,
+    ):
+        self.msg_ids = list(msg_ids)
+        self.fetch = fetch
+        self.download = download
+        self.upload = upload
+        self.fetch_workers = max(1, int(fetch_workers))
+        self.download_workers = max(1, int(download_workers))
+        self.upload_workers = max(1, int(upload_workers))
+        self.queue_size = max(1, int(queue_size))
+        self.fetch_chunk = max(1, int(fetch_chunk))
+        self.window = self.queue_size + self.download_workers + self.upload_workers
+        self.on_result = on_result
+        self.should_cancel = should_cancel or (lambda: False)
+
+        self._dl_q: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._cond = asyncio.Condition()
+        self._ready: Dict[int, BatchItem] = {}
+        self._next_claim = 0      # next seq a fetch worker may claim
+        self._next_take = 0       # next seq an upload worker may take
+        self._next_deliver = 0    # next seq allowed to send
+        self._claimed_final: Optional[int] = None
+        self._dropped_from: Optional[int] = None  # first claimed seq never passed on (cancelled)
+
+    # ------------------------------------------------------------------
+    # ordering
+    # ------------------------------------------------------------------
+    async def _wait_turn(self, seq: int) -> None:
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._next_deliver >= seq)
+
+    async def _finish(self, item: BatchItem) -> None:
+        await self._wait_turn(item.seq)
+        if self.on_result:
+            try:
+                await self.on_result(item)
+            except Exception as e:
+                logger.error(f"Batch on_result failed for {item.msg_id}: {e}")
+        async with self._cond:
+            self._next_deliver = item.seq + 1
+            self._cond.notify_all()
+
+    # ------------------------------------------------------------------
+    # stages
+    # ------------------------------------------------------------------
+    async def _claim(self) -> Optional[List[BatchItem]]:
+        async with self._cond:
+            await self._cond.wait_for(
+                lambda: self._claimed_final is not None
+                or self._next_claim >= len(self.msg_ids)
+                or self.should_cancel()
+                or self._next_claim < self._next_deliver + self.window
+            )
+            if self._claimed_final is not None or self._next_claim >= len(self.msg_ids) or self.should_cancel():
+                return None
+            start = self._next_claim
+            end = min(start + self.fetch_chunk, len(self.msg_ids))
+            self._next_claim = end
+            return [BatchItem(self, seq, self.msg_ids[seq]) for seq in range(start, end)]
+
+    async def _release(self, item: BatchItem) -> bool:
+        """Waits until `item` is inside the run-ahead window; False when the batch is cancelled first."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: item.seq < self._next_deliver + self.window or self.should_cancel())
+            if item.seq < self._next_deliver + self.window:
+                return True
+            if self._dropped_from is None or item.seq < self._dropped_from:
+                self._dropped_from = item.seq
+            return False
+
+    async def _fetch_worker(self) -> None:
+        while True:
+            items = await self._claim()
+            if not items:
+                return
+            try:
+                msgs = await self.fetch([it.msg_id for it in items])
+            except Exception as e:
+                logger.error(f"Batch fetch failed for {items[0].msg_id}..{items[-1].msg_id}: {e}")
+                msgs = []
+            for idx, it in enumerate(items):
+                it.msg = msgs[idx] if idx < len(msgs) else None
+                if not await self._release(it):
+                    break
+                await self._dl_q.put(it)
+
+    async def _download_worker(self) -> None:
+        while True:
+            item = await self._dl_q.get()
+            if item is None:
+                return
+            if item.msg is not None:
+                try:
+                    await self.download(item)
+                except Exception as e:
+                    item.result = f"Error: {str(e)[:60]}"
+            async with self._cond:
+                self._ready[item.seq] = item
+                self._cond.notify_all()
+
+    async def _take(self) -> Optional[BatchItem]:
+        async with self._cond:
+            await self._cond.wait_for(
+                lambda: self._next_take in self._ready
+                or (self._claimed_final is not None and self._next_take >= self._claimed_final)
+            )
+            item = self._ready.pop(self._next_take, None)
+            if item is None:
+                return None
+            self._next_take += 1
+            self._cond.notify_all()
+            return item
+
+    async def _upload_worker(self) -> None:
+        while True:
+            item = await self._take()
+            if item is None:
+                return
+            if item.msg is not None and item.result is None:
+                try:
+                    item.result = await self.upload(item)
+                except Exception as e:
+                    item.result = f"Error: {str(e)[:60]}"
+            await self._finish(item)
+
+    # ------------------------------------------------------------------
+    async def run(self) -> None:
+        fetchers = [asyncio.create_task(self._fetch_worker()) for _ in range(self.fetch_workers)]
+        downloaders = [asyncio.create_task(self._download_worker()) for _ in range(self.download_workers)]
+        uploaders = [asyncio.create_task(self._upload_worker()) for _ in range(self.upload_workers)]
+
+        async def _poke_cancel():
+            # claimers wait on the condition; wake them periodically so a
+            # cancel request is noticed even when nothing else moves
+            while True:
+                await asyncio.sleep(1)
+                async with self._cond:
+                    self._cond.notify_all()
+
+        poker = asyncio.create_task(_poke_cancel())
+        try:
+            await asyncio.gather(*fetchers)
+            for _ in downloaders:
+                await self._dl_q.put(None)
+            await asyncio.gather(*downloaders)
+            async with self._cond:
+                self._claimed_final = self._next_claim
+                if self._dropped_from is not None:
+                    self._claimed_final = min(self._claimed_final, self._dropped_from)
+                self._cond.notify_all()
+            await asyncio.gather(*uploaders)
+        finally:
+            poker.cancel()
+            for t in fetchers + downloaders + uploaders:
+                if not t.done():
+                    t.cancel()
+
+    @property
+    def claimed(self) -> int:
+        return self._next_claim
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("client", "rev", "last_used", "last_check", "leases")
+
+    def __init__(self, client: Any, rev: Any = None):
+        self.client = client
+        self.rev = rev
+        self.last_used = time.monotonic()
+        self.last_check = self.last_used
+        self.leases = 0
+
+
+class ClientPool:
+    """
+    Bounded LRU pool of started per-user clients.
+
+    `acquire(uid, factory)` returns the pooled client (hit) or starts one
+    with `factory()` (miss). The least recently used client is stopped
+    once the pool is over `max_size`, and a sweeper stops clients idle for
+    longer than `idle_ttl`. Clients held with `hold(uid)` (running batches)
+    are never evicted. A pooled client that has not been checked for
+    `health_every` seconds is pinged on acquire and restarted if dead.
+    `rev` names the credentials a client was started with (read from the
+    user's document by the caller): a pooled client whose `rev` no longer
+    matches was logged out or replaced, on this node or another, and is
+    stopped and started again.
+
+    Keeps the read/delete part of the old dict interface (`in`, get, [],
+    del, pop) for callers that manage a client by hand (/setbot, /logout).
+    """
+
+    def __init__(self, name: str, max_size: int, idle_ttl: float, health_every: float):
+        self.name = name
+        self.max_size = max(1, max_size)
+        self.idle_ttl = idle_ttl
+        self.health_every = health_every
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {
+            "hits": 0, "misses": 0, "failures": 0,
+            "evicted_lru": 0, "evicted_idle": 0, "reconnects": 0, "invalidated": 0,
+        }
+
+    # ------------------------------------------------------------------
+    # dict compatibility
+    # ------------------------------------------------------------------
+    def __contains__(self, uid) -> bool:
+        return uid in self._entries
+
+    def __getitem__(self, uid):
+        return self._entries[uid].client
+
+    def __delitem__(self, uid) -> None:
+        del self._entries[uid]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, uid, default=None):
+        e = self._entries.get(uid)
+        return e.client if e else default
+
+    def pop(self, uid, default=None):
+        e = self._entries.pop(uid, None)
+        return e.client if e else default
+
+    # ------------------------------------------------------------------
+    # pooling
+    # ------------------------------------------------------------------
+    async def acquire(self, uid: int, factory: Callable[[], Awaitable[Any]], rev: Any = None) -> Optional[Any]:
+        lock = self._locks.setdefault(uid, asyncio.Lock())
+        async with lock:
+            e = self._entries.get(uid)
+            if e is not None and e.rev != rev:
+                self.stats["invalidated"] += 1
+                self._entries.pop(uid, None)
+                await self._stop(e.client)
+                e = None
+            if e is not None:
+                self._entries.move_to_end(uid)
+                e.last_used = time.monotonic()
+                if await self._healthy(e):
+                    self.stats["hits"] += 1
+                    return e.client
+                self._entries.pop(uid, None)
+                await self._stop(e.client)
+
+            self.stats["misses"] += 1
+            try:
+                client = await factory()
+            except Exception as ex:
+                logger.warning(f"{self.name}: starting client for {uid} failed: {ex}")
+                client = None
+            if client is None:
+                self.stats["failures"] += 1
+                self._locks.pop(uid, None)
+                return None
+            self._entries[uid] = _Entry(client, rev)
+        await self._shrink()
+        return client
+
+    async def _healthy(self, e: _Entry) -> bool:
+        now = time.monotonic()
+        if now - e.last_check < self.health_every:
+            return True
+        e.last_check = now
+        try:
+            if getattr(e.client, "is_connected", True):
+                await asyncio.wait_for(e.client.get_me(), timeout=15)
+                return True
+        except Exception:
+            pass
+        # dead socket or revoked session: one restart before giving up
+        self.stats["reconnects"] += 1
+        try:
+            await self._stop(e.client)
+            await asyncio.wait_for(e.client.start(), timeout=30)
+            return True
+        except Exception as ex:
+            logger.warning(f"{self.name}: reconnect failed: {ex}")
+            return False
+
+    async def _shrink(self) -> None:
+        while len(self._entries) > self.max_size:
+            victim = next((u for u, e in self._entries.items() if not e.leases), None)
+            if victim is None:
+                return
+            await self.evict(victim)
+            self.stats["evicted_lru"] += 1
+
+    async def evict(self, uid: int) -> None:
+        e = self._entries.pop(uid, None)
+        self._locks.pop(uid, None)
+        if e is not None:
+            await self._stop(e.client)
+
+    async def _stop(self, client: Any) -> None:
+        try:
+            if getattr(client, "is_connected", True):
+                await asyncio.wait_for(client.stop(), timeout=30)
+        except Exception:
+            pass
+
+    @contextmanager
+    def hold(self, uid: int):
+        """Pins the user's client while a job runs on it."""
+        e = self._entries.get(uid)
+        if e is not None:
+            e.leases += 1
+        try:
+            yield
+        finally:
+            if e is not None:
+                e.leases -= 1
+                e.last_used = time.monotonic()
+
+    async def sweep(self) -> int:
+        now = time.monotonic()
+        idle = [u for u, e in self._entries.items() if not e.leases and now - e.last_used > self.idle_ttl]
+        for uid in idle:
+            await self.evict(uid)
+        self.stats["evicted_idle"] += len(idle)
+        return len(idle)
+
+    async def _sweep_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep()
+            except Exception as ex:
+                logger.warning(f"{self.name}: sweep failed: {ex}")
+
+    def start_sweeper(self, interval: float = 60) -> None:
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop(interval))
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "max": self.max_size,
+            "held": sum(1 for e in self._entries.values() if e.leases),
+            **self.stats,
+        }
@@ -0,0 +1,252 @@
+import hashlib
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from pyrogram.enums import ChatType
+from pyrogram.errors import RPCError
+from pyrogram.types import Message
+
+from config import LOG_GROUP, STRING, FILE_CACHE_MIRROR, FILE_CACHE_TTL_DAYS, FILE_CACHE_MAX_ENTRIES
+from utils.func import file_cache_collection, find_cached_file, save_cached_file, forget_cached_file, trim_cached_files
+from utils.transfer import media_of
+
+logger = logging.getLogger(__name__)
+
+# YtdlUploadCache keeps its own entries in the same collection; ours carry this marker
+OWN_KEYS = {"cache": "file"}
+TRIM_EVERY = 100  # stores between two trims to max_entries
+
+
+def _thumb_fingerprint(thumb: Optional[str]) -> list:
+    if thumb:
+        try:
+            st = os.stat(thumb)
+            return [st.st_size, int(st.st_mtime)]
+        except OSError:
+            pass
+    return []
+
+
+def cache_variant(settings: Any, renamed: bool, thumb: Optional[str]) -> str:
+    """What, besides the source, changes the uploaded file: rename rules and the custom thumbnail."""
+    parts: list = []
+    if renamed:
+        parts += [settings.rename_tag, settings.delete_words, settings.replacement_words]
+    parts += _thumb_fingerprint(thumb)
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+
+
+def content_variant(file_name: Optional[str], thumb: Optional[str]) -> str:
+    """Same bytes reposted elsewhere still differ by the name they end up with and the thumbnail."""
+    return hashlib.sha1(repr([file_name or ""] + _thumb_fingerprint(thumb)).encode()).hexdigest()[:16]
+
+
+class FileCache:
+    """
+    Uploaded results keyed by (source chat, message id, media unique id, variant).
+
+    A file_id only works for the account that received it, so every bot
+    that delivered a file gets its own entry. A copy of the first upload
+    is also kept in LOG_GROUP, made by the delivering bot or, when that bot
+    is not a member there, by the main bot (or the STRING userbot) if it
+    can see the target chat. A later request
+    is sent by file_id when this bot has one, else copied server-side from
+    LOG_GROUP, by this bot or else by the one that keeps the copies; only
+    when all fail is the file transferred again.
+
+    The same upload is also indexed by content ("sha256:<digest>:<size>:
+    <variant>", see utils.transfer.ChunkHasher) and by every file_unique_id
+    seen for it, so a file reposted under another chat or message id is
+    found before its bytes move (unique id) or before its upload (hash).
+
+    Entries expire `ttl_days` after they were last stored or reused and,
+    checked every TRIM_EVERY stores, only the `max_entries` most recently
+    used are kept.
+    """
+
+    def __init__(
+        self,
+        log_chat: int = LOG_GROUP,
+        mirror: bool = FILE_CACHE_MIRROR,
+        ttl_days: float = FILE_CACHE_TTL_DAYS,
+        max_entries: int = FILE_CACHE_MAX_ENTRIES,
+    ):
+        self.log_chat = log_chat
+        self.mirror = mirror
+        self.ttl_days = ttl_days
+        self.max_entries = max(0, max_entries)
+        self._indexed = False
+        self._stores = 0
+        self._cannot_mirror: set = set()  # (client id, chat id) copies into LOG_GROUP that failed
+        self.stats = {"file_id": 0, "copy": 0, "miss": 0, "stale": 0, "stored": 0}
+
+    @staticmethod
+    def key(msg: Message, variant: str) -> Optional[str]:
+        _, media = media_of(msg)
+        unique = getattr(media, "file_unique_id", None)
+        if not unique or not msg.chat:
+            return None
+        return f"{msg.chat.id}:{msg.id}:{unique}:{variant}"
+
+    @staticmethod
+    def content_key(digest: str, size: int, variant: str) -> str:
+        return f"sha256:{digest}:{size}:{variant}"
+
+    async def _ensure_indexes(self) -> None:
+        if self._indexed:
+            return
+        self._indexed = True
+        try:
+            await file_cache_collection.create_index("key", unique=True)
+            await file_cache_collection.create_index([("unique_ids", 1), ("variant", 1)])
+            await file_cache_collection.create_index("expires_at", expireAfterSeconds=0)
+            await file_cache_collection.create_index([("cache", 1), ("updated_at", 1)])
+        except Exception as e:
+            logger.warning(f"file_cache index: {e}")
+
+    @staticmethod
+    def _usable(doc: Optional[Dict[str, Any]]) -> bool:
+        # the TTL monitor runs once a minute: don't serve what it hasn't removed yet
+        if not doc or (doc.get("expires_at") and doc["expires_at"] < datetime.utcnow()):
+            return False
+        return bool(doc.get("file_ids") or doc.get("log_msg_id"))
+
+    def _fields(self) -> Dict[str, Any]:
+        # UTC, as the TTL monitor compares expires_at
+        if self.ttl_days > 0:
+            return {**OWN_KEYS, "expires_at": datetime.utcnow() + timedelta(days=self.ttl_days)}
+        return dict(OWN_KEYS)
+
+    @staticmethod
+    def _keepers() -> list:
+        """Clients that mirror into and resend from LOG_GROUP: the main bot, then the userbot."""
+        import shared_client  # the clients live there; imported late so this module stays light
+
+        return [shared_client.app] + ([shared_client.userbot] if STRING else [])
+
+    async def _find(self, query: Dict[str, Any], stat: str) -> Optional[Dict[str, Any]]:
+        await self._ensure_indexes()
+        try:
+            doc = await find_cached_file(query)
+        except Exception:
+            doc = None
+        if not self._usable(doc):
+            self.stats["miss"] += 1
+            return None
+        self.stats[stat] = self.stats.get(stat, 0) + 1
+        return doc
+
+    async def lookup(self, key: Optional[str]) -> Optional[Dict[str, Any]]:
+        if not key:
+            return None
+        return await self._find({"key": key}, "source_hit")
+
+    async def lookup_unique(self, unique_id: Optional[str], variant: str) -> Optional[Dict[str, Any]]:
+        """Pre-check before any bytes move: the same Telegram file seen under another post."""
+        if not unique_id:
+            return None
+        return await self._find({"unique_ids": unique_id, "variant": variant}, "unique_hit")
+
+    async def lookup_content(self, digest: Optional[str], size: int, variant: str) -> Optional[Dict[str, Any]]:
+        if not digest:
+            return None
+        return await self._find({"key": self.content_key(digest, size, variant)}, "content_hit")
+
+    async def send(self, client: Any, doc: Dict[str, Any], chat_id, caption: Optional[str] = None, reply_to: Optional[int] = None) -> Optional[Message]:
+        bot_id = getattr(getattr(client, "me", None), "id", None)
+        file_id = (doc.get("file_ids") or {}).get(str(bot_id))
+        if file_id:
+            try:
+                sent = await client.send_cached_media(chat_id, file_id, caption=caption or "", reply_to_message_id=reply_to)
+                self.stats["file_id"] += 1
+                try:
+                    await save_cached_file(doc["key"], None, None, size=int(doc.get("size") or 0), extra=self._fields())
+                except Exception:
+                    pass
+                return sent
+            except Exception as e:
+                # expired file reference or a deleted file: drop it, try the copy
+                self.stats["stale"] += 1
+                logger.info(f"cached file_id unusable ({e}), dropping")
+                try:
+                    await forget_cached_file(doc["key"], bot_id)
+                except Exception:
+                    pass
+        if doc.get("log_msg_id"):
+            # this bot first, so the file comes from the bot the user talks to
+            for sender in [client] + [k for k in self._keepers() if k is not client]:
+                try:
+                    sent = await sender.copy_message(chat_id, self.log_chat, doc["log_msg_id"], caption=caption or "", reply_to_message_id=reply_to)
+                except Exception:
+                    continue
+                self.stats["copy"] += 1
+                await self.store(sender, doc["key"], sent, int(doc.get("size") or 0), log_msg_id=doc["log_msg_id"])
+                return sent
+        return None
+
+    async def _mirror(self, client: Any, sent: Message) -> Optional[int]:
+        """
+        Copies `sent` into LOG_GROUP. The client that sent it sees the chat
+        but a user's own bot is rarely in LOG_GROUP; a keeper is, but sees
+        a group or channel only as a member and never another bot's DM.
+        Pairs that failed once are not asked again.
+        """
+        chat = sent.chat
+        senders = [client]
+        if chat.type not in (ChatType.PRIVATE, ChatType.BOT):
+            senders += [k for k in self._keepers() if k is not client]
+        for sender in senders:
+            pair = (id(sender), chat.id if sender is not client else None)
+            if pair in self._cannot_mirror:
+                continue
+            try:
+                mirrored = await sender.copy_message(self.log_chat, chat.id, sent.id)
+                return mirrored.id
+            except RPCError:
+                if len(self._cannot_mirror) > 10000:
+                    self._cannot_mirror.clear()
+                self._cannot_mirror.add(pair)
+            except Exception:
+                pass
+        return None
+
+    async def store(
+        self,
+        client: Any,
+        key: Optional[str],
+        sent: Optional[Message],
+        size: int = 0,
+        log_msg_id: Optional[int] = None,
+        digest: Optional[str] = None,
+        variant: Optional[str] = None,
+        unique_id: Optional[str] = None,
+    ) -> None:
+        """Records `sent` under its source key and, when the content hash is known, its content key."""
+        if not sent or not (key or digest):
+            return
+        _, media = media_of(sent)
+        file_id = getattr(media, "file_id", None)
+        if self.mirror and not log_msg_id:
+            log_msg_id = await self._mirror(client, sent)
+        bot_id = getattr(getattr(client, "me", None), "id", None)
+        try:
+            await self._ensure_indexes()
+            if key:
+                await save_cached_file(key, bot_id, file_id, log_msg_id, size, extra=self._fields())
+            if digest and variant is not None:
+                await save_cached_file(
+                    self.content_key(digest, size, variant), bot_id, file_id, log_msg_id, size,
+                    extra={"sha256": digest, "variant": variant, **self._fields()},
+                    unique_id=unique_id,
+                )
+            self._stores += 1
+            if self.max_entries and self._stores % TRIM_EVERY == 1:
+                await trim_cached_files(OWN_KEYS, self.max_entries)
+            self.stats["stored"] += 1
+        except Exception as e:
+            logger.warning(f"file_cache store failed: {e}")
+
+
+FILE_CACHE = FileCache()
@@ -1,14 +1,18 @@
 
-import concurrent.futures
 import time
 import os
 import re
-import cv2
 import logging
 import asyncio
+from dataclasses import dataclass
+from typing import Optional, Tuple
 from datetime import datetime, timedelta
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from config import MONGO_DB as MONGO_URI, DB_NAME
+from utils.probe import PROBE
+from utils.media_jobs import MEDIA_JOBS, MediaJobError, PRIORITY_THUMB
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -118,9 +122,12 @@ async def is_private_chat(event):
 
 
 async def save_user_data(user_id, key, value):
+    update = {"$set": {key: value}}
+    if key in SETTINGS_KEYS:
+        update["$inc"] = {"settings_rev": 1}
     await users_collection.update_one(
         {"user_id": user_id},
-        {"$set": {key: value}},
+        update,
         upsert=True
     )
    # print(users_collection)
@@ -201,13 +208,71 @@ async def remove_user_bot(user_id):
         return False
 
 
-async def process_text_with_rules(user_id, text):
+# ─────────────────────────────────────────────────────────────
+# PER-JOB SETTINGS SNAPSHOT
+# One find_one per job instead of one per setting per file.
+# Any settings write bumps `settings_rev` on the user's document, and
+# refresh_user_settings reloads on the next item when it moved. The
+# revision lives in Mongo, so a change made through the frontend reaches
+# a batch running on a worker node.
+# ─────────────────────────────────────────────────────────────
+
+SETTINGS_KEYS = {"chat_id", "caption", "rename_tag", "replacement_words", "delete_words"}
+
+
+@dataclass(frozen=True)
+class UserSettings:
+    user_id: int
+    chat_id: Optional[str] = None
+    caption: str = ""
+    rename_tag: str = ""
+    replacement_words: Tuple[Tuple[str, str], ...] = ()
+    delete_words: Tuple[str, ...] = ()
+    rev: int = 0
+
+    @classmethod
+    def from_doc(cls, user_id, doc: dict | None, rev: int = 0) -> "UserSettings":
+        doc = doc or {}
+        replacements = doc.get("replacement_words") or {}
+        return cls(
+            user_id=int(user_id),
+            chat_id=doc.get("chat_id"),
+            caption=doc.get("caption") or "",
+            rename_tag=doc.get("rename_tag") or "",
+            replacement_words=tuple(replacements.items()),
+            delete_words=tuple(doc.get("delete_words") or []),
+            rev=rev,
+        )
+
+
+async def load_user_settings(user_id) -> UserSettings:
+    # the revision comes from the same document, so it matches the settings read
+    doc = await users_collection.find_one({"user_id": int(user_id)})
+    return UserSettings.from_doc(user_id, doc, int((doc or {}).get("settings_rev") or 0))
+
+
+async def refresh_user_settings(settings: UserSettings) -> UserSettings:
+    """Returns the same snapshot unless /settings changed something since it was taken."""
+    try:
+        doc = await users_collection.find_one({"user_id": settings.user_id}, {"settings_rev": 1})
+    except Exception:
+        return settings
+    if int((doc or {}).get("settings_rev") or 0) == settings.rev:
+        return settings
+    return await load_user_settings(settings.user_id)
+
+
+async def process_text_with_rules(user_id, text, settings: UserSettings | None = None):
     if not text:
         return ""
     
     try:
-        replacements = await get_user_data_key(user_id, "replacement_words", {})
-        delete_words = await get_user_data_key(user_id, "delete_words", [])
+        if settings is not None:
+            replacements = dict(settings.replacement_words)
+            delete_words = list(settings.delete_words)
+        else:
+            replacements = await get_user_data_key(user_id, "replacement_words", {})
+            delete_words = await get_user_data_key(user_id, "delete_words", [])
         
         processed_text = text
         for word, replacement in replacements.items():
@@ -238,8 +303,8 @@ def _is_user_thumbnail_path(path: str, sender: str | int | None = None) -> bool:
 
 
 def cleanup_temp_file(path: str | None, sender: str | int | None = None) -> None:
-    if not path:
-        return
+    if not path or not isinstance(path, str):
+        return  # in-memory thumbnails leave nothing behind
     if _is_user_thumbnail_path(path, sender):
         return
     try:
@@ -282,7 +347,8 @@ async def screenshot(video: str, duration: int, sender: str) -> str | None:
         return existing_screenshot
 
     time_stamp = hhmmss(duration // 2)
-    output_file = datetime.now().isoformat("_", "seconds") + ".jpg"
+    # next to the video: inside the job's workspace, removed with it
+    output_file = os.path.join(os.path.dirname(video), datetime.now().isoformat("_", "seconds") + ".jpg")
 
     cmd = [
         "ffmpeg",
@@ -293,13 +359,10 @@ async def screenshot(video: str, duration: int, sender: str) -> str | None:
         "-y"
     ]
 
-    process = await asyncio.create_subprocess_exec(
-        *cmd,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
-    
-    stdout, stderr = await process.communicate()
+    try:
+        _, _, stderr = await MEDIA_JOBS.run(cmd, priority=PRIORITY_THUMB, timeout=60, kind="screenshot")
+    except MediaJobError as e:
+        stderr = str(e).encode()
 
     if os.path.isfile(output_file):
         return output_file
@@ -309,40 +372,7 @@ async def screenshot(video: str, duration: int, sender: str) -> str | None:
 
 
 async def get_video_metadata(file_path):
-    default_values = {'width': 1, 'height': 1, 'duration': 1}
-    loop = asyncio.get_event_loop()
-    executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
-    
-    try:
-        def _extract_metadata():
-            try:
-                vcap = cv2.VideoCapture(file_path)
-                if not vcap.isOpened():
-                    return default_values
-
-                width = round(vcap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                height = round(vcap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                fps = vcap.get(cv2.CAP_PROP_FPS)
-                frame_count = vcap.get(cv2.CAP_PROP_FRAME_COUNT)
-
-                if fps <= 0:
-                    return default_values
-
-                duration = round(frame_count / fps)
-                if duration <= 0:
-                    return default_values
-
-                vcap.release()
-                return {'width': width, 'height': height, 'duration': duration}
-            except Exception as e:
-                logger.error(f"Error in video_metadata: {e}")
-                return default_values
-        
-        return await loop.run_in_executor(executor, _extract_metadata)
-        
-    except Exception as e:
-        logger.error(f"Error in get_video_metadata: {e}")
-        return default_values
+    return await PROBE.video_metadata(file_path)
 
 
 async def add_premium_user(user_id, duration_value, duration_unit):
@@ -574,3 +604,164 @@ async def get_warnings_db(user_id: int) -> int:
     doc = await warnings_collection.find_one({"user_id": user_id})
     return int(doc.get("count", 0)) if doc else 0
 
+
+
+# --- BATCH CHECKPOINTS (resume after restart) ---
+batch_checkpoints_collection = db["batch_checkpoints"]
+
+async def save_batch_checkpoint(user_id: int, doc: dict):
+    now = datetime.now()
+    await batch_checkpoints_collection.update_one(
+        {"user_id": user_id},
+        {"$set": {**doc, "user_id": user_id, "updated_at": now}, "$setOnInsert": {"created_at": now}},
+        upsert=True,
+    )
+
+async def update_batch_checkpoint(user_id: int, last_id: int, done: int, success: int):
+    await batch_checkpoints_collection.update_one(
+        {"user_id": user_id},
+        {"$set": {"last_id": last_id, "done": done, "success": success, "updated_at": datetime.now()}},
+        upsert=True,
+    )
+
+async def get_batch_checkpoint(user_id: int):
+    return await batch_checkpoints_collection.find_one({"user_id": user_id})
+
+async def get_batch_checkpoints() -> list[dict]:
+    docs = []
+    try:
+        async for doc in batch_checkpoints_collection.find({}):
+            docs.append(doc)
+    except Exception as e:
+        logger.error(f"Error loading batch checkpoints: {e}")
+    return docs
+
+async def delete_batch_checkpoint(user_id: int):
+    await batch_checkpoints_collection.delete_one({"user_id": user_id})
+
+
+# ─── Peer cache: access hashes per logged-in account ───────────────────────────
+peers_collection = db["peers"]
+
+async def save_peers(owner_id: int, peers: list[tuple]):
+    """`peers` are (peer_id, access_hash, type, username) tuples as pyrogram stores them."""
+    if not peers:
+        return
+    now = datetime.now()
+    ops = []
+    for pid, ah, ptype, uname in peers:
+        fields = {"access_hash": ah, "type": ptype, "updated_at": now}
+        if uname:
+            fields["username"] = uname
+        ops.append(UpdateOne({"owner_id": owner_id, "peer_id": pid}, {"$set": fields}, upsert=True))
+    await peers_collection.bulk_write(ops, ordered=False)
+
+async def get_peer(owner_id: int, peer_id: int):
+    return await peers_collection.find_one({"owner_id": owner_id, "peer_id": peer_id})
+
+async def get_peer_by_username(owner_id: int, username: str):
+    return await peers_collection.find_one({"owner_id": owner_id, "username": username}, sort=[("updated_at", -1)])
+
+
+# ─── Transfer result cache: uploaded file_ids per source media ─────────────────
+file_cache_collection = db["file_cache"]
+
+async def get_cached_file(key: str):
+    return await file_cache_collection.find_one({"key": key})
+
+async def find_cached_file(query: dict):
+    return await file_cache_collection.find_one(query, sort=[("updated_at", -1)])
+
+async def save_cached_file(key: str, bot_id: int | None, file_id: str | None, log_msg_id: int | None = None, size: int = 0, extra: dict | None = None, unique_id: str | None = None):
+    fields = {**(extra or {}), "key": key, "size": size, "updated_at": datetime.now()}
+    if bot_id and file_id:
+        fields[f"file_ids.{bot_id}"] = file_id
+    if log_msg_id:
+        fields["log_msg_id"] = log_msg_id
+    update = {"$set": fields, "$setOnInsert": {"created_at": datetime.now()}}
+    if unique_id:
+        update["$addToSet"] = {"unique_ids": unique_id}
+    await file_cache_collection.update_one({"key": key}, update, upsert=True)
+
+async def trim_cached_files(query: dict, keep: int) -> int:
+    """Deletes the least recently updated entries matching `query` beyond `keep`."""
+    excess = await file_cache_collection.count_documents(query) - keep
+    if excess <= 0:
+        return 0
+    old = await file_cache_collection.find(query, {"_id": 1}).sort("updated_at", 1).to_list(length=excess)
+    res = await file_cache_collection.delete_many({"_id": {"$in": [d["_id"] for d in old]}})
+    return res.deleted_count
+
+async def forget_cached_file(key: str, bot_id: int | None = None):
+    if bot_id:
+        await file_cache_collection.update_one({"key": key}, {"$unset": {f"file_ids.{bot_id}": ""}})
+    else:
+        await file_cache_collection.delete_one({"key": key})
+
+
+# ─── Distributed jobs and leases (nodes sharing this database) ─────────────────
+jobs_collection = db["jobs"]
+leases_collection = db["leases"]
+
+async def ensure_job_indexes():
+    await jobs_collection.create_index([("status", 1), ("kind", 1), ("enqueued_at", 1)])
+    await jobs_collection.create_index([("user_id", 1), ("status", 1)])
+    await jobs_collection.create_index("finished_at", expireAfterSeconds=86400)
+
+async def insert_job(doc: dict):
+    await jobs_collection.insert_one(doc)
+
+async def claim_job(node: str, kinds: list, lease_sec: int):
+    """Takes the oldest queued job, or a running one whose worker stopped renewing it."""
+    now = datetime.now()
+    return await jobs_collection.find_one_and_update(
+        {"kind": {"$in": kinds}, "$or": [{"status": "queued"}, {"status": "running", "lease_until": {"$lt": now}}]},
+        {"$set": {"status": "running", "node": node, "started_at": now, "lease_until": now + timedelta(seconds=lease_sec)}, "$inc": {"attempts": 1}},
+        sort=[("enqueued_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+async def renew_job(job_id, node: str, lease_sec: int):
+    """Extends our lease; None means another node has taken the job over."""
+    return await jobs_collection.find_one_and_update(
+        {"_id": job_id, "node": node, "status": "running"},
+        {"$set": {"lease_until": datetime.now() + timedelta(seconds=lease_sec)}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+async def finish_job(job_id, node: str, status: str):
+    await jobs_collection.update_one(
+        {"_id": job_id, "node": node},
+        {"$set": {"status": status, "finished_at": datetime.now()}, "$unset": {"lease_until": ""}},
+    )
+
+async def cancel_queued_jobs(query: dict) -> int:
+    now = datetime.now()
+    res = await jobs_collection.update_many({**query, "status": "queued"}, {"$set": {"status": "cancelled", "finished_at": now}})
+    return res.modified_count
+
+async def request_job_cancel(query: dict) -> int:
+    res = await jobs_collection.update_many({**query, "status": "running"}, {"$set": {"cancel_requested": True}})
+    return res.matched_count
+
+async def count_jobs(query: dict) -> int:
+    return await jobs_collection.count_documents(query)
+
+async def find_jobs(query: dict, limit: int = 0):
+    return await jobs_collection.find(query).sort("enqueued_at", 1).to_list(length=limit or None)
+
+async def acquire_lease(key: str, owner: str, lease_sec: int) -> bool:
+    """Takes (or renews) the named lease unless another owner holds it unexpired."""
+    now = datetime.now()
+    try:
+        await leases_collection.update_one(
+            {"_id": key, "$or": [{"owner": owner}, {"until": {"$lt": now}}]},
+            {"$set": {"owner": owner, "until": now + timedelta(seconds=lease_sec)}},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def release_lease(key: str, owner: str):
+    await leases_collection.delete_one({"_id": key, "owner": owner})
@@ -0,0 +1,399 @@
+import asyncio
+import itertools
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from config import JOB_WORKERS, JOB_SINGLE_WORKERS, JOB_YTDL_WORKERS, JOB_STORE, NODE_ROLE, NODE_ID, JOB_LEASE_SEC, JOB_HEARTBEAT_SEC, JOB_POLL_SEC
+from utils.func import ensure_job_indexes, insert_job, count_jobs, find_jobs, claim_job, renew_job, finish_job, cancel_queued_jobs, request_job_cancel
+
+logger = logging.getLogger(__name__)
+
+# job kinds
+BATCH = "batch"
+SINGLE = "single"
+YTDL_VIDEO = "ytdl_video"
+YTDL_AUDIO = "ytdl_audio"
+KINDS = (BATCH, SINGLE, YTDL_VIDEO, YTDL_AUDIO)
+
+# worker pools: short jobs never wait behind long batches
+POOLS = {"batch": (BATCH,), "single": (SINGLE,), "ytdl": (YTDL_VIDEO, YTDL_AUDIO)}
+
+# job document states (Mongo store)
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+KindFilter = Union[None, str, Sequence[str]]
+
+
+@dataclass
+class Job:
+    kind: str
+    user_id: int
+    payload: Dict[str, Any] = field(default_factory=dict)
+    id: Any = 0
+    enqueued_at: float = 0.0
+    started_at: Optional[float] = None
+    cancelled: bool = False
+    attempts: int = 1               # > 1: taken over from a node that stopped renewing it
+    cancel_requested: bool = False
+    lost: bool = False              # our lease expired and another node took the job
+
+
+def _kinds(kind: KindFilter) -> Optional[tuple]:
+    if kind is None:
+        return None
+    return (kind,) if isinstance(kind, str) else tuple(kind)
+
+
+class JobQueue:
+    """
+    Long-running work (batches, /single, yt-dlp) taken off the update handlers.
+
+    Handlers only `submit` a typed Job and return. Each pool of kinds
+    (POOLS) has its own queue and fixed set of worker tasks running the
+    handler registered for the job's kind, so a /single or a yt-dlp job
+    never waits behind a long batch. Queue depth, running jobs and
+    wait/run times per kind are kept for /bstats.
+
+    With the "mongo" store the queue is a collection shared by every node:
+    workers claim the oldest job with a lease, renew it every `heartbeat`
+    seconds and lose it when they stop, so a job whose node died is claimed
+    again (with `attempts` > 1) once the lease runs out. A "frontend" node
+    only submits; "worker" nodes only run jobs. Job payloads must then be
+    plain BSON values.
+    """
+
+    def __init__(
+        self,
+        workers: int = JOB_WORKERS,
+        single_workers: int = JOB_SINGLE_WORKERS,
+        ytdl_workers: int = JOB_YTDL_WORKERS,
+        store: str = JOB_STORE,
+        role: str = NODE_ROLE,
+        node: str = NODE_ID,
+        lease_sec: float = JOB_LEASE_SEC,
+        heartbeat: float = JOB_HEARTBEAT_SEC,
+        poll: float = JOB_POLL_SEC,
+    ):
+        self.pool_workers = {
+            "batch": max(1, workers),
+            "single": max(1, single_workers),
+            "ytdl": max(1, ytdl_workers),
+        }
+        self.workers = sum(self.pool_workers.values())
+        self.distributed = store == "mongo"
+        self.runs_jobs = role != "frontend"
+        self.node = node
+        self.lease_sec = lease_sec
+        self.heartbeat = max(1.0, min(heartbeat, lease_sec / 3))
+        self.poll = poll
+        self._handlers: Dict[str, Callable[[Job], Awaitable[None]]] = {}
+        self._on_cancel: Dict[str, Callable[[Job], Awaitable[Any]]] = {}
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._tasks: Dict[str, List[asyncio.Task]] = {}
+        self._ids = itertools.count(1)
+        self._pending: Dict[Any, Job] = {}
+        self.running: Dict[Any, Job] = {}
+        self._work: Dict[Any, asyncio.Task] = {}
+        self.stats: Dict[str, Dict[str, float]] = {k: self._new_stat() for k in KINDS}
+
+    @staticmethod
+    def _new_stat() -> Dict[str, float]:
+        return {"started": 0, "done": 0, "failed": 0, "cancelled": 0, "lost": 0, "wait_s": 0.0, "run_s": 0.0}
+
+    def register(
+        self,
+        kind: str,
+        handler: Callable[[Job], Awaitable[None]],
+        on_cancel: Optional[Callable[[Job], Awaitable[Any]]] = None,
+    ) -> None:
+        """
+        `on_cancel(job)` is awaited when /stop asks a running job of this
+        kind to stop; kinds without one have their task cancelled instead.
+        """
+        self._handlers[kind] = handler
+        if on_cancel is not None:
+            self._on_cancel[kind] = on_cancel
+
+    @staticmethod
+    def pool_of(kind: str) -> str:
+        for name, kinds in POOLS.items():
+            if kind in kinds:
+                return name
+        raise ValueError(f"{kind} jobs belong to no worker pool")
+
+    def _q(self, pool: str) -> asyncio.Queue:
+        if pool not in self._queues:
+            self._queues[pool] = asyncio.Queue()
+        return self._queues[pool]
+
+    def start(self) -> None:
+        if not self.runs_jobs:
+            return
+        if self.distributed and not self._tasks:
+            asyncio.create_task(self._ensure_indexes())
+        worker = self._claim_loop if self.distributed else self._worker
+        for pool, n in self.pool_workers.items():
+            tasks = self._tasks[pool] = [t for t in self._tasks.get(pool, []) if not t.done()]
+            for _ in range(len(tasks), n):
+                tasks.append(asyncio.create_task(worker(pool)))
+
+    @staticmethod
+    async def _ensure_indexes() -> None:
+        try:
+            await ensure_job_indexes()
+        except Exception as e:
+            logger.warning(f"job indexes not created: {e}")
+
+    # ------------------------------------------------------------------
+    # submitting and querying
+    # ------------------------------------------------------------------
+    def _query(self, user_id: Optional[int], kind: KindFilter) -> Dict[str, Any]:
+        q: Dict[str, Any] = {}
+        if user_id is not None:
+            q["user_id"] = user_id
+        kinds = _kinds(kind)
+        if kinds is not None:
+            q["kind"] = {"$in": list(kinds)}
+        return q
+
+    def _matches(self, j: Job, user_id: Optional[int], kind: KindFilter) -> bool:
+        kinds = _kinds(kind)
+        return (user_id is None or j.user_id == user_id) and (kinds is None or j.kind in kinds)
+
+    async def submit(self, kind: str, user_id: int, **payload) -> int:
+        """Queues a job; returns how many jobs of its pool are ahead of it."""
+        if kind not in self._handlers:
+            raise ValueError(f"no handler registered for {kind} jobs")
+        pool = self.pool_of(kind)
+        if not self.distributed:
+            job = Job(kind, user_id, payload, next(self._ids), time.time())
+            ahead = await self.depth(kind)
+            self._pending[job.id] = job
+            self._q(pool).put_nowait(job)
+            return ahead
+
+        ahead = await self.depth(kind)
+        await insert_job({
+            "_id": uuid.uuid4().hex,
+            "kind": kind,
+            "user_id": user_id,
+            "payload": payload,
+            "status": QUEUED,
+            "attempts": 0,
+            "enqueued_at": datetime.now(),
+            "submitted_by": self.node,
+        })
+        if self._wake is not None:
+            self._wake.set()  # a local worker need not wait for its next poll
+        return ahead
+
+    async def idle(self, kind: str) -> bool:
+        """A `kind` job submitted now would start right away."""
+        if await self.depth(kind):
+            return False
+        if not self.distributed:
+            pool = self.pool_of(kind)
+            busy = sum(1 for j in self.running.values() if self.pool_of(j.kind) == pool)
+            return busy < self.pool_workers[pool]
+        return True
+
+    async def depth(self, kind: KindFilter = None) -> int:
+        """Jobs waiting in `kind`'s pool (in every pool when None)."""
+        kinds = POOLS[self.pool_of(kind)] if isinstance(kind, str) else _kinds(kind)
+        if not self.distributed:
+            return sum(1 for j in self._pending.values() if kinds is None or j.kind in kinds)
+        return await count_jobs({**self._query(None, kinds), "status": QUEUED})
+
+    async def cancel_pending(self, user_id: Optional[int], kind: KindFilter = None) -> int:
+        """Drops jobs that have not started (all users' when `user_id` is None); returns how many."""
+        if self.distributed:
+            return await cancel_queued_jobs(self._query(user_id, kind))
+        dropped = [j for j in self._pending.values() if self._matches(j, user_id, kind)]
+        for j in dropped:
+            j.cancelled = True
+            self._pending.pop(j.id, None)
+        return len(dropped)
+
+    async def request_cancel(self, user_id: Optional[int], kind: KindFilter = None) -> int:
+        """Asks running jobs to stop, on whichever node runs them; returns how many were asked."""
+        if self.distributed:
+            return await request_job_cancel(self._query(user_id, kind))
+        asked = [j for j in self.running.values() if self._matches(j, user_id, kind)]
+        for j in asked:
+            await self._cancel_running(j)
+        return len(asked)
+
+    async def has(self, user_id: int, kind: KindFilter = None) -> bool:
+        """A job of this user is queued or running."""
+        if self.distributed:
+            return await count_jobs({**self._query(user_id, kind), "status": {"$in": [QUEUED, RUNNING]}}) > 0
+        return any(
+            self._matches(j, user_id, kind)
+            for j in itertools.chain(self._pending.values(), self.running.values())
+        )
+
+    # ------------------------------------------------------------------
+    # running
+    # ------------------------------------------------------------------
+    async def _cancel_running(self, job: Job) -> None:
+        if job.cancel_requested:
+            return
+        job.cancel_requested = True
+        hook = self._on_cancel.get(job.kind)
+        if hook is None:
+            # no graceful stop for this kind: cancel its task (a yt-dlp child is killed with it)
+            work = self._work.get(job.id)
+            if work is not None:
+                work.cancel()
+            return
+        try:
+            await hook(job)
+        except Exception as e:
+            logger.warning(f"cancel hook of {job.kind} job {job.id} failed: {e}")
+
+    async def _worker(self, pool: str) -> None:
+        q = self._q(pool)
+        while True:
+            job: Job = await q.get()
+            self._pending.pop(job.id, None)
+            try:
+                if not job.cancelled:
+                    await self._run(job)
+            finally:
+                q.task_done()
+
+    async def _claim_loop(self, pool: str) -> None:
+        if self._wake is None:
+            self._wake = asyncio.Event()
+        kinds = [k for k in POOLS[pool] if k in self._handlers]
+        if not kinds:
+            return
+        while True:
+            try:
+                doc = await claim_job(self.node, kinds, self.lease_sec)
+            except Exception as e:
+                logger.warning(f"job claim failed: {e}")
+                doc = None
+            if doc is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.poll)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            job = Job(
+                doc["kind"], doc["user_id"], doc.get("payload") or {}, doc["_id"],
+                doc["enqueued_at"].timestamp(), attempts=int(doc.get("attempts") or 1),
+            )
+            if job.attempts > 1:
+                logger.info(f"{job.kind} job {job.id} of {job.user_id} taken over (attempt {job.attempts})")
+            await self._run(job)
+
+    async def _heartbeat(self, job: Job, work: asyncio.Task) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                doc = await renew_job(job.id, self.node, self.lease_sec)
+            except Exception as e:
+                logger.warning(f"lease renewal of job {job.id} failed: {e}")
+                continue
+            if doc is None:
+                # another node owns it now: stop here so it doesn't run twice
+                job.lost = True
+                logger.warning(f"{job.kind} job {job.id} lost its lease; stopping it on {self.node}")
+                work.cancel()
+                return
+            if doc.get("cancel_requested"):
+                await self._cancel_running(job)
+
+    async def _run(self, job: Job) -> None:
+        job.started_at = time.time()
+        st = self.stats.setdefault(job.kind, self._new_stat())
+        st["started"] += 1
+        st["wait_s"] += max(0.0, job.started_at - job.enqueued_at)
+        self.running[job.id] = job
+        work = self._work[job.id] = asyncio.create_task(self._handlers[job.kind](job))
+        hb = asyncio.create_task(self._heartbeat(job, work)) if self.distributed else None
+        status = DONE
+        try:
+            try:
+                await asyncio.wait({work})
+            except asyncio.CancelledError:
+                work.cancel()
+                status = None  # shutting down: the lease runs out and another worker takes it
+                raise
+            if work.cancelled():
+                if job.lost:
+                    status = None
+                    st["lost"] += 1
+                else:
+                    status = CANCELLED
+                    st["cancelled"] += 1
+            elif work.exception() is not None:
+                status = FAILED
+                st["failed"] += 1
+                e = work.exception()
+                logger.error(f"{job.kind} job {job.id} of {job.user_id} failed: {e}", exc_info=e)
+            else:
+                st["done"] += 1
+        finally:
+            if hb is not None:
+                hb.cancel()
+            st["run_s"] += time.time() - job.started_at
+            self.running.pop(job.id, None)
+            self._work.pop(job.id, None)
+            if self.distributed and status is not None:
+                try:
+                    await finish_job(job.id, self.node, status)
+                except Exception as e:
+                    logger.warning(f"could not mark job {job.id} {status}: {e}")
+
+    # ------------------------------------------------------------------
+    async def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        if self.distributed:
+            try:
+                docs = await find_jobs({"status": {"$in": [QUEUED, RUNNING]}})
+            except Exception:
+                docs = []
+            pending = [(d["kind"], d["enqueued_at"].timestamp()) for d in docs if d["status"] == QUEUED]
+            running = [(d["kind"], d["enqueued_at"].timestamp()) for d in docs if d["status"] == RUNNING]
+            nodes = len({d.get("node") for d in docs if d["status"] == RUNNING})
+        else:
+            pending = [(j.kind, j.enqueued_at) for j in self._pending.values()]
+            running = [(j.kind, j.enqueued_at) for j in self.running.values()]
+            nodes = 1
+
+        kinds = {}
+        for k, v in self.stats.items():
+            n = v["started"]
+            queued = sum(1 for kind, _ in pending if kind == k)
+            busy = sum(1 for kind, _ in running if kind == k)
+            if not n and not queued and not busy:
+                continue
+            kinds[k] = {
+                "queued": queued,
+                "running": busy,
+                "done": int(v["done"]),
+                "failed": int(v["failed"]),
+                "avg_wait_ms": round(1000 * v["wait_s"] / n) if n else 0,
+            }
+        oldest = min((t for _, t in pending), default=None)
+        return {
+            "store": "mongo" if self.distributed else "memory",
+            "node": self.node,
+            "nodes": nodes,
+            "workers": self.workers if self.runs_jobs else 0,
+            "queued": len(pending),
+            "running": len(running),
+            "oldest_wait_s": round(now - oldest) if oldest is not None else 0,
+            "kinds": kinds,
+        }
+
+
+JOBS = JobQueue()
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    """
+    Append-only JSON-lines journal for small keyed job state.
+
+    Every mutation is one line: {"op": "set"|"patch"|"del", "k": ..., "v": ...}.
+    Lines are buffered and written by a debounced flusher off the event loop;
+    once the log grows past `compact_every` records it is rewritten as one
+    "set" per live key (tmp file + os.replace, so a crash leaves either the
+    old or the new file). Replay ignores a torn last line.
+    """
+
+    def __init__(self, path: str, flush_delay: float = 0.5, compact_every: int = 1000):
+        self.path = path
+        self.flush_delay = flush_delay
+        self.compact_every = compact_every
+        self.state: Dict[str, Any] = {}
+        self._pending: List[str] = []
+        self._records = 0
+        self._compact_requested = False
+        self._flush_task: Optional[asyncio.Task] = None
+        self._io_lock = asyncio.Lock()
+
+    # ------------------------------------------------------------------
+    # replay
+    # ------------------------------------------------------------------
+    def load(self, legacy_json: Optional[str] = None) -> Dict[str, Any]:
+        """Rebuilds state from disk. `legacy_json` is a plain JSON dump to import once."""
+        self.state.clear()
+        self._records = 0
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            rec = json.loads(line)
+                        except ValueError:
+                            # torn write from a crash mid-append; rewrite the
+                            # file before appending after it
+                            self._compact_requested = True
+                            continue
+                        self._apply(rec)
+                        self._records += 1
+            except Exception as e:
+                logger.error(f"Journal replay failed for {self.path}: {e}")
+        elif legacy_json and os.path.exists(legacy_json):
+            try:
+                with open(legacy_json, "r", encoding="utf-8") as f:
+                    for k, v in (json.load(f) or {}).items():
+                        self.state[str(k)] = v
+                self._compact_requested = True
+            except Exception:
+                pass
+        return self.state
+
+    def _apply(self, rec: Dict[str, Any]) -> None:
+        op, k = rec.get("op"), rec.get("k")
+        if k is None:
+            return
+        if op == "set":
+            self.state[k] = rec.get("v")
+        elif op == "patch":
+            cur = self.state.get(k)
+            if isinstance(cur, dict):
+                cur.update(rec.get("v") or {})
+        elif op == "del":
+            self.state.pop(k, None)
+
+    # ------------------------------------------------------------------
+    # mutations
+    # ------------------------------------------------------------------
+    def _append(self, rec: Dict[str, Any]) -> None:
+        self._apply(rec)
+        try:
+            self._pending.append(json.dumps(rec, separators=(",", ":"), default=str))
+        except Exception as e:
+            logger.error(f"Journal record not serializable: {e}")
+            return
+        self._schedule()
+
+    def set(self, key: str, value: Any) -> None:
+        self._append({"op": "set", "k": str(key), "v": value})
+
+    def patch(self, key: str, fields: Dict[str, Any]) -> None:
+        if str(key) in self.state:
+            self._append({"op": "patch", "k": str(key), "v": fields})
+
+    def delete(self, key: str) -> None:
+        self._append({"op": "del", "k": str(key)})
+
+    def checkpoint(self) -> None:
+        """State was mutated directly; persist a full snapshot on the next flush."""
+        self._compact_requested = True
+        self._schedule()
+
+    # ------------------------------------------------------------------
+    # flushing
+    # ------------------------------------------------------------------
+    def _schedule(self) -> None:
+        if self._flush_task and not self._flush_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._flush_task = loop.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(self.flush_delay)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        async with self._io_lock:
+            lines, self._pending = self._pending, []
+            compact = self._compact_requested or (self._records + len(lines) > self.compact_every)
+            try:
+                if compact:
+                    self._compact_requested = False
+                    snapshot = [
+                        json.dumps({"op": "set", "k": k, "v": v}, separators=(",", ":"), default=str)
+                        for k, v in self.state.items()
+                    ]
+                    await asyncio.to_thread(self._write_snapshot, snapshot)
+                    self._records = len(snapshot)
+                elif lines:
+                    await asyncio.to_thread(self._write_lines, lines)
+                    self._records += len(lines)
+            except Exception as e:
+                logger.error(f"Journal flush failed for {self.path}: {e}")
+                self._pending = lines + self._pending
+                self._compact_requested = self._compact_requested or compact
+        if self._pending or self._compact_requested:
+            self._schedule()
+
+    def _write_lines(self, lines: List[str]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_snapshot(self, lines: List[str]) -> None:
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            if lines:
+                f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
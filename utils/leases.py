@@ -0,0 +1,158 @@
+import asyncio
+import itertools
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from config import JOB_STORE, NODE_ID, JOB_LEASE_SEC, JOB_HEARTBEAT_SEC, JOB_POLL_SEC
+from utils.func import acquire_lease, release_lease
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseError(Exception):
+    """The lease stayed with another holder for the whole wait."""
+
+
+class LeaseManager:
+    """
+    Named mutual exclusion that holds across nodes.
+
+    Inside one process a plain asyncio.Lock per name is enough. With the
+    Mongo job store every holder also takes a lease document
+    `{_id: name, owner, until}` and renews it while the body runs; a lease
+    whose holder died is free again once `until` has passed.
+
+    `share(name)` is the node-wide form: every holder on this node runs at
+    once under one lease, and other nodes wait until the last of them is
+    done. It pins per-user sessions to one node at a time.
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        store: str = JOB_STORE,
+        node: str = NODE_ID,
+        lease_sec: float = JOB_LEASE_SEC,
+        renew_every: float = JOB_HEARTBEAT_SEC,
+        poll: float = JOB_POLL_SEC,
+    ):
+        self.prefix = prefix
+        self.distributed = store == "mongo"
+        self.node = node
+        self.lease_sec = lease_sec
+        self.renew_every = max(1.0, min(renew_every, lease_sec / 3))
+        self.poll = poll
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._shared: Dict[str, list] = {}  # key -> [holders here, renewer task]
+        self._seq = itertools.count(1)
+        self.stats = {"acquired": 0, "contended": 0, "lost": 0}
+
+    def _key(self, name: Any) -> str:
+        return f"{self.prefix}:{name}"
+
+    def _local(self, key: str) -> asyncio.Lock:
+        if key not in self._locks:
+            self._locks[key] = asyncio.Lock()
+        return self._locks[key]
+
+    def clear(self) -> None:
+        """Forgets the local locks (the Mongo leases expire on their own)."""
+        self._locks.clear()
+        self._shared.clear()
+
+    async def _renew(self, key: str, owner: str) -> None:
+        while True:
+            await asyncio.sleep(self.renew_every)
+            try:
+                if not await acquire_lease(key, owner, self.lease_sec):
+                    self.stats["lost"] += 1
+                    logger.warning(f"lease {key} was taken over while held by {owner}")
+                    return
+            except Exception as e:
+                logger.warning(f"lease {key} renewal failed: {e}")
+
+    async def _acquire(self, key: str, owner: str, timeout: Optional[float]) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+        waited = False
+        while not await acquire_lease(key, owner, self.lease_sec):
+            if not waited:
+                waited = True
+                self.stats["contended"] += 1
+            if deadline is not None and loop.time() >= deadline:
+                raise LeaseError(f"{key} is held by another node")
+            await asyncio.sleep(self.poll)
+        self.stats["acquired"] += 1
+
+    @asynccontextmanager
+    async def hold(self, name: Any, timeout: Optional[float] = None):
+        """Runs the body while holding `name` on every node; raises LeaseError after `timeout` seconds of waiting."""
+        key = self._key(name)
+        async with self._local(key):
+            if not self.distributed:
+                self.stats["acquired"] += 1
+                yield
+                return
+
+            owner = f"{self.node}:{next(self._seq)}"
+            await self._acquire(key, owner, timeout)
+            renewer = asyncio.create_task(self._renew(key, owner))
+            try:
+                yield
+            finally:
+                renewer.cancel()
+                try:
+                    await release_lease(key, owner)
+                except Exception as e:
+                    logger.warning(f"lease {key} release failed: {e}")
+
+    @asynccontextmanager
+    async def share(self, name: Any, on_release: Optional[Callable[[], Awaitable[Any]]] = None):
+        """
+        Runs the body alongside this node's other holders of `name`; no
+        other node holds it meanwhile. `on_release()` is awaited before the
+        last holder here lets the lease go to another node (distributed
+        only), e.g. to stop what must not run on two nodes at once.
+        """
+        key = self._key(name)
+        async with self._local(key):
+            entry = self._shared.get(key)
+            if entry is None:
+                renewer = None
+                if not self.distributed:
+                    self.stats["acquired"] += 1
+                else:
+                    owner = f"{self.node}:shared"
+                    await self._acquire(key, owner, None)
+                    renewer = asyncio.create_task(self._renew(key, owner))
+                entry = self._shared[key] = [0, renewer]
+            entry[0] += 1
+        try:
+            yield
+        finally:
+            entry[0] -= 1
+            if not entry[0]:
+                # under the local lock: a holder arriving meanwhile waits for the release
+                async with self._local(key):
+                    if not entry[0] and self._shared.get(key) is entry:
+                        del self._shared[key]
+                        if entry[1] is not None:
+                            entry[1].cancel()
+                            if on_release:
+                                try:
+                                    await on_release()
+                                except Exception as e:
+                                    logger.warning(f"lease {key} release hook failed: {e}")
+                            try:
+                                await release_lease(key, f"{self.node}:shared")
+                            except Exception as e:
+                                logger.warning(f"lease {key} release failed: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        held = sum(1 for l in self._locks.values() if l.locked()) + len(self._shared)
+        return {"distributed": self.distributed, "held": held, **self.stats}
+
+
+USER_LEASES = LeaseManager("user")
+SESSION_LEASES = LeaseManager("session")
@@ -0,0 +1,192 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from config import MEDIA_JOB_WORKERS, MEDIA_JOB_NICE, MEDIA_JOB_IONICE, MEDIA_JOB_TIMEOUT, MEDIA_JOB_RESERVED
+
+try:
+    import psutil
+except ImportError:  # ionice is skipped without it
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+# lower runs first: a user waits on a probe or a thumbnail, not on a transcode
+PRIORITY_PROBE = 0
+PRIORITY_THUMB = 1
+PRIORITY_TRANSCODE = 5
+
+
+def default_workers() -> int:
+    # one core stays with the event loop
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+class MediaJobError(Exception):
+    pass
+
+
+class MediaJobPool:
+    """
+    Every ffmpeg / ffprobe child process of the bot goes through here.
+
+    At most `workers` processes run at once, and `reserved` of those
+    slots are never given to transcodes, so a probe or thumbnail does not
+    wait for a long job to end. Waiting jobs start in priority order (then
+    FIFO), children run under `nice` and, when psutil is available, the
+    idle I/O class, and each job is killed after its timeout (counted
+    from its start, not from when it was queued). Counts and wait/run
+    times are kept per kind for /bstats.
+    """
+
+    def __init__(self, workers: int = 0, nice: int = MEDIA_JOB_NICE, ionice: bool = MEDIA_JOB_IONICE, timeout: float = MEDIA_JOB_TIMEOUT, reserved: int = MEDIA_JOB_RESERVED):
+        self.workers = workers if workers > 0 else default_workers()
+        # transcodes keep at least one slot
+        self.reserved = max(0, min(reserved, self.workers - 1))
+        self.nice = nice
+        self.ionice = ionice
+        self.timeout = timeout
+        self.running = 0
+        self.running_heavy = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self.stats: Dict[str, Dict[str, float]] = {}
+
+    # ------------------------------------------------------------------
+    # slots
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _heavy(priority: int) -> bool:
+        return priority >= PRIORITY_TRANSCODE
+
+    def _fits(self, priority: int) -> bool:
+        if self.running >= self.workers:
+            return False
+        return not self._heavy(priority) or self.running_heavy < self.workers - self.reserved
+
+    def _take(self, priority: int) -> None:
+        self.running += 1
+        if self._heavy(priority):
+            self.running_heavy += 1
+
+    async def _acquire(self, priority: int) -> None:
+        if not self._waiters and self._fits(priority):
+            self._take(priority)
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        self._dispatch()  # a probe may start ahead of transcodes waiting on their share
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self._release(priority)  # the slot was handed over as we were cancelled
+            else:
+                self._waiters = [w for w in self._waiters if w[2] is not fut]
+                heapq.heapify(self._waiters)
+                self._dispatch()
+            raise
+
+    def _dispatch(self) -> None:
+        # the heap puts probes and thumbnails first: when its head is a
+        # transcode that doesn't fit, nothing behind it does either
+        while self._waiters:
+            priority, _, fut = self._waiters[0]
+            if fut.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._fits(priority):
+                return
+            heapq.heappop(self._waiters)
+            self._take(priority)
+            fut.set_result(None)
+
+    def _release(self, priority: int) -> None:
+        self.running -= 1
+        if self._heavy(priority):
+            self.running_heavy -= 1
+        self._dispatch()
+
+    # ------------------------------------------------------------------
+    def _preexec(self) -> None:
+        if self.nice:
+            try:
+                os.nice(self.nice)
+            except OSError:
+                pass
+
+    def _lower_io(self, pid: int) -> None:
+        if not self.ionice or psutil is None:
+            return
+        try:
+            psutil.Process(pid).ionice(psutil.IOPRIO_CLASS_IDLE)
+        except Exception:
+            pass
+
+    def _stat(self, kind: str) -> Dict[str, float]:
+        return self.stats.setdefault(kind, {"jobs": 0, "failed": 0, "timeouts": 0, "wait_s": 0.0, "run_s": 0.0})
+
+    async def run(
+        self,
+        args: Sequence[str],
+        priority: int = PRIORITY_TRANSCODE,
+        timeout: Optional[float] = None,
+        kind: Optional[str] = None,
+    ) -> Tuple[int, bytes, bytes]:
+        """Runs `args` when a slot is free; returns (returncode, stdout, stderr). Raises MediaJobError on timeout."""
+        kind = kind or os.path.basename(args[0])
+        stat = self._stat(kind)
+        queued_at = time.monotonic()
+        await self._acquire(priority)
+        started = time.monotonic()
+        stat["wait_s"] += started - queued_at
+        stat["jobs"] += 1
+        proc = None
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *args,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                preexec_fn=self._preexec if os.name == "posix" else None,
+            )
+            self._lower_io(proc.pid)
+            try:
+                out, err = await asyncio.wait_for(proc.communicate(), timeout=timeout or self.timeout)
+            except asyncio.TimeoutError:
+                stat["timeouts"] += 1
+                raise MediaJobError(f"{kind} timed out after {timeout or self.timeout:g}s")
+            if proc.returncode != 0:
+                stat["failed"] += 1
+            return proc.returncode, out, err
+        except BaseException:
+            if proc is not None and proc.returncode is None:
+                try:
+                    proc.kill()
+                    await proc.wait()
+                except ProcessLookupError:
+                    pass
+            raise
+        finally:
+            stat["run_s"] += time.monotonic() - started
+            self._release(priority)
+
+    def snapshot(self) -> Dict[str, Any]:
+        kinds = {
+            k: {
+                "jobs": int(v["jobs"]),
+                "failed": int(v["failed"]),
+                "timeouts": int(v["timeouts"]),
+                "avg_wait_ms": round(1000 * v["wait_s"] / v["jobs"]) if v["jobs"] else 0,
+                "avg_run_ms": round(1000 * v["run_s"] / v["jobs"]) if v["jobs"] else 0,
+            }
+            for k, v in self.stats.items()
+        }
+        return {"workers": self.workers, "reserved": self.reserved, "running": self.running, "queued": len(self._waiters), "kinds": kinds}
+
+
+MEDIA_JOBS = MediaJobPool(MEDIA_JOB_WORKERS)
@@ -0,0 +1,158 @@
+import asyncio
+import time
+from typing import Dict, Iterable, Optional
+
+from config import PACE_START_RATE, PACE_MIN_RATE, PACE_CHAT_MAX_RATE, PACE_CLIENT_MAX_RATE, PACE_BURST, PACE_RAMP_AFTER
+
+
+class TokenBucket:
+    """
+    Adaptive token bucket (sends per second).
+
+    The rate grows additively after every `ramp_after` calls that finished
+    without a FloodWait and is halved when one is raised; the bucket is
+    also closed until the FloodWait has expired.
+    """
+
+    def __init__(self, rate: float, burst: float, min_rate: float, max_rate: float, ramp_after: int, step: float = 0.1):
+        self.rate = min(rate, max_rate)
+        self.step = step
+        self.burst = max(1.0, burst)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.ramp_after = max(1, ramp_after)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.clean_streak = 0
+        self.floods = 0
+        self.waiting = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        self.waiting += 1
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    if now < self.blocked_until:
+                        await asyncio.sleep(self.blocked_until - now)
+                        continue
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+        finally:
+            self.waiting -= 1
+
+    def success(self) -> None:
+        self.clean_streak += 1
+        if self.clean_streak >= self.ramp_after:
+            self.clean_streak = 0
+            self.rate = min(self.max_rate, self.rate + self.step)
+
+    def flood(self, seconds: float) -> None:
+        self.floods += 1
+        self.clean_streak = 0
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + max(0.0, seconds))
+
+    def blocked(self) -> bool:
+        return time.monotonic() < self.blocked_until
+
+    def available(self) -> bool:
+        now = time.monotonic()
+        if now < self.blocked_until or self.waiting:
+            return False
+        return min(self.burst, self.tokens + (now - self.updated) * self.rate) >= 1
+
+    def idle(self, now: float, max_idle: float) -> bool:
+        return not self.waiting and now >= self.blocked_until and now - self.updated > max_idle
+
+
+class Pacer:
+    """
+    Keyed token buckets: "chat:<client>:<id>" per client and target chat, "method:<client>.<name>"
+    per client method (see utils.rpc).
+    """
+
+    MAX_BUCKETS = 5000
+    MAX_IDLE = 600
+
+    def __init__(self):
+        self.buckets: Dict[str, TokenBucket] = {}
+
+    def bucket(self, key: str) -> TokenBucket:
+        b = self.buckets.get(key)
+        if b is None:
+            if len(self.buckets) >= self.MAX_BUCKETS:
+                self._prune()
+            if key.startswith("chat:"):
+                # Telegram allows roughly one message per second per chat;
+                # start below that and ramp up while nothing floods
+                b = TokenBucket(PACE_START_RATE, PACE_BURST, PACE_MIN_RATE, PACE_CHAT_MAX_RATE, PACE_RAMP_AFTER)
+            else:
+                # a client as a whole goes much faster across chats, only
+                # back off once it is actually flooded
+                b = TokenBucket(PACE_CLIENT_MAX_RATE, PACE_CLIENT_MAX_RATE, PACE_MIN_RATE, PACE_CLIENT_MAX_RATE, PACE_RAMP_AFTER, step=1.0)
+            self.buckets[key] = b
+        return b
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for k in [k for k, b in self.buckets.items() if b.idle(now, self.MAX_IDLE)]:
+            self.buckets.pop(k, None)
+
+    async def acquire(self, *keys: str) -> None:
+        for k in keys:
+            if k:
+                await self.bucket(k).acquire()
+
+    def success(self, *keys: str) -> None:
+        for k in keys:
+            if k:
+                self.bucket(k).success()
+
+    def flood(self, seconds: float, *keys: str) -> None:
+        for k in keys:
+            if k:
+                self.bucket(k).flood(seconds)
+
+    def blocked(self, *keys: str) -> bool:
+        return any(k in self.buckets and self.buckets[k].blocked() for k in keys if k)
+
+    def available(self, *keys: str) -> bool:
+        return all(k not in self.buckets or self.buckets[k].available() for k in keys if k)
+
+    def rate(self, key: str) -> Optional[float]:
+        b = self.buckets.get(key)
+        return b.rate if b else None
+
+    def snapshot(self, keys: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, float]]:
+        now = time.monotonic()
+        out = {}
+        for k in (keys if keys is not None else list(self.buckets)):
+            b = self.buckets.get(k)
+            if not b:
+                continue
+            out[k] = {
+                "rate": round(b.rate, 3),
+                "waiting": b.waiting,
+                "floods": b.floods,
+                "blocked_for": round(max(0.0, b.blocked_until - now), 1),
+            }
+        return out
+
+
+def chat_key(client_name: str, chat_id) -> str:
+    # per client: the flood limit Telegram applies to a chat is counted per account
+    return f"chat:{client_name}:{chat_id}"
+
+
+PACER = Pacer()
@@ -0,0 +1,177 @@
+import logging
+from typing import Any, List, Optional, Tuple
+
+from pyrogram import raw
+
+from config import PEER_SCAN_LIMIT
+from utils.func import peers_collection, save_peers, get_peer, get_peer_by_username
+
+logger = logging.getLogger(__name__)
+
+
+def peer_candidates(chat_id) -> List[int]:
+    """Numeric spellings a link's chat id may stand for (-100 / - / bare)."""
+    s = str(chat_id)
+    try:
+        if s.startswith("-100"):
+            return [int(s), int(f"-{s[4:]}")]
+        if s.lstrip("-").isdigit():
+            if s.startswith("-"):
+                return [int(s)]
+            return [int(f"-100{s}"), int(f"-{s}"), int(s)]
+    except ValueError:
+        pass
+    return []
+
+
+def peer_username(chat_id) -> Optional[str]:
+    """The username a public link points at, spelled the way pyrogram stores it."""
+    s = str(chat_id).strip().lstrip("@").lower()
+    return s if s and not s.lstrip("-").isdigit() else None
+
+
+def _peer_type(peer) -> Optional[str]:
+    if isinstance(peer, raw.types.InputPeerChannel):
+        return "channel"
+    if isinstance(peer, raw.types.InputPeerChat):
+        return "group"
+    if isinstance(peer, raw.types.InputPeerUser):
+        return "user"
+    return None
+
+
+class PeerStore:
+    """
+    Access hashes of every account we log in as, persisted in Mongo.
+
+    Pyrogram can only address a chat it has an access hash for. Session
+    string clients keep those in memory, so every new client used to walk
+    its dialogs before the first fetch. `ensure` now answers from the
+    session, then from Mongo (seeding the session), and only on a miss scans
+    the dialogs until the chat shows up, saving what it saw on the way.
+    Usernames are looked up the same way, which spares the rate-limited
+    ResolveUsername call for public chats this account has seen before.
+    """
+
+    def __init__(self, scan_limit: int = PEER_SCAN_LIMIT):
+        self.scan_limit = scan_limit
+        self._indexed = False
+        self._saved: set = set()  # (owner, peer_id) known to be in Mongo
+        self.stats = {"session": 0, "mongo": 0, "scan": 0, "miss": 0}
+
+    @staticmethod
+    def _owner(client: Any) -> Optional[int]:
+        me = getattr(client, "me", None)
+        return getattr(me, "id", None)
+
+    async def _from_session(self, client: Any, peer_id: int) -> Optional[Any]:
+        try:
+            return await client.storage.get_peer_by_id(peer_id)
+        except Exception:
+            return None
+
+    async def _ensure_index(self) -> None:
+        if self._indexed:
+            return
+        self._indexed = True
+        try:
+            await peers_collection.create_index([("owner_id", 1), ("peer_id", 1)], unique=True)
+            await peers_collection.create_index([("owner_id", 1), ("username", 1)], sparse=True)
+        except Exception as e:
+            logger.warning(f"peers index: {e}")
+
+    async def ensure(self, client: Any, chat_id) -> bool:
+        """True when `client` can resolve `chat_id` (one of its numeric spellings) without a dialog scan."""
+        ids = peer_candidates(chat_id)
+        if not ids:
+            await self._ensure_username(client, peer_username(chat_id))
+            return True  # otherwise Telegram resolves the username
+
+        owner = self._owner(client)
+        for pid in ids:
+            if await self._from_session(client, pid) is not None:
+                self.stats["session"] += 1
+                if owner is not None and (owner, pid) not in self._saved:
+                    await self.remember(client, pid)
+                return True
+
+        if owner is not None:
+            await self._ensure_index()
+            for pid in ids:
+                try:
+                    doc = await get_peer(owner, pid)
+                except Exception:
+                    doc = None
+                if doc:
+                    await client.storage.update_peers([(pid, doc["access_hash"], doc["type"], doc.get("username"), None)])
+                    self._saved.add((owner, pid))
+                    self.stats["mongo"] += 1
+                    return True
+
+        found = await self._scan(client, owner, set(ids))
+        self.stats["scan" if found else "miss"] += 1
+        return found
+
+    async def _ensure_username(self, client: Any, username: Optional[str]) -> None:
+        owner = self._owner(client)
+        if not username or owner is None:
+            return
+        try:
+            await client.storage.get_peer_by_username(username)
+            self.stats["session"] += 1
+            return
+        except Exception:
+            pass
+        await self._ensure_index()
+        try:
+            doc = await get_peer_by_username(owner, username)
+        except Exception:
+            doc = None
+        if doc:
+            await client.storage.update_peers([(doc["peer_id"], doc["access_hash"], doc["type"], username, None)])
+            self._saved.add((owner, doc["peer_id"]))
+            self.stats["mongo"] += 1
+
+    async def _scan(self, client: Any, owner: Optional[int], wanted: set) -> bool:
+        seen: List[Tuple[int, int, str, Optional[str]]] = []
+        found = False
+        try:
+            async for d in client.get_dialogs(limit=self.scan_limit):
+                chat = d.chat
+                try:
+                    peer = await self._from_session(client, chat.id)
+                    ptype = _peer_type(peer)
+                    if ptype:
+                        # basic groups (InputPeerChat) have no access hash
+                        uname = (getattr(chat, "username", None) or "").lower() or None
+                        seen.append((chat.id, getattr(peer, "access_hash", 0), ptype, uname))
+                except Exception as e:
+                    logger.debug(f"skipping dialog {getattr(chat, 'id', None)}: {e}")
+                if chat.id in wanted:
+                    found = True
+                    break
+        except Exception as e:
+            logger.warning(f"dialog scan failed: {e}")
+        if owner is not None and seen:
+            try:
+                await save_peers(owner, seen)
+                self._saved.update((owner, p[0]) for p in seen)
+            except Exception as e:
+                logger.warning(f"saving peers failed: {e}")
+        return found
+
+    async def remember(self, client: Any, chat_id: int) -> None:
+        """Persists a peer the session already knows (e.g. after a successful fetch)."""
+        owner = self._owner(client)
+        peer = await self._from_session(client, chat_id)
+        ptype = _peer_type(peer)
+        if owner is None or not ptype:
+            return
+        try:
+            await save_peers(owner, [(chat_id, getattr(peer, "access_hash", 0), ptype, None)])
+            self._saved.add((owner, chat_id))
+        except Exception:
+            pass
+
+
+PEERS = PeerStore()
@@ -0,0 +1,180 @@
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import shutil
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, Optional, Tuple
+
+from config import PROBE_WORKERS, PROBE_CACHE_SIZE, PROBE_TIMEOUT
+from utils.media_jobs import MEDIA_JOBS, MediaJobError, PRIORITY_PROBE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METADATA = {"width": 1, "height": 1, "duration": 1}
+
+
+def _cv2_probe(path: str) -> Optional[Dict[str, int]]:
+    """Fallback when ffprobe is not installed: decodes through OpenCV."""
+    import cv2
+
+    vcap = cv2.VideoCapture(path)
+    try:
+        if not vcap.isOpened():
+            return None
+        width = round(vcap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = round(vcap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = vcap.get(cv2.CAP_PROP_FPS)
+        frame_count = vcap.get(cv2.CAP_PROP_FRAME_COUNT)
+        if fps <= 0:
+            return None
+        duration = round(frame_count / fps)
+        if duration <= 0:
+            return None
+        return {"width": width, "height": height, "duration": duration}
+    finally:
+        vcap.release()
+
+
+def _parse_ffprobe(out: bytes) -> Optional[Dict[str, int]]:
+    data = json.loads(out or b"{}")
+    streams = data.get("streams") or [{}]
+    v = streams[0]
+    duration = v.get("duration") or (data.get("format") or {}).get("duration")
+    try:
+        duration = round(float(duration))
+    except (TypeError, ValueError):
+        duration = 0
+    width, height = int(v.get("width") or 0), int(v.get("height") or 0)
+    if duration <= 0 and not width:
+        return None
+    return {"width": width or 1, "height": height or 1, "duration": max(duration, 1)}
+
+
+class ProbeService:
+    """
+    Process-wide media probing with a fixed number of probes in flight.
+
+    ffprobe reads only the container headers (no frame decoding); OpenCV is
+    the fallback when ffprobe is missing, on one shared thread pool instead
+    of a new executor per call. Results are cached by (path, inode, mtime,
+    size), so the same file is probed once however many times it is asked
+    for, and a replaced file is probed again.
+    """
+
+    def __init__(self, workers: int = PROBE_WORKERS, cache_size: int = PROBE_CACHE_SIZE, timeout: float = PROBE_TIMEOUT):
+        self.workers = max(1, workers)
+        self.cache_size = max(0, cache_size)
+        self.timeout = timeout
+        self.ffprobe = shutil.which("ffprobe")
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._cache: "OrderedDict[Tuple, Dict[str, int]]" = OrderedDict()
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        self._latency: deque = deque(maxlen=200)
+        self.stats = {"calls": 0, "hits": 0, "probes": 0, "failures": 0, "timeouts": 0}
+
+    @staticmethod
+    def _key(path: str) -> Optional[Tuple]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (os.path.realpath(path), st.st_ino, st.st_mtime_ns, st.st_size)
+
+    async def video_metadata(self, path: str) -> Dict[str, int]:
+        """{'width', 'height', 'duration'}; the old defaults (1, 1, 1) when the file cannot be probed."""
+        self.stats["calls"] += 1
+        key = self._key(path)
+        if key is None:
+            self.stats["failures"] += 1
+            return dict(DEFAULT_METADATA)
+        hit = self._cache.get(key)
+        if hit is not None:
+            self._cache.move_to_end(key)
+            self.stats["hits"] += 1
+            return dict(hit)
+
+        # concurrent asks for the same file share one probe
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.stats["hits"] += 1
+            return dict(await asyncio.shield(pending))
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            result = await self._probe(path)
+            if result is not None and self.cache_size:
+                self._cache[key] = result
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            result = result or dict(DEFAULT_METADATA)
+            fut.set_result(result)
+            return dict(result)
+        finally:
+            if not fut.done():
+                fut.set_result(dict(DEFAULT_METADATA))  # cancelled: waiters get the defaults
+            self._inflight.pop(key, None)
+
+    async def _probe(self, path: str) -> Optional[Dict[str, int]]:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.workers)
+        async with self._sem:
+            t0 = time.monotonic()
+            self.stats["probes"] += 1
+            try:
+                result = await self._run(path)
+            except (asyncio.TimeoutError, MediaJobError):
+                self.stats["timeouts"] += 1
+                logger.warning(f"probe timed out after {self.timeout}s: {path}")
+                result = None
+            except Exception as e:
+                logger.error(f"Error in video_metadata: {e}")
+                result = None
+            self._latency.append(time.monotonic() - t0)
+        if result is None:
+            self.stats["failures"] += 1
+        return result
+
+    async def _run(self, path: str) -> Optional[Dict[str, int]]:
+        if self.ffprobe:
+            # the media job pool times the process from its start, so time
+            # spent queued for a slot doesn't count against the probe
+            return await self._ffprobe(path)
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="probe")
+        return await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(self._executor, _cv2_probe, path), timeout=self.timeout)
+
+    async def _ffprobe(self, path: str) -> Optional[Dict[str, int]]:
+        code, out, err = await MEDIA_JOBS.run(
+            [
+                self.ffprobe, "-v", "error",
+                "-select_streams", "v:0",
+                "-show_entries", "stream=width,height,duration:format=duration",
+                "-of", "json", path,
+            ],
+            priority=PRIORITY_PROBE,
+            timeout=self.timeout,
+            kind="ffprobe",
+        )
+        if code != 0:
+            logger.warning(f"ffprobe failed on {path}: {err.decode(errors='ignore').strip()[:200]}")
+            return None
+        return _parse_ffprobe(out)
+
+    def snapshot(self) -> Dict[str, Any]:
+        lat = sorted(self._latency)
+        return {
+            **self.stats,
+            "cached": len(self._cache),
+            "in_flight": len(self._inflight),
+            "avg_ms": round(1000 * sum(lat) / len(lat)) if lat else 0,
+            "p95_ms": round(1000 * lat[int(0.95 * (len(lat) - 1))]) if lat else 0,
+            "backend": "ffprobe" if self.ffprobe else "opencv",
+        }
+
+
+PROBE = ProbeService()
@@ -0,0 +1,201 @@
+import contextlib
+import contextvars
+import functools
+import inspect
+import logging
+from typing import Any, Dict, Optional
+
+from pyrogram.errors import FloodWait
+from telethon.errors import FloodWaitError
+
+from config import RPC_FLOOD_RETRIES
+from utils.pacing import PACER, chat_key
+
+logger = logging.getLogger(__name__)
+
+# Outbound methods routed through the scheduler (only those the client has).
+SCHEDULED_METHODS = (
+    # pyrogram
+    "send_message", "send_photo", "send_video", "send_document", "send_audio",
+    "send_voice", "send_video_note", "send_sticker", "send_animation",
+    "send_media_group", "copy_message", "forward_messages",
+    "edit_message_text", "edit_message_caption", "edit_message_media",
+    "edit_message_reply_markup", "delete_messages", "get_messages",
+    "get_chat", "get_chat_member", "get_users", "export_chat_invite_link",
+    "answer_callback_query", "send_cached_media",
+    # telethon
+    "send_file", "edit_message", "get_entity",
+)
+
+# Methods that post into a chat and count against its per-chat quota. Edits
+# and deletes only touch status messages already there and are not paced
+# per chat; neither are sends made inside RpcScheduler.status().
+CHAT_WRITE_PREFIXES = ("send_", "copy_", "forward_")
+
+# Library methods that call another scheduled method of the same client
+# internally (telethon send_message(file=...) -> send_file, pyrogram
+# copy_message -> get_messages + Message.copy -> send_cached_media). The
+# inner call is not counted twice. Everything else nested in a call, e.g.
+# progress edits made from an upload's progress callback, is still scheduled.
+NESTED_CALLS = {
+    "send_message": ("send_file",),
+    "copy_message": (
+        "get_messages", "send_cached_media", "send_message", "send_contact",
+        "send_location", "send_venue", "send_poll", "send_game",
+    ),
+}
+
+# (id(client), method) of the scheduled call running in this context
+_IN_RPC: contextvars.ContextVar[Optional[tuple]] = contextvars.ContextVar("_IN_RPC", default=None)
+
+# set while status messages are sent (RpcScheduler.status)
+_STATUS: contextvars.ContextVar[bool] = contextvars.ContextVar("_STATUS", default=False)
+
+
+def _chat_of(method: str, args, kwargs) -> Optional[str]:
+    target = kwargs.get("chat_id", kwargs.get("entity"))
+    if target is None and args:
+        target = args[0]
+    if target is None:
+        return None
+    if isinstance(target, (int, str)):
+        return str(target)
+    for attr in ("id", "user_id", "channel_id", "chat_id"):
+        v = getattr(target, attr, None)
+        if isinstance(v, int):
+            return str(v)
+    return None
+
+
+def _is_async(fn) -> bool:
+    # pyrogram 2.x wraps every method in a plain-def sync adapter
+    # (pyrogram/sync.py) that returns the coroutine inside a running loop;
+    # the async original is kept as __wrapped__
+    try:
+        return inspect.iscoroutinefunction(inspect.unwrap(fn))
+    except ValueError:
+        return False
+
+
+def _flood_seconds(e: Exception) -> Optional[float]:
+    if isinstance(e, FloodWait):
+        return float(e.value)
+    if isinstance(e, FloodWaitError):
+        return float(e.seconds)
+    return None
+
+
+class RpcScheduler:
+    """
+    Single choke point for outbound Telegram calls of every client.
+
+    Each call takes a token from its per-method bucket and, for calls that
+    post into a chat, from that chat's bucket (utils.pacing). A FloodWait
+    closes the affected buckets for its duration: later calls queue on the
+    bucket instead of failing, and the failed call is retried.
+    """
+
+    def __init__(self, pacer=PACER, retries: int = RPC_FLOOD_RETRIES):
+        self.pacer = pacer
+        self.retries = max(0, retries)
+        self.in_flight: Dict[str, int] = {}
+        self.floods: Dict[str, int] = {}
+
+    def install(self, client: Any, name: Optional[str] = None) -> Any:
+        if getattr(client, "_rpc_installed", False):
+            return client
+        cname = name or getattr(client, "name", None) or type(client).__name__
+        for method in SCHEDULED_METHODS:
+            fn = getattr(client, method, None)
+            if fn is None or not _is_async(fn):
+                continue
+            setattr(client, method, self._wrap(id(client), cname, method, fn))
+        client._rpc_installed = True
+        client._rpc_name = cname
+        return client
+
+    def _keys(self, cname: str, method: str, args, kwargs):
+        keys = [f"method:{cname}.{method}"]
+        if method.startswith(CHAT_WRITE_PREFIXES) and not _STATUS.get():
+            chat = _chat_of(method, args, kwargs)
+            if chat:
+                keys.append(chat_key(cname, chat))
+        return keys
+
+    def _wrap(self, cid: int, cname: str, method: str, fn):
+        @functools.wraps(fn)
+        async def scheduled(*args, **kwargs):
+            outer = _IN_RPC.get()
+            if outer and outer[0] == cid and method in NESTED_CALLS.get(outer[1], ()):
+                return await fn(*args, **kwargs)
+            return await self._run(cid, method, self._keys(cname, method, args, kwargs), fn, args, kwargs)
+        return scheduled
+
+    @contextlib.contextmanager
+    def status(self):
+        """Sends made inside take only the per-method token, not the chat's: for "Downloading..."-style status messages."""
+        token = _STATUS.set(True)
+        try:
+            yield
+        finally:
+            _STATUS.reset(token)
+
+    async def call(self, client: Any, method: str, chat_id, fn, *args, **kwargs):
+        """Schedules a call made outside the wrapped methods, e.g. a raw invoke() that posts into `chat_id`."""
+        cname = getattr(client, "_rpc_name", None) or getattr(client, "name", None) or type(client).__name__
+        keys = [f"method:{cname}.{method}"]
+        if chat_id is not None:
+            keys.append(chat_key(cname, chat_id))
+        return await self._run(id(client), method, keys, fn, args, kwargs)
+
+    async def _run(self, cid: int, method: str, keys, fn, args, kwargs):
+        mkey = keys[0]
+        token = _IN_RPC.set((cid, method))
+        try:
+            for attempt in range(self.retries + 1):
+                await self.pacer.acquire(*keys)
+                self.in_flight[mkey] = self.in_flight.get(mkey, 0) + 1
+                try:
+                    r = await fn(*args, **kwargs)
+                except Exception as e:
+                    seconds = _flood_seconds(e)
+                    if seconds is None:
+                        raise
+                    self.floods[mkey] = self.floods.get(mkey, 0) + 1
+                    self.pacer.flood(seconds, *keys)
+                    logger.warning(f"FloodWait {seconds:.0f}s on {mkey} ({keys[-1]}), attempt {attempt + 1}")
+                    if attempt >= self.retries:
+                        raise
+                    continue
+                finally:
+                    self.in_flight[mkey] -= 1
+                self.pacer.success(*keys)
+                return r
+        finally:
+            _IN_RPC.reset(token)
+
+    # ------------------------------------------------------------------
+    def ready(self, client: Any, method: str, chat_id) -> bool:
+        """True when a call would not have to wait; lets lossy callers (progress bars) skip instead of queueing."""
+        cname = getattr(client, "_rpc_name", None) or getattr(client, "name", "")
+        return self.pacer.available(f"method:{cname}.{method}", chat_key(cname, chat_id))
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        out: Dict[str, Dict[str, Any]] = {}
+        for key, b in self.pacer.snapshot().items():
+            if not key.startswith("method:") and not b["waiting"] and not b["blocked_for"]:
+                continue
+            out[key] = {
+                "queued": b["waiting"],
+                "in_flight": self.in_flight.get(key, 0),
+                "rate": b["rate"],
+                "floods": self.floods.get(key, b["floods"]),
+                "blocked_for": b["blocked_for"],
+            }
+        return out
+
+    def queue_depth(self) -> int:
+        return sum(b.waiting for b in self.pacer.buckets.values())
+
+
+RPC = RpcScheduler()
@@ -0,0 +1,161 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Optional
+
+from config import SCHED_SLOTS, SCHED_PREMIUM_WEIGHT, SCHED_PREMIUM_USER_CAP, SCHED_FREE_USER_CAP, SCHED_STARVE_SEC
+
+logger = logging.getLogger(__name__)
+
+PREMIUM, FREE = "premium", "free"
+
+
+class _Waiter:
+    __slots__ = ("fut", "cost", "since", "seq")
+
+    def __init__(self, fut: asyncio.Future, cost: float, seq: int):
+        self.fut = fut
+        self.cost = cost
+        self.since = time.monotonic()
+        self.seq = seq
+
+
+class _User:
+    __slots__ = ("lane", "active", "finish", "queue")
+
+    def __init__(self, lane: str):
+        self.lane = lane
+        self.active = 0
+        self.finish = 0.0  # virtual finish tag of the user's last dispatched item
+        self.queue: Deque[_Waiter] = deque()
+
+
+class FairScheduler:
+    """
+    Global slots for per-item work (downloads) shared by every user.
+
+    Within a lane users are served by start-time fair queueing: each item
+    is tagged max(virtual time, user's last finish) and the smallest tag
+    runs next, premium items advancing their user's tag `premium_weight`
+    times slower. The premium lane goes first, but a free item that has
+    waited `starve_after` seconds is served before it so free users keep
+    moving. A user never holds more than its lane's cap at once.
+    """
+
+    def __init__(
+        self,
+        slots: int = SCHED_SLOTS,
+        premium_weight: float = SCHED_PREMIUM_WEIGHT,
+        premium_cap: int = SCHED_PREMIUM_USER_CAP,
+        free_cap: int = SCHED_FREE_USER_CAP,
+        starve_after: float = SCHED_STARVE_SEC,
+    ):
+        self.slots = max(1, slots)
+        self.weights = {PREMIUM: max(1.0, premium_weight), FREE: 1.0}
+        self.caps = {PREMIUM: max(1, premium_cap), FREE: max(1, free_cap)}
+        self.starve_after = starve_after
+        self.running = 0
+        self.vtime = 0.0
+        self._users: Dict[Any, _User] = {}
+        self._seq = itertools.count()
+        self.stats = {lane: {"served": 0, "wait_s": 0.0, "starved": 0} for lane in (PREMIUM, FREE)}
+
+    # ------------------------------------------------------------------
+    def _user(self, uid: Any, premium: bool) -> _User:
+        lane = PREMIUM if premium else FREE
+        u = self._users.get(uid)
+        if u is None:
+            u = self._users[uid] = _User(lane)
+        u.lane = lane  # follows the latest flag, e.g. a plan bought mid-batch
+        return u
+
+    def _eligible(self, lane: str):
+        for uid, u in self._users.items():
+            if u.lane == lane and u.queue and u.active < self.caps[lane]:
+                yield uid, u
+
+    def _pick(self) -> Optional[Any]:
+        now = time.monotonic()
+        starved = [(u.queue[0].seq, uid) for uid, u in self._eligible(FREE) if now - u.queue[0].since >= self.starve_after]
+        if starved:
+            uid = min(starved)[1]
+            self.stats[FREE]["starved"] += 1
+            return uid
+        for lane in (PREMIUM, FREE):
+            tags = [(max(self.vtime, u.finish), u.queue[0].seq, uid) for uid, u in self._eligible(lane)]
+            if tags:
+                return min(tags)[2]
+        return None
+
+    def _dispatch(self) -> None:
+        while self.running < self.slots:
+            uid = self._pick()
+            if uid is None:
+                return
+            u = self._users[uid]
+            w = u.queue.popleft()
+            if w.fut.done():
+                continue  # cancelled while queued
+            start = max(self.vtime, u.finish)
+            u.finish = start + w.cost / self.weights[u.lane]
+            self.vtime = start
+            u.active += 1
+            self.running += 1
+            st = self.stats[u.lane]
+            st["served"] += 1
+            st["wait_s"] += time.monotonic() - w.since
+            w.fut.set_result(None)
+
+    def _done(self, uid: Any) -> None:
+        u = self._users.get(uid)
+        self.running -= 1
+        if u is not None:
+            u.active -= 1
+            if not u.active and not u.queue:
+                self._users.pop(uid, None)
+        self._dispatch()
+
+    # ------------------------------------------------------------------
+    @asynccontextmanager
+    async def slot(self, uid: Any, premium: bool, cost: float = 1.0):
+        """Runs the body when it is this user's fair turn for one of the global slots."""
+        u = self._user(uid, premium)
+        w = _Waiter(asyncio.get_running_loop().create_future(), cost, next(self._seq))
+        u.queue.append(w)
+        self._dispatch()
+        try:
+            await w.fut
+        except asyncio.CancelledError:
+            if w.fut.done() and not w.fut.cancelled():
+                self._done(uid)  # dispatched as we were cancelled: give the slot back
+            else:
+                try:
+                    u.queue.remove(w)
+                except ValueError:
+                    pass
+                if not u.active and not u.queue:
+                    self._users.pop(uid, None)
+            raise
+        try:
+            yield
+        finally:
+            self._done(uid)
+
+    def snapshot(self) -> Dict[str, Any]:
+        queued = {lane: sum(len(u.queue) for u in self._users.values() if u.lane == lane) for lane in (PREMIUM, FREE)}
+        lanes = {
+            lane: {
+                "queued": queued[lane],
+                "served": int(s["served"]),
+                "starved": int(s["starved"]),
+                "avg_wait_ms": round(1000 * s["wait_s"] / s["served"]) if s["served"] else 0,
+            }
+            for lane, s in self.stats.items()
+        }
+        return {"running": self.running, "slots": self.slots, "users": len(self._users), "lanes": lanes}
+
+
+SCHEDULER = FairScheduler()
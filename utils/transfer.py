@@ -0,0 +1,568 @@
+import asyncio
+import hashlib
+import inspect
+import logging
+import os
+import time
+from io import BytesIO
+from typing import Any, Callable, Optional, Tuple
+
+from pyrogram import Client, raw, types, utils
+from pyrogram.errors import FloodWait, AuthBytesInvalid
+from pyrogram.file_id import FileId, FileType
+from pyrogram.session import Auth, Session
+from pyrogram.types import Message
+
+from config import STREAM_BUFFER_CHUNKS, INMEMORY_MAX_SIZE, DOWNLOAD_CONNECTIONS, DOWNLOAD_RANGE_MB, PARALLEL_MIN_SIZE
+from config import UPLOAD_PARTS_IN_FLIGHT, UPLOAD_PART_RETRIES
+from utils.rpc import RPC
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTS = {".mp4", ".avi", ".mkv", ".mov", ".wmv", ".flv", ".webm", ".m4v", ".3gp", ".ogv"}
+AUDIO_EXTS = {".mp3", ".wav", ".flac", ".aac", ".ogg", ".wma", ".m4a", ".opus", ".aiff", ".ac3"}
+
+PART_SIZE = 512 * 1024                   # largest upload part Telegram accepts
+CHUNK_SIZE = 1024 * 1024                 # download chunk (stream_media / upload.GetFile)
+BIG_FILE_MIN = 10 * 1024 * 1024          # SaveBigFilePart is required above this
+BOT_UPLOAD_LIMIT = 2 * 1024 * 1024 * 1024
+
+MEDIA_KINDS = ("video", "audio", "document", "voice", "video_note", "sticker", "animation", "photo")
+
+
+class ChunkHasher:
+    """
+    Content hash of a file: sha256 over the sha256 of each 1 MB chunk.
+
+    Chunks may be added in any order (add_chunk) or fed as a sequential
+    stream of any split (update), so every transfer route - memory, disk,
+    stream, ranged - produces the same digest for the same bytes.
+    """
+
+    def __init__(self):
+        self._digests: dict = {}
+        self._buf = bytearray()
+        self._next = 0
+
+    def update(self, data: bytes) -> None:
+        self._buf += data
+        while len(self._buf) >= CHUNK_SIZE:
+            self.add_chunk(self._next, bytes(self._buf[:CHUNK_SIZE]))
+            del self._buf[:CHUNK_SIZE]
+            self._next += 1
+
+    def add_chunk(self, index: int, data: bytes) -> None:
+        self._digests[index] = hashlib.sha256(data).digest()
+
+    def hexdigest(self) -> str:
+        if self._buf:
+            self.add_chunk(self._next, bytes(self._buf))
+            self._buf.clear()
+            self._next += 1
+        h = hashlib.sha256()
+        for i in sorted(self._digests):
+            h.update(self._digests[i])
+        return h.hexdigest()
+
+
+def hash_bytes(data) -> str:
+    hasher = ChunkHasher()
+    view = memoryview(data)
+    for k in range(0, len(view), CHUNK_SIZE):
+        hasher.add_chunk(k // CHUNK_SIZE, bytes(view[k:k + CHUNK_SIZE]))
+    return hasher.hexdigest()
+
+
+def media_of(msg: Message) -> Tuple[Optional[str], Any]:
+    for kind in MEDIA_KINDS:
+        m = getattr(msg, kind, None)
+        if m:
+            return kind, m
+    return None, None
+
+
+def media_size(msg: Message) -> int:
+    _, m = media_of(msg)
+    return int(getattr(m, "file_size", 0) or 0)
+
+
+def needs_local_probe(msg: Message, file_name: str) -> bool:
+    """Uploading needs ffprobe/ffmpeg on a real file (duration, size, thumbnail)."""
+    if msg.video:
+        return not msg.video.duration
+    return bool(msg.document and os.path.splitext(file_name)[1].lower() in VIDEO_EXTS)
+
+
+def can_buffer(msg: Message, file_name: str) -> bool:
+    """Small enough to download into memory and upload from there."""
+    size = media_size(msg)
+    return 0 < size <= INMEMORY_MAX_SIZE and not needs_local_probe(msg, file_name)
+
+
+def can_stream(msg: Message, file_name: str, big_ok: bool) -> bool:
+    """Can be piped from the source stream straight into an upload."""
+    size = media_size(msg)
+    if size <= max(INMEMORY_MAX_SIZE, BIG_FILE_MIN):
+        return False
+    if size > BOT_UPLOAD_LIMIT and not big_ok:
+        return False
+    if not (msg.video or msg.audio or msg.document):
+        return False
+    return not needs_local_probe(msg, file_name)
+
+
+async def download_to_memory(client: Client, msg: Message, file_name: str, progress: Optional[Callable] = None, progress_args: tuple = ()) -> Optional[BytesIO]:
+    buf = await client.download_media(msg, in_memory=True, progress=progress, progress_args=progress_args)
+    if not isinstance(buf, BytesIO):
+        return None
+    buf.name = file_name
+    buf.seek(0)
+    return buf
+
+
+def source_video_attrs(msg: Message) -> Optional[dict]:
+    """Duration and size Telegram already knows for the source video; None when it has to be probed."""
+    v = msg.video or msg.animation
+    if not v or not v.duration:
+        return None
+    return {"duration": v.duration, "width": v.width or 1, "height": v.height or 1}
+
+
+async def source_thumb(client: Client, msg: Message) -> Optional[BytesIO]:
+    """The source's own thumbnail (a few KB), in memory; None when it has none."""
+    _, media = media_of(msg)
+    thumbs = getattr(media, "thumbs", None)
+    if not thumbs:
+        return None
+    best = max(thumbs, key=lambda t: (t.file_size or 0, (t.width or 0) * (t.height or 0)))
+    try:
+        buf = await client.download_media(best.file_id, in_memory=True)
+    except Exception as e:
+        logger.info(f"source thumbnail unavailable: {e}")
+        return None
+    if not isinstance(buf, BytesIO) or not buf.getbuffer().nbytes:
+        return None
+    buf.name = "thumb.jpg"
+    buf.seek(0)
+    return buf
+
+
+async def media_session(client: Client, dc_id: Optional[int] = None) -> Session:
+    """
+    The client's media session for `dc_id` (its home DC by default),
+    started once and kept in client.media_sessions, which Client.stop()
+    closes. For a foreign DC the auth key and the exported authorization are
+    set up here once, not for every request sent through it.
+    """
+    home = await client.storage.dc_id()
+    dc_id = dc_id or home
+    async with client.media_sessions_lock:
+        session = client.media_sessions.get(dc_id)
+        if session:
+            return session
+        test_mode = await client.storage.test_mode()
+        if dc_id == home:
+            session = Session(client, dc_id, await client.storage.auth_key(), test_mode, is_media=True)
+            await session.start()
+        else:
+            session = Session(client, dc_id, await Auth(client, dc_id, test_mode).create(), test_mode, is_media=True)
+            await session.start()
+            for _ in range(3):
+                exported = await client.invoke(raw.functions.auth.ExportAuthorization(dc_id=dc_id))
+                try:
+                    await session.invoke(raw.functions.auth.ImportAuthorization(id=exported.id, bytes=exported.bytes))
+                    break
+                except AuthBytesInvalid:
+                    continue
+            else:
+                await session.stop()
+                raise AuthBytesInvalid
+        client.media_sessions[dc_id] = session
+        return session
+
+
+def _file_location(file_id: FileId):
+    if file_id.file_type == FileType.PHOTO:
+        return raw.types.InputPhotoFileLocation(
+            id=file_id.media_id, access_hash=file_id.access_hash,
+            file_reference=file_id.file_reference, thumb_size=file_id.thumbnail_size,
+        )
+    return raw.types.InputDocumentFileLocation(
+        id=file_id.media_id, access_hash=file_id.access_hash,
+        file_reference=file_id.file_reference, thumb_size=file_id.thumbnail_size,
+    )
+
+
+async def iter_media(client: Client, msg: Message, size: int = 0, connections: int = DOWNLOAD_CONNECTIONS):
+    """
+    Yields the media of `msg` in order, in 1 MB chunks.
+
+    Small files are read as one sequential stream. Larger ones are split
+    into DOWNLOAD_RANGE_MB ranges fetched concurrently with upload.GetFile,
+    all through one media session for the file's DC (media_session) and up
+    to the client's max_concurrent_transmissions. Only `limit + 1` ranges are
+    held ahead of the consumer. `limit` starts at 2 and climbs while each
+    extra range in flight still raises measured throughput, and backs off
+    when it falls. A failed range is retried on its own.
+    """
+    size = size or media_size(msg)
+    if connections <= 1 or size < PARALLEL_MIN_SIZE:
+        async for chunk in client.stream_media(msg):
+            yield chunk
+        return
+
+    per_range = max(1, DOWNLOAD_RANGE_MB)
+    total = (size + CHUNK_SIZE - 1) // CHUNK_SIZE
+    ranges = [(start, min(per_range, total - start)) for start in range(0, total, per_range)]
+
+    file_id = FileId.decode(media_of(msg)[1].file_id)
+    location = _file_location(file_id)
+
+    async def read(start: int, count: int) -> list:
+        session = await media_session(client, file_id.dc_id)
+        chunks = []
+        async with client.get_file_semaphore:
+            for index in range(start, start + count):
+                r = await session.invoke(
+                    raw.functions.upload.GetFile(location=location, offset=index * CHUNK_SIZE, limit=CHUNK_SIZE),
+                    sleep_threshold=30,
+                )
+                if not isinstance(r, raw.types.upload.File):
+                    raise IOError(f"unexpected {type(r).__name__} for chunk {index}")
+                chunks.append(r.bytes)
+                if len(r.bytes) < CHUNK_SIZE:
+                    break
+        return chunks
+
+    async def fetch(start: int, count: int) -> list:
+        for attempt in range(3):
+            try:
+                return await read(start, count)
+            except Exception:
+                if attempt == 2:
+                    raise
+                await asyncio.sleep(1 + attempt)
+        return []
+
+    limit = min(2, connections)
+    best_rate = 0.0
+    window_start, window_bytes, window_ranges = time.monotonic(), 0, 0
+    tasks: dict = {}
+    launched = 0
+    try:
+        for i in range(len(ranges)):
+            while launched < len(ranges) and launched <= i + limit and sum(not t.done() for t in tasks.values()) < limit:
+                tasks[launched] = asyncio.create_task(fetch(*ranges[launched]))
+                launched += 1
+            chunks = await tasks.pop(i)
+            for chunk in chunks:
+                window_bytes += len(chunk)
+                yield chunk
+
+            # hill-climb the number of ranges in flight on measured throughput
+            window_ranges += 1
+            if window_ranges >= limit:
+                rate = window_bytes / max(time.monotonic() - window_start, 1e-3)
+                if rate > best_rate * 1.05 and limit < connections:
+                    best_rate = rate
+                    limit += 1
+                elif rate < best_rate * 0.8 and limit > 1:
+                    limit -= 1
+                    best_rate = rate
+                else:
+                    best_rate = max(best_rate, rate)
+                window_start, window_bytes, window_ranges = time.monotonic(), 0, 0
+    finally:
+        for t in tasks.values():
+            t.cancel()
+
+
+async def download_to_file(
+    client: Client,
+    msg: Message,
+    path: str,
+    hasher: Optional[ChunkHasher] = None,
+    progress: Optional[Callable] = None,
+    progress_args: tuple = (),
+) -> Optional[str]:
+    """Download of `msg` into `path` (see iter_media), hashing the chunks as they arrive."""
+    size = media_size(msg)
+    done = 0
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    f = open(path, "wb")
+    chunks = iter_media(client, msg, size)
+    try:
+        async for chunk in chunks:
+            await asyncio.to_thread(f.write, chunk)
+            if hasher:
+                hasher.update(chunk)
+            done += len(chunk)
+            if progress and size:
+                await progress(min(done, size), size, *progress_args)
+    except Exception:
+        f.close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
+    finally:
+        await chunks.aclose()
+    f.close()
+    return path if done else None
+
+
+class PartUploader:
+    """
+    Saves the parts of one upload with up to `in_flight` SaveFilePart /
+    SaveBigFilePart requests at a time, sent through the client's home-DC
+    media session so they do not queue ahead of its other calls. A failed part is retried on its own
+    (waiting out a FloodWait); the first part that keeps failing fails the
+    upload on the next put() or on finish().
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        total_parts: int,
+        big: bool,
+        in_flight: int = UPLOAD_PARTS_IN_FLIGHT,
+        size: int = 0,
+        progress: Optional[Callable] = None,
+        progress_args: tuple = (),
+    ):
+        self.client = client
+        self.file_id = client.rnd_id()
+        self.total_parts = total_parts
+        self.big = big
+        self.size = size
+        self.progress = progress
+        self.progress_args = progress_args
+        self.done = 0
+        self._sem = asyncio.Semaphore(max(1, in_flight))
+        self._tasks: set = set()
+        self._error: Optional[BaseException] = None
+
+    def _request(self, part: int, data: bytes):
+        if self.big:
+            return raw.functions.upload.SaveBigFilePart(
+                file_id=self.file_id, file_part=part, file_total_parts=self.total_parts, bytes=data,
+            )
+        return raw.functions.upload.SaveFilePart(file_id=self.file_id, file_part=part, bytes=data)
+
+    async def _save(self, part: int, data: bytes) -> None:
+        try:
+            for attempt in range(UPLOAD_PART_RETRIES):
+                try:
+                    session = await media_session(self.client)
+                    if await session.invoke(self._request(part, data)):
+                        break
+                    raise IOError(f"part {part} was not saved")
+                except FloodWait as e:
+                    await asyncio.sleep(e.value)
+                except Exception:
+                    if attempt >= UPLOAD_PART_RETRIES - 1:
+                        raise
+                    await asyncio.sleep(1 + attempt)
+            else:
+                raise IOError(f"part {part} was not saved")
+            self.done += len(data)
+            if self.progress and self.size:
+                await self.progress(min(self.done, self.size), self.size, *self.progress_args)
+        except Exception as e:
+            self._error = self._error or e
+        finally:
+            self._sem.release()
+
+    async def put(self, part: int, data: bytes) -> None:
+        if self._error:
+            raise self._error
+        await self._sem.acquire()
+        task = asyncio.create_task(self._save(part, data))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def finish(self) -> None:
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks))
+        if self._error:
+            raise self._error
+
+    def abort(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+
+    def input_file(self, file_name: str):
+        if self.big:
+            return raw.types.InputFileBig(id=self.file_id, parts=self.total_parts, name=file_name)
+        return raw.types.InputFile(id=self.file_id, parts=self.total_parts, name=file_name, md5_checksum="")
+
+
+async def stream_upload(
+    src: Client,
+    dst: Client,
+    msg: Message,
+    file_name: str,
+    size: int,
+    progress: Optional[Callable] = None,
+    progress_args: tuple = (),
+    hasher: Optional[ChunkHasher] = None,
+) -> "raw.types.InputFileBig":
+    """
+    Uploads the media of `msg` (read with `src`) as a big file of `dst`
+    while it is still being downloaded. At most STREAM_BUFFER_CHUNKS chunks
+    of the source stream are held in memory; nothing is written to disk.
+    """
+    total_parts = (size + PART_SIZE - 1) // PART_SIZE
+    uploader = PartUploader(dst, total_parts, big=True, size=size, progress=progress, progress_args=progress_args)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, STREAM_BUFFER_CHUNKS))
+
+    async def produce():
+        chunks = iter_media(src, msg, size)
+        try:
+            async for chunk in chunks:
+                await queue.put(chunk)
+        except Exception as e:
+            await queue.put(e)
+            return
+        finally:
+            await chunks.aclose()
+        await queue.put(None)
+
+    producer = asyncio.create_task(produce())
+    pending = bytearray()
+    part = 0
+    try:
+        while True:
+            item = await queue.get()
+            if isinstance(item, Exception):
+                raise item
+            if item is None:
+                break
+            if hasher:
+                hasher.update(item)
+            pending += item
+            while len(pending) >= PART_SIZE:
+                await uploader.put(part, bytes(pending[:PART_SIZE]))
+                del pending[:PART_SIZE]
+                part += 1
+        if pending:
+            await uploader.put(part, bytes(pending))
+            part += 1
+        if part != total_parts:
+            raise IOError(f"{file_name}: streamed {part} parts, expected {total_parts}")
+        await uploader.finish()
+    except BaseException:
+        uploader.abort()
+        raise
+    finally:
+        if not producer.done():
+            producer.cancel()
+            try:
+                await producer
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    return uploader.input_file(file_name)
+
+
+async def upload_file(
+    client: Client,
+    src,
+    file_name: str,
+    progress: Optional[Callable] = None,
+    progress_args: tuple = (),
+    in_flight: int = UPLOAD_PARTS_IN_FLIGHT,
+):
+    """Uploads a path or a file object as parallel parts; returns the InputFile for send_uploaded."""
+    own = isinstance(src, (str, os.PathLike))
+    f = open(src, "rb") if own else src
+    try:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(0)
+        total_parts = max(1, (size + PART_SIZE - 1) // PART_SIZE)
+        uploader = PartUploader(client, total_parts, big=size > BIG_FILE_MIN, in_flight=in_flight, size=size, progress=progress, progress_args=progress_args)
+        try:
+            for part in range(total_parts):
+                await uploader.put(part, await asyncio.to_thread(f.read, PART_SIZE))
+            await uploader.finish()
+        except BaseException:
+            uploader.abort()
+            raise
+    finally:
+        if own:
+            f.close()
+    return uploader.input_file(file_name)
+
+
+def _reply_to(reply_to: Optional[int]) -> dict:
+    if not reply_to:
+        return {}
+    # newer layers replaced reply_to_msg_id with an InputReplyTo object
+    if "reply_to" in inspect.signature(raw.functions.messages.SendMedia.__init__).parameters:
+        return {"reply_to": raw.types.InputReplyToMessage(reply_to_msg_id=reply_to)}
+    return {"reply_to_msg_id": reply_to}
+
+
+async def send_uploaded(
+    client: Client,
+    chat_id,
+    msg: Message,
+    file,
+    file_name: str,
+    caption: Optional[str] = None,
+    thumb=None,
+    reply_to: Optional[int] = None,
+    kind: Optional[str] = None,
+    duration: Optional[int] = None,
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+) -> Optional[Message]:
+    """
+    Sends a file uploaded with stream_upload / upload_file as the same kind
+    of media as `msg` ("video", "audio" or "document"; `kind` overrides).
+    Video attributes default to the source's.
+    """
+    kind = kind or ("video" if msg.video else "audio" if msg.audio else "document")
+    mime = client.guess_mime_type(file_name) or "application/octet-stream"
+    attributes = [raw.types.DocumentAttributeFilename(file_name=file_name)]
+    if kind == "video":
+        if not mime.startswith("video/"):
+            mime = "video/mp4"
+        v = msg.video
+        attributes.insert(0, raw.types.DocumentAttributeVideo(
+            supports_streaming=True,
+            duration=duration if duration is not None else (v.duration if v else 0) or 0,
+            w=width if width is not None else (v.width if v else 0) or 0,
+            h=height if height is not None else (v.height if v else 0) or 0,
+        ))
+    elif kind == "audio":
+        a = msg.audio
+        attributes.insert(0, raw.types.DocumentAttributeAudio(
+            duration=(a.duration if a else 0) or 0,
+            performer=a.performer if a else None,
+            title=a.title if a else None,
+        ))
+
+    media = raw.types.InputMediaUploadedDocument(
+        mime_type=mime,
+        file=file,
+        thumb=await client.save_file(thumb) if thumb else None,
+        attributes=attributes,
+    )
+    request = raw.functions.messages.SendMedia(
+        peer=await client.resolve_peer(chat_id),
+        media=media,
+        random_id=client.rnd_id(),
+        **_reply_to(reply_to),
+        **await utils.parse_text_entities(client, caption or "", None, None),
+    )
+    r = await RPC.call(client, "send_media", chat_id, client.invoke, request)
+
+    users = {u.id: u for u in getattr(r, "users", [])}
+    chats = {c.id: c for c in getattr(r, "chats", [])}
+    for u in getattr(r, "updates", []):
+        if isinstance(u, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+            return await types.Message._parse(client, u.message, users, chats)
+    return None
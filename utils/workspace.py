@@ -0,0 +1,158 @@
+import itertools
+import logging
+import os
+import re
+import shutil
+import time
+from typing import Any, Dict, Optional
+
+from config import WORKSPACE_ROOT, WORKSPACE_TMPFS, WORKSPACE_TMPFS_MAX
+
+logger = logging.getLogger(__name__)
+
+TMPFS_DIR = "/dev/shm"
+
+
+def safe_name(name: str) -> str:
+    """A file name that stays inside its directory, whatever the source called it."""
+    name = re.sub(r'[<>:"/\\|?*\'\x00-\x1f]', "_", os.path.basename(str(name))).strip(" .")
+    return name[:255] or "file"
+
+
+class Workspace:
+    """One job's private directory: every file of the job lives here and goes with it."""
+
+    def __init__(self, manager: "WorkspaceManager", path: str):
+        self.manager = manager
+        self.path = path
+        self.created = time.time()
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, safe_name(name))
+
+    def usage(self) -> int:
+        total = 0
+        try:
+            with os.scandir(self.path) as it:
+                for e in it:
+                    try:
+                        total += e.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+        return total
+
+    def cleanup(self) -> None:
+        self.manager.release(self)
+
+
+class WorkspaceManager:
+    """
+    Hands out per-job directories under `root` and removes them whole when
+    the job ends, so cleanup never lists a shared directory and two jobs
+    can't collide on a file name.
+
+    A job expected to stay under `tmpfs_max` bytes gets its directory on
+    tmpfs (/dev/shm) when there is room for it; larger ones, and all jobs
+    when tmpfs is off or missing, go to `root` on disk.
+    """
+
+    def __init__(self, root: str = WORKSPACE_ROOT, tmpfs: bool = WORKSPACE_TMPFS, tmpfs_max: int = WORKSPACE_TMPFS_MAX):
+        self.root = os.path.abspath(root)
+        self.tmpfs_root = os.path.join(TMPFS_DIR, os.path.basename(self.root) or "workspaces") if tmpfs else None
+        self.tmpfs_max = tmpfs_max
+        self._seq = itertools.count(1)
+        self._active: Dict[str, Workspace] = {}
+        self.stats = {"opened": 0, "closed": 0, "tmpfs": 0, "bytes_released": 0}
+        self._prepare()
+
+    def _prepare(self) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        if self.tmpfs_root:
+            try:
+                if os.path.isdir(TMPFS_DIR) and os.access(TMPFS_DIR, os.W_OK):
+                    os.makedirs(self.tmpfs_root, exist_ok=True)
+                else:
+                    self.tmpfs_root = None
+            except OSError:
+                self.tmpfs_root = None
+
+    def _roots(self):
+        return [r for r in (self.root, self.tmpfs_root) if r]
+
+    def _pick_root(self, expected_size: int) -> str:
+        if self.tmpfs_root and 0 < expected_size <= self.tmpfs_max:
+            try:
+                # leave room for the rest of the machine
+                if shutil.disk_usage(self.tmpfs_root).free - expected_size > self.tmpfs_max:
+                    return self.tmpfs_root
+            except OSError:
+                pass
+        return self.root
+
+    def open(self, tag: Any = "job", expected_size: int = 0) -> Workspace:
+        root = self._pick_root(expected_size)
+        path = os.path.join(root, f"{safe_name(str(tag))}-{os.getpid()}-{next(self._seq)}")
+        os.makedirs(path, exist_ok=True)
+        ws = Workspace(self, path)
+        self._active[path] = ws
+        self.stats["opened"] += 1
+        if root == self.tmpfs_root:
+            self.stats["tmpfs"] += 1
+        return ws
+
+    def release(self, ws: Optional[Workspace]) -> None:
+        if ws is None or self._active.pop(ws.path, None) is None:
+            return
+        self.stats["bytes_released"] += ws.usage()
+        self.stats["closed"] += 1
+        shutil.rmtree(ws.path, ignore_errors=True)
+
+    @staticmethod
+    def _owner_alive(name: str) -> bool:
+        # "<tag>-<pid>-<seq>": another process on this host (a second node) still owns it
+        try:
+            pid = int(name.rsplit("-", 2)[-2])
+        except (IndexError, ValueError):
+            return False
+        if pid == os.getpid():
+            return False
+        try:
+            os.kill(pid, 0)
+            return True
+        except PermissionError:
+            return True
+        except OSError:
+            return False
+
+    def sweep(self, max_age_hours: float = 24) -> int:
+        """Removes directories no live job owns (left by a crash or a cancelled batch)."""
+        cutoff = time.time() - max_age_hours * 3600
+        removed = 0
+        for root in self._roots():
+            try:
+                entries = list(os.scandir(root))
+            except OSError:
+                continue
+            for e in entries:
+                if e.path in self._active or not e.is_dir(follow_symlinks=False) or self._owner_alive(e.name):
+                    continue
+                try:
+                    if e.stat().st_mtime >= cutoff:
+                        continue
+                except OSError:
+                    continue
+                shutil.rmtree(e.path, ignore_errors=True)
+                removed += 1
+        return removed
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "active": len(self._active),
+            "bytes": sum(ws.usage() for ws in self._active.values()),
+            **self.stats,
+        }
+
+
+WORKSPACES = WorkspaceManager()
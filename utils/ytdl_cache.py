@@ -0,0 +1,139 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from telethon.tl.types import InputDocument
+
+from config import LOG_GROUP, FILE_CACHE_MIRROR, YTDL_CACHE_TTL_HOURS, YTDL_CACHE_MAX_ENTRIES
+from utils.func import file_cache_collection, get_cached_file, save_cached_file, forget_cached_file, trim_cached_files
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "ytdl:"
+OWN_KEYS = {"cache": "ytdl"}  # marker on our entries in the shared collection
+TRIM_EVERY = 50  # stores between two trims to max_entries
+
+
+class YtdlUploadCache:
+    """
+    /dl and /adl results already on Telegram, keyed by (extractor, video id,
+    format spec, output kind), so a link someone else fetched recently is
+    resent instead of downloaded, converted and uploaded again.
+
+    Entries live in the file_cache collection under "ytdl:" keys. Each holds
+    the sent document (id, access hash, file reference) and, with
+    FILE_CACHE_MIRROR, a copy in LOG_GROUP to fall back on once the file
+    reference expires. Entries expire after `ttl_hours` and, checked every
+    TRIM_EVERY stores, only the newest `max_entries` are kept.
+    """
+
+    def __init__(
+        self,
+        ttl_hours: float = YTDL_CACHE_TTL_HOURS,
+        max_entries: int = YTDL_CACHE_MAX_ENTRIES,
+        log_chat: int = LOG_GROUP,
+        mirror: bool = FILE_CACHE_MIRROR,
+    ):
+        self.ttl_hours = ttl_hours
+        self.max_entries = max(0, max_entries)
+        self.log_chat = log_chat
+        self.mirror = mirror
+        self._indexed = False
+        self._stores = 0
+        self.stats = {"hit": 0, "copy": 0, "miss": 0, "stale": 0, "stored": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_hours > 0 and self.max_entries > 0
+
+    def key(self, info: Dict[str, Any], fmt: Optional[str], kind: str) -> Optional[str]:
+        extractor, vid = info.get("extractor_key") or info.get("extractor"), info.get("id")
+        if not self.enabled or not extractor or not vid:
+            return None
+        return f"{PREFIX}{extractor}:{vid}:{fmt or 'default'}:{kind}"
+
+    async def _ensure_indexes(self) -> None:
+        if self._indexed:
+            return
+        self._indexed = True
+        try:
+            # the same indexes FileCache creates on this collection
+            await file_cache_collection.create_index("expires_at", expireAfterSeconds=0)
+            await file_cache_collection.create_index([("cache", 1), ("updated_at", 1)])
+        except Exception as e:
+            logger.warning(f"ytdl cache index: {e}")
+
+    async def lookup(self, key: Optional[str]) -> Optional[Dict[str, Any]]:
+        if not key:
+            return None
+        await self._ensure_indexes()
+        try:
+            doc = await get_cached_file(key)
+        except Exception:
+            doc = None
+        # the TTL monitor runs once a minute: don't serve what it hasn't removed yet
+        if not doc or (doc.get("expires_at") and doc["expires_at"] < datetime.utcnow()) or not (doc.get("document") or doc.get("log_msg_id")):
+            self.stats["miss"] += 1
+            return None
+        return doc
+
+    async def send(self, client: Any, doc: Dict[str, Any], chat_id: int, caption: str = ""):
+        """Resends a cached result; None when neither the document nor the LOG_GROUP copy works any more."""
+        d = doc.get("document")
+        if d:
+            try:
+                sent = await client.send_file(
+                    chat_id,
+                    InputDocument(id=d["id"], access_hash=d["access_hash"], file_reference=bytes(d["file_reference"])),
+                    caption=caption,
+                )
+                self.stats["hit"] += 1
+                return sent
+            except Exception as e:
+                # expired file reference or a deleted file: try the copy
+                self.stats["stale"] += 1
+                logger.info(f"cached ytdl document unusable ({e})")
+        if doc.get("log_msg_id"):
+            try:
+                mirrored = await client.get_messages(self.log_chat, ids=doc["log_msg_id"])
+                if mirrored is not None and mirrored.media is not None:
+                    sent = await client.send_file(chat_id, mirrored.media, caption=caption)
+                    self.stats["copy"] += 1
+                    await self.store(client, doc["key"], sent, int(doc.get("size") or 0), log_msg_id=doc["log_msg_id"])
+                    return sent
+            except Exception as e:
+                logger.info(f"cached ytdl copy unusable ({e})")
+        try:
+            await forget_cached_file(doc["key"])
+        except Exception:
+            pass
+        return None
+
+    async def store(self, client: Any, key: Optional[str], sent: Any, size: int = 0, log_msg_id: Optional[int] = None) -> None:
+        document = getattr(getattr(sent, "media", None), "document", None)
+        if not key or document is None:
+            return
+        if self.mirror and not log_msg_id:
+            try:
+                mirrored = await client.send_file(self.log_chat, sent.media, caption=key)
+                log_msg_id = mirrored.id
+            except Exception:
+                pass  # this bot is not in the log group; document only
+        extra = {
+            "document": {"id": document.id, "access_hash": document.access_hash, "file_reference": document.file_reference},
+            # UTC, as the TTL monitor compares expires_at
+            "expires_at": datetime.utcnow() + timedelta(hours=self.ttl_hours),
+            **OWN_KEYS,
+        }
+        try:
+            await self._ensure_indexes()
+            await save_cached_file(key, None, None, log_msg_id, size, extra=extra)
+            self._stores += 1
+            if self._stores % TRIM_EVERY == 1:
+                await trim_cached_files(OWN_KEYS, self.max_entries)
+            self.stats["stored"] += 1
+        except Exception as e:
+            logger.warning(f"ytdl cache store failed: {e}")
+
+
+YTDL_CACHE = YtdlUploadCache()
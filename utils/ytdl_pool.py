@@ -0,0 +1,319 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from config import YTDL_PROCESS_WORKERS, YTDL_TIMEOUT, YTDL_INFO_TTL, YTDL_INFO_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LINE_LIMIT = 64 * 1024 * 1024  # one info dict per line; YouTube's run to a few MB
+PROGRESS_EVERY = 1.0
+
+
+# share / tracking parameters that never change what a link points at
+TRACKING_PARAMS = {"si", "feature", "pp", "igsh", "igshid", "fbclid", "gclid", "ref", "ref_src", "s", "t"}
+
+
+class YtdlError(Exception):
+    pass
+
+
+def normalize_url(url: str) -> str:
+    """One spelling per video: youtu.be, shorts and m./www. hosts fold to youtube.com/watch?v=, tracking params go."""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    host = re.sub(r"^(www|m|mobile|music)\.", "", host)
+    path = parts.path.rstrip("/") or "/"
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in TRACKING_PARAMS and not k.startswith("utm_")]
+    if host == "youtu.be":
+        host, query, path = "youtube.com", [("v", path.strip("/"))] + query, "/watch"
+    elif host == "youtube.com":
+        m = re.match(r"^/(shorts|live|embed)/([^/]+)", path)
+        if m:
+            query, path = [("v", m.group(2))] + query, "/watch"
+    return urlunsplit(("https", host, path, urlencode(sorted(query)), ""))
+
+
+class _Worker:
+    """One long-lived `python -m utils.ytdl_pool` child, serving one request at a time."""
+
+    def __init__(self, n: int):
+        self.n = n
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.served = 0
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
+
+    async def ensure(self) -> None:
+        if self.alive():
+            return
+        self.proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "utils.ytdl_pool",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=None,  # yt-dlp's own output goes to the bot's log
+            cwd=ROOT,
+            limit=LINE_LIMIT,
+        )
+
+    async def kill(self) -> None:
+        if self.alive():
+            try:
+                self.proc.kill()
+                await self.proc.wait()
+            except ProcessLookupError:
+                pass
+        self.proc = None
+
+
+class YtdlPool:
+    """
+    yt-dlp runs in `workers` child processes instead of threads of the bot,
+    so extractor work (signature deciphering, JSON parsing) never holds
+    the event loop's GIL.
+
+    Children are started on first use and kept for later requests. A
+    request is one JSON line to a free child; progress events and the
+    final info dict come back as JSON lines and progress is handed to
+    `on_progress`. A cancelled or timed-out request kills its child, which
+    is started again for the next request.
+
+    `extract` keeps info dicts for `info_ttl` seconds by normalized URL, and
+    `download` takes such a dict so the child goes straight to the media
+    instead of extracting the page again.
+    """
+
+    def __init__(
+        self,
+        workers: int = YTDL_PROCESS_WORKERS,
+        timeout: float = YTDL_TIMEOUT,
+        info_ttl: float = YTDL_INFO_TTL,
+        info_cache_size: int = YTDL_INFO_CACHE_SIZE,
+    ):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self._idle: Optional[asyncio.Queue] = None
+        self._all: List[_Worker] = []
+        self.busy = 0
+        self.waiting = 0
+        self.info_ttl = info_ttl
+        self.info_cache_size = max(0, info_cache_size)
+        self._info: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._extracting: Dict[str, asyncio.Future] = {}
+        self.stats = {"requests": 0, "failed": 0, "killed": 0, "wait_s": 0.0, "run_s": 0.0, "info_hits": 0, "info_misses": 0}
+
+    def _pool(self) -> asyncio.Queue:
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            self._all = [_Worker(n) for n in range(self.workers)]
+            for w in self._all:
+                self._idle.put_nowait(w)
+        return self._idle
+
+    async def run(
+        self,
+        url: str,
+        opts: Dict[str, Any],
+        download: bool = True,
+        on_progress: Optional[Callable[[Dict[str, Any]], Awaitable[Any]]] = None,
+        timeout: Optional[float] = None,
+        info: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """
+        `extract_info(url, download)` in a child with `opts` (plain values
+        only); returns the sanitized info dict. Given `info`, the child
+        processes that extracted result instead of extracting `url` again.
+        """
+        pool = self._pool()
+        queued_at = time.monotonic()
+        self.waiting += 1
+        try:
+            w: _Worker = await pool.get()
+        finally:
+            self.waiting -= 1
+        started = time.monotonic()
+        self.stats["wait_s"] += started - queued_at
+        self.stats["requests"] += 1
+        self.busy += 1
+        answered = False
+        try:
+            await w.ensure()
+            req = {"url": url, "opts": opts, "download": download, "info": info}
+            w.proc.stdin.write(json.dumps(req).encode() + b"\n")
+            await w.proc.stdin.drain()
+            kind, result = await asyncio.wait_for(self._read(w, on_progress), timeout=timeout or self.timeout)
+            answered = True
+            w.served += 1
+            if kind == "error":
+                self.stats["failed"] += 1
+                raise YtdlError(result or "yt-dlp failed")
+            return result
+        except asyncio.TimeoutError:
+            raise YtdlError(f"yt-dlp timed out after {timeout or self.timeout:g}s")
+        except (BrokenPipeError, ConnectionResetError):
+            raise YtdlError("yt-dlp worker exited")
+        finally:
+            if not answered:
+                self.stats["failed"] += 1
+                if w.alive():
+                    # mid-request: the only way to stop yt-dlp is to stop its process
+                    self.stats["killed"] += 1
+                    await w.kill()
+            self.stats["run_s"] += time.monotonic() - started
+            self.busy -= 1
+            pool.put_nowait(w)
+
+    # ------------------------------------------------------------------
+    # single-pass extract -> download
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _info_key(url: str, tag: str) -> str:
+        # `tag` names the cookies: a logged-in extraction is not shared with an anonymous one
+        return f"{tag}|{normalize_url(url)}"
+
+    async def extract(self, url: str, opts: Dict[str, Any], tag: str = "") -> Tuple[Dict[str, Any], bool]:
+        """The info dict for `url` without downloading; returns (info, came_from_cache)."""
+        key = self._info_key(url, tag)
+        hit = self._info.get(key)
+        if hit is not None:
+            if hit[0] > time.monotonic():
+                self._info.move_to_end(key)
+                self.stats["info_hits"] += 1
+                return hit[1], True
+            self._info.pop(key, None)
+
+        # concurrent asks for the same link share one extraction
+        pending = self._extracting.get(key)
+        if pending is not None:
+            self.stats["info_hits"] += 1
+            return await asyncio.shield(pending), True
+
+        self.stats["info_misses"] += 1
+        fut = asyncio.get_running_loop().create_future()
+        self._extracting[key] = fut
+        try:
+            info = await self.run(url, opts, download=False)
+            if self.info_cache_size and self.info_ttl > 0:
+                self._info[key] = (time.monotonic() + self.info_ttl, info)
+                while len(self._info) > self.info_cache_size:
+                    self._info.popitem(last=False)
+            fut.set_result(info)
+            return info, False
+        except BaseException as e:
+            fut.set_exception(e if isinstance(e, Exception) else YtdlError("extraction cancelled"))
+            fut.exception()  # retrieved: no warning when nobody else was waiting
+            raise
+        finally:
+            self._extracting.pop(key, None)
+
+    def forget(self, url: str, tag: str = "") -> None:
+        self._info.pop(self._info_key(url, tag), None)
+
+    async def download(
+        self,
+        info: Dict[str, Any],
+        opts: Dict[str, Any],
+        on_progress: Optional[Callable[[Dict[str, Any]], Awaitable[Any]]] = None,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """Downloads what an `extract` result points at, with `opts`' format and output template."""
+        return await self.run(info.get("webpage_url") or info.get("original_url") or "", opts, True, on_progress, timeout, info=info)
+
+    async def _read(self, w: _Worker, on_progress) -> Tuple[str, Any]:
+        while True:
+            line = await w.proc.stdout.readline()
+            if not line:
+                await w.kill()
+                raise YtdlError("yt-dlp worker exited")
+            msg = json.loads(line)
+            kind = msg.get("type")
+            if kind == "progress":
+                if on_progress:
+                    try:
+                        await on_progress(msg)
+                    except Exception:
+                        pass
+            elif kind == "done":
+                return kind, msg["info"]
+            elif kind == "error":
+                return kind, msg.get("error")
+
+    def snapshot(self) -> Dict[str, Any]:
+        n = self.stats["requests"]
+        return {
+            "workers": self.workers,
+            "busy": self.busy,
+            "queued": self.waiting,
+            "started": sum(1 for w in self._all if w.alive()),
+            "requests": n,
+            "failed": self.stats["failed"],
+            "killed": self.stats["killed"],
+            "avg_wait_ms": round(1000 * self.stats["wait_s"] / n) if n else 0,
+            "avg_run_ms": round(1000 * self.stats["run_s"] / n) if n else 0,
+            "info_cached": len(self._info),
+            "info_hits": self.stats["info_hits"],
+            "info_misses": self.stats["info_misses"],
+        }
+
+
+YTDL_POOL = YtdlPool()
+
+
+# ----------------------------------------------------------------------
+# child process
+# ----------------------------------------------------------------------
+def _serve() -> None:
+    import yt_dlp
+
+    # yt-dlp prints to stdout; keep the real stdout for our messages only
+    out = os.fdopen(os.dup(1), "w", buffering=1)
+    os.dup2(2, 1)
+
+    def send(msg: Dict[str, Any]) -> None:
+        out.write(json.dumps(msg, default=str) + "\n")
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        req = json.loads(line)
+        last = [0.0]
+
+        def hook(d: Dict[str, Any]) -> None:
+            now = time.monotonic()
+            if d.get("status") == "downloading" and now - last[0] < PROGRESS_EVERY:
+                return
+            last[0] = now
+            send({
+                "type": "progress",
+                "status": d.get("status"),
+                "downloaded": d.get("downloaded_bytes") or 0,
+                "total": d.get("total_bytes") or d.get("total_bytes_estimate") or 0,
+                "speed": d.get("speed") or 0,
+                "eta": d.get("eta") or 0,
+            })
+
+        try:
+            with yt_dlp.YoutubeDL({**req["opts"], "progress_hooks": [hook]}) as ydl:
+                if req.get("info"):
+                    # what --load-info-json does: pick formats and download, no page fetch
+                    info = ydl.process_ie_result(req["info"], download=req["download"])
+                else:
+                    info = ydl.extract_info(req["url"], download=req["download"])
+                send({"type": "done", "info": ydl.sanitize_info(info)})
+        except BaseException as e:
+            send({"type": "error", "error": f"{type(e).__name__}: {e}"})
+            if isinstance(e, KeyboardInterrupt):
+                return
+
+
+if __name__ == "__main__":
+    _serve()